@@ -1,5 +1,5 @@
 #!/bin/bash
 
 cd /heat2dot
+# HEAT2DOT_ASYNC=1 selects the asyncio server
 python3 ./heat2dot_server.py
-
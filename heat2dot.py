@@ -1,517 +1,1673 @@
 #!/usr/bin/python3
-# Reads json or yaml from stdin
+# Reads json or yaml from stdin or a file
 # Interprets structure as heat template
 # Generates dot graph from heat template
 
 # Dependencies:
-# * PyYaml
+# * PyYaml (uses libyaml if available)
 
+# Library usage:
+#   import heat2dot
+#   result = heat2dot.convert(text)   # text or already parsed template
+#   if result.success:
+#       print(result.dot)
+#   print(result.messageText())
+#
+#   result = heat2dot.resolve(text)   # graph only, e.g. to stream the output
+#   heat2dot.writeDot(result.graph, sys.stdout)
+
+import os
 import sys
+import time
 import json
+import copy
+import argparse
+from array import array
+from collections import deque
 import yaml
+import heat2dot_select
+
+# libyaml based loader is much faster than the pure python one
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# format hint by file extension
+FORMAT_EXTENSIONS = {
+    ".json": "json",
+    ".yaml": "yaml",
+    ".yml": "yaml",
+}
 
 def eprint(*args, **kwargs):
     print(*args, file=sys.stderr, **kwargs)
 
-class Server:
-    def __init__(self, idx,longName=None, shortName=None):
-        self.idx = idx
-        self.longName = longName
-        self.shortName = shortName
-        self.portIdx = []
-        self.broken = False
+# node type codes, index into Graph.nodes and TYPE_REGISTRY
+SERVER = 0
+PORT = 1
+NET = 2
+SUBNET = 3
+ROUTER = 4
+ROUTERINTERFACE = 5
+FLOATINGIP = 6
+SECURITYGROUP = 7
+VOLUME = 8
+VOLUMEATTACHMENT = 9
+POOL = 10
+POOLMEMBER = 11
+NODE_TYPE_COUNT = 12
 
-class Port:
-    def __init__(self, idx, longName=None, shortName=None):
-        self.idx = idx
-        self.longName = longName
-        self.shortName = shortName
-        self.broken = False
+# diagnostic codes
+MISSING_PROPERTY = "missing-property"
+MISSING_GET_RESOURCE = "missing-get-resource"
+UNRESOLVED_REFERENCE = "unresolved-reference"
+UNEXPECTED_NAME = "unexpected-name"
+UNKNOWN_TYPE = "unknown-type"
+RESERVED_ATTRIBUTE = "reserved-attribute"
+UNRESOLVED_TEMPLATE = "unresolved-template"
+TEMPLATE_CYCLE = "template-cycle"
+INVALID_GROUP = "invalid-group"
 
-    def dot(self):
-        if self.broken:
-            return "port"+str(self.idx)+" [style=filled,fillcolor=red,shape=ellipse,label=\""+str(self.shortName)+"\"];"
-        else:
-            return "port"+str(self.idx)+" [style=filled,fillcolor=white,shape=ellipse,label=\""+str(self.shortName)+"\"];"
+# diagnostics kept per code, further ones are only counted
+DIAGNOSTIC_LIMIT = 100
 
-class Net:
-    def __init__(self, idx, longName=None, shortName=None):
-        self.idx = idx
-        self.longName = longName
-        self.shortName = shortName
-        self.broken = False
+# reference arrays of nodes are only created for the first reference
+NO_REFERENCES = ()
 
-    def dot(self):
-        if self.broken:
-            return "net"+str(self.idx)+" [shape=box,style=filled,fillcolor=red,label=\""+str(self.shortName)+"\"];"
-        else:
-            return "net"+str(self.idx)+" [shape=box,style=filled,fillcolor=lawngreen,label=\""+str(self.shortName)+"\"];"
+# common part of all graph nodes
+# key is the heat resource key
+class Node:
+    __slots__ = ("idx", "key", "longName", "shortName", "broken")
+    DOT = None
+    DOT_BROKEN = None
 
-class Subnet:
-    def __init__(self, idx, longName=None, shortName=None):
+    def __init__(self, idx, longName=None, shortName=None, key=None):
         self.idx = idx
+        self.key = key
         self.longName = longName
         self.shortName = shortName
         self.broken = False
-    def dot(self):
-        if self.broken:
-            return "subnet"+str(self.idx)+" [shape=octagon,style=filled,fillcolor=red,label=\""+str(self.shortName)+"\"];"
-        else:
-            return "subnet"+str(self.idx)+" [shape=octagon,label=\""+str(self.shortName)+"\"];"
 
-class Router:
-    def __init__(self, idx, longName=None, shortName=None):
-        self.idx = idx
-        self.longName = longName
-        self.shortName = shortName
-        self.broken = False
-    def dot(self):
+    # label defaults to the short name
+    def dot(self, label=None):
+        if label == None:
+            label = self.shortName
         if self.broken:
-            return "router"+str(self.idx)+" [style=filled,fillcolor=red,shape=diamond,label=\""+str(self.shortName)+"\"];"
+            return self.DOT_BROKEN % (self.idx, label)
         else:
-            return "router"+str(self.idx)+" [style=filled,fillcolor=lightpink1,shape=diamond,label=\""+str(self.shortName)+"\"];"
+            return self.DOT % (self.idx, label)
 
-class RouterInterface:
-    def __init__(self, idx, longName=None, shortName=None):
-        self.idx = idx
-        self.longName = longName
-        self.shortName = shortName
+class Server(Node):
+    __slots__ = ("portIdx",)
+    TYPE = SERVER
+    DOT_BEGIN = "subgraph cluster_server%s {\nlabel=\"%s\";\nfillcolor=lightblue1;\nstyle=filled;"
+    DOT_END = "}"
+    # server drawn as a single node in reduced levels of detail
+    DOT = "server%s [shape=box,style=\"filled,rounded\",fillcolor=lightblue1,label=\"%s\"];"
+    DOT_BROKEN = "server%s [shape=box,style=\"filled,rounded\",fillcolor=red,label=\"%s\"];"
+
+    def __init__(self, idx, longName=None, shortName=None, key=None):
+        Node.__init__(self, idx, longName, shortName, key)
+        self.portIdx = array("l")
+
+class Port(Node):
+    __slots__ = ("netIdx", "subnetIdx", "securityGroupIdx")
+    TYPE = PORT
+    DOT = "port%s [style=filled,fillcolor=white,shape=ellipse,label=\"%s\"];"
+    DOT_BROKEN = "port%s [style=filled,fillcolor=red,shape=ellipse,label=\"%s\"];"
+
+    def __init__(self, idx, longName=None, shortName=None, key=None):
+        Node.__init__(self, idx, longName, shortName, key)
+        self.netIdx = None
+        self.subnetIdx = NO_REFERENCES
+        self.securityGroupIdx = NO_REFERENCES
+
+class Net(Node):
+    __slots__ = ()
+    TYPE = NET
+    DOT = "net%s [shape=box,style=filled,fillcolor=lawngreen,label=\"%s\"];"
+    DOT_BROKEN = "net%s [shape=box,style=filled,fillcolor=red,label=\"%s\"];"
+
+class Subnet(Node):
+    __slots__ = ("cidr", "gatewayIp", "netIdx")
+    TYPE = SUBNET
+    DOT = "subnet%s [shape=octagon,label=\"%s\"];"
+    DOT_BROKEN = "subnet%s [shape=octagon,style=filled,fillcolor=red,label=\"%s\"];"
+
+    def __init__(self, idx, longName=None, shortName=None, key=None):
+        Node.__init__(self, idx, longName, shortName, key)
+        self.cidr = None
+        self.gatewayIp = None
+        self.netIdx = None
+
+class Router(Node):
+    __slots__ = ()
+    TYPE = ROUTER
+    DOT = "router%s [style=filled,fillcolor=lightpink1,shape=diamond,label=\"%s\"];"
+    DOT_BROKEN = "router%s [style=filled,fillcolor=red,shape=diamond,label=\"%s\"];"
+
+class RouterInterface(Node):
+    __slots__ = ("routerIdx", "subnetIdx")
+    TYPE = ROUTERINTERFACE
+    DOT = "routerInterface%s [shape=triangle,label=\"%s\"];"
+    DOT_BROKEN = "routerInterface%s [shape=triangle,style=filled,fillcolor=red,label=\"%s\"];"
+
+    def __init__(self, idx, longName=None, shortName=None, key=None):
+        Node.__init__(self, idx, longName, shortName, key)
         self.routerIdx = None
         self.subnetIdx = None
-        self.broken = False
-    def dot(self):
-        if self.broken:
-            return "routerInterface"+str(self.idx)+" [shape=triangle,style=filled,fillcolor=red,label=\""+str(self.shortName)+"\"];"
-        else:
-            return "routerInterface"+str(self.idx)+" [shape=triangle,label=\""+str(self.shortName)+"\"];"
 
-class FloatingIP:
-    def __init__(self, idx, longName=None, shortName=None):
-        self.idx = idx
-        self.longName = longName
-        self.shortName = shortName
-        self.broken = False
-    def dot(self):
-        if self.broken:
-            return "floating"+str(self.idx)+" [shape=egg,style=filled,fillcolor=red,label=\""+str(self.shortName)+"\"];"
-        else:
-            return "floating"+str(self.idx)+" [shape=egg,label=\""+str(self.shortName)+"\"];"
-
-def findPortIdxByName(ports,name):
-    for idx,port in enumerate(ports):
-        if port["properties"]["name"]==name:
-            return idx
-
-def findNetIdxByName(nets,name):
-    for idx,net in enumerate(nets):
-        if net["properties"]["name"]==name:
-            return idx
-
-def findSubnetIdxByName(subnets,name):
-    for idx,subnet in enumerate(subnets):
-        if subnet["properties"]["name"]==name:
-            return idx
-
-def findRouterIdxByName(routers,name):
-    for idx,router in enumerate(routers):
-        if router["properties"]["name"]==name:
-            return idx
-
-##### START PROGRAM #####
-
-# read from stdin
-text = ""
-for line in sys.stdin:
-    text += line
-
-jsonFile = True
-yamlFile = True
-
-try:
-    textobj = json.loads(text)
-except Exception as e:
-    eprint("JSON parse failure")
-    eprint(e)
-    jsonFile = False
-
-if jsonFile == False:
+class FloatingIP(Node):
+    __slots__ = ("portIdx",)
+    TYPE = FLOATINGIP
+    DOT = "floating%s [shape=egg,label=\"%s\"];"
+    DOT_BROKEN = "floating%s [shape=egg,style=filled,fillcolor=red,label=\"%s\"];"
+
+    def __init__(self, idx, longName=None, shortName=None, key=None):
+        Node.__init__(self, idx, longName, shortName, key)
+        self.portIdx = None
+
+class SecurityGroup(Node):
+    __slots__ = ()
+    TYPE = SECURITYGROUP
+    DOT = "securityGroup%s [shape=house,style=filled,fillcolor=khaki1,label=\"%s\"];"
+    DOT_BROKEN = "securityGroup%s [shape=house,style=filled,fillcolor=red,label=\"%s\"];"
+
+class Volume(Node):
+    __slots__ = ()
+    TYPE = VOLUME
+    DOT = "volume%s [shape=cylinder,style=filled,fillcolor=lightgrey,label=\"%s\"];"
+    DOT_BROKEN = "volume%s [shape=cylinder,style=filled,fillcolor=red,label=\"%s\"];"
+
+# drawn inside the cluster of its server like a port
+class VolumeAttachment(Node):
+    __slots__ = ("serverIdx", "volumeIdx")
+    TYPE = VOLUMEATTACHMENT
+    DOT = "volumeAttachment%s [shape=invhouse,style=filled,fillcolor=white,label=\"%s\"];"
+    DOT_BROKEN = "volumeAttachment%s [shape=invhouse,style=filled,fillcolor=red,label=\"%s\"];"
+
+    def __init__(self, idx, longName=None, shortName=None, key=None):
+        Node.__init__(self, idx, longName, shortName, key)
+        self.serverIdx = None
+        self.volumeIdx = None
+
+class Pool(Node):
+    __slots__ = ()
+    TYPE = POOL
+    DOT = "pool%s [shape=hexagon,style=filled,fillcolor=orange,label=\"%s\"];"
+    DOT_BROKEN = "pool%s [shape=hexagon,style=filled,fillcolor=red,label=\"%s\"];"
+
+class PoolMember(Node):
+    __slots__ = ("poolIdx", "subnetIdx")
+    TYPE = POOLMEMBER
+    DOT = "poolMember%s [shape=ellipse,style=filled,fillcolor=moccasin,label=\"%s\"];"
+    DOT_BROKEN = "poolMember%s [shape=ellipse,style=filled,fillcolor=red,label=\"%s\"];"
+
+    def __init__(self, idx, longName=None, shortName=None, key=None):
+        Node.__init__(self, idx, longName, shortName, key)
+        self.poolIdx = None
+        self.subnetIdx = None
+
+# edge kind codes, index into EDGE_TYPES
+EDGE_PORT_NET = 0
+EDGE_SUBNET_NET = 1
+EDGE_SUBNET_ROUTERINTERFACE = 2
+EDGE_ROUTERINTERFACE_ROUTER = 3
+EDGE_PORT_FLOATING = 4
+EDGE_PORT_SUBNET = 5
+EDGE_PORT_SECURITYGROUP = 6
+EDGE_VOLUMEATTACHMENT_VOLUME = 7
+EDGE_POOLMEMBER_POOL = 8
+EDGE_POOLMEMBER_SUBNET = 9
+
+# node types connected by each edge kind and its dot template
+EDGE_TYPES = [
+    (PORT, NET, "port%s -- net%s;"),
+    (SUBNET, NET, "subnet%s -- net%s;"),
+    (SUBNET, ROUTERINTERFACE, "subnet%s -- routerInterface%s;"),
+    (ROUTERINTERFACE, ROUTER, "routerInterface%s -- router%s;"),
+    (PORT, FLOATINGIP, "port%s -- floating%s;"),
+    (PORT, SUBNET, "port%s -- subnet%s;"),
+    (PORT, SECURITYGROUP, "port%s -- securityGroup%s;"),
+    (VOLUMEATTACHMENT, VOLUME, "volumeAttachment%s -- volume%s;"),
+    (POOLMEMBER, POOL, "poolMember%s -- pool%s;"),
+    (POOLMEMBER, SUBNET, "poolMember%s -- subnet%s;"),
+]
+
+# edges of nodes drawn inside server clusters redirected to the server when
+# the clusters are collapsed, the cluster member is the first node of these kinds
+SERVER_EDGE_TEMPLATES = {
+    EDGE_PORT_NET: "server%s -- net%s;",
+    EDGE_PORT_FLOATING: "server%s -- floating%s;",
+    EDGE_PORT_SUBNET: "server%s -- subnet%s;",
+    EDGE_PORT_SECURITYGROUP: "server%s -- securityGroup%s;",
+    EDGE_VOLUMEATTACHMENT_VOLUME: "server%s -- volume%s;",
+}
+
+# resource type registry
+# every handled heat type declares how its node is labelled and which properties
+# it reads, buildGraph classifies, validates and resolves all resources with it
+# in one pass over the template, see readResource and resolveReferences
+# a new type needs a node class with its dot style, a type code and an entry here
+
+# label of a node from a property, prop None uses the resource key
+# parts is the number of ":"-separated parts kept as the short name, values with
+# fewer parts are reported and used in full, None keeps the whole value
+# a missing required property marks the node broken, otherwise the key is used
+class LabelRule:
+    def __init__(self, prop="name", parts=None, required=True):
+        self.prop = prop
+        self.parts = parts
+        self.required = required
+
+# a property copied to a node attribute
+class ValueField:
+    targetType = None
+
+    def __init__(self, prop, attribute, required=True):
+        self.prop = prop
+        self.attribute = attribute
+        self.required = required
+
+# a get_resource reference to a node of targetType, stored as its index in attribute
+# many: the property is a list and attribute an array of indexes, item is the key
+#   of the reference in each list entry or None if the entries are references
+# edge: edge kind drawn for the reference, None for references to and from server
+#   clusters, which are drawn by nesting the nodes instead
+# required: a missing reference marks the node broken, optional references that
+#   are no get_resource (e.g. ids of existing resources) are ignored
+# labelInMessage adds the label of the node to the message of unresolved references
+class ReferenceField:
+    def __init__(self, prop, attribute, targetType, edge=None, required=True, many=False, item=None, labelInMessage=False):
+        self.prop = prop
+        self.attribute = attribute
+        self.targetType = targetType
+        self.edge = edge
+        self.required = required
+        self.many = many
+        self.item = item
+        self.labelInMessage = labelInMessage
+        self.name = prop if item == None else prop+"."+item
+
+# a handled heat resource type
+# defaultName and the node index name nodes without label
+# countLabel is the line of the resource counts log
+# legend is the legend label of types that are only listed in the legend if drawn
+class ResourceType:
+    def __init__(self, code, heatType, nodeClass, defaultName, countLabel, label=None, fields=(), legend=None):
+        self.code = code
+        self.heatType = heatType
+        self.nodeClass = nodeClass
+        self.defaultName = defaultName
+        self.countLabel = countLabel
+        self.label = label
+        self.fields = list(fields)
+        self.legend = legend
+        # name of the type in messages about references to it
+        self.refName = heatType.split("::")[-1]
+        self.references = [field for field in self.fields if isinstance(field, ReferenceField)]
+        # edges are added in edge kind order
+        self.edgeFields = sorted([field for field in self.references if field.edge != None], key=lambda field: field.edge)
+        # a resource without properties is only broken if it needs some
+        self.needsProperties = any(field.required for field in self.fields) or (label != None and label.prop != None and label.required)
+
+TYPE_REGISTRY = [
+    ResourceType(SERVER, "OS::Nova::Server", Server, "server", "Servers: \t\t", LabelRule("name", 1), [
+        ReferenceField("networks", "portIdx", PORT, many=True, item="port"),
+    ]),
+    ResourceType(PORT, "OS::Neutron::Port", Port, "port", "Ports: \t\t\t", LabelRule("name", 3), [
+        ReferenceField("network", "netIdx", NET, EDGE_PORT_NET, labelInMessage=True),
+        ReferenceField("fixed_ips", "subnetIdx", SUBNET, EDGE_PORT_SUBNET, required=False, many=True, item="subnet"),
+        ReferenceField("security_groups", "securityGroupIdx", SECURITYGROUP, EDGE_PORT_SECURITYGROUP, required=False, many=True),
+    ]),
+    ResourceType(NET, "OS::Neutron::Net", Net, "net", "Nets: \t\t\t", LabelRule("name", 2)),
+    ResourceType(SUBNET, "OS::Neutron::Subnet", Subnet, "subnet", "Subnets: \t\t", LabelRule("name", 2), [
+        ValueField("cidr", "cidr"),
+        ValueField("gateway_ip", "gatewayIp"),
+        ReferenceField("network", "netIdx", NET, EDGE_SUBNET_NET, labelInMessage=True),
+    ]),
+    ResourceType(ROUTER, "OS::Neutron::Router", Router, "router", "Routers: \t\t", LabelRule("name", 2)),
+    ResourceType(ROUTERINTERFACE, "OS::Neutron::RouterInterface", RouterInterface, "ri", "RouterInterfaces: \t", LabelRule(None, 3), [
+        ReferenceField("router", "routerIdx", ROUTER, EDGE_ROUTERINTERFACE_ROUTER),
+        ReferenceField("subnet", "subnetIdx", SUBNET, EDGE_SUBNET_ROUTERINTERFACE),
+    ]),
+    ResourceType(FLOATINGIP, "OS::Neutron::FloatingIP", FloatingIP, "fip", "FloatingIPs: \t\t", None, [
+        ReferenceField("port_id", "portIdx", PORT, EDGE_PORT_FLOATING),
+    ]),
+    ResourceType(SECURITYGROUP, "OS::Neutron::SecurityGroup", SecurityGroup, "sg", "SecurityGroups: \t",
+                 LabelRule("name", required=False), legend="security group"),
+    ResourceType(VOLUME, "OS::Cinder::Volume", Volume, "volume", "Volumes: \t\t",
+                 LabelRule("name", required=False), legend="volume"),
+    ResourceType(VOLUMEATTACHMENT, "OS::Cinder::VolumeAttachment", VolumeAttachment, "va", "VolumeAttachments: \t",
+                 LabelRule("mountpoint", required=False), [
+        ReferenceField("instance_uuid", "serverIdx", SERVER),
+        ReferenceField("volume_id", "volumeIdx", VOLUME, EDGE_VOLUMEATTACHMENT_VOLUME),
+    ], legend="volume attachment"),
+    ResourceType(POOL, "OS::Neutron::LBaaS::Pool", Pool, "pool", "Pools: \t\t\t",
+                 LabelRule("name", required=False), legend="pool"),
+    ResourceType(POOLMEMBER, "OS::Neutron::LBaaS::PoolMember", PoolMember, "member", "PoolMembers: \t\t",
+                 LabelRule("address", required=False), [
+        ReferenceField("pool", "poolIdx", POOL, EDGE_POOLMEMBER_POOL),
+        ReferenceField("subnet", "subnetIdx", SUBNET, EDGE_POOLMEMBER_SUBNET, required=False),
+    ], legend="pool member"),
+]
+
+# heat resource types handled by the converter
+RESOURCE_TYPES = {}
+for resourceType in TYPE_REGISTRY:
+    RESOURCE_TYPES[resourceType.heatType] = resourceType.code
+
+# heat resource type per node type code
+TYPE_NAMES = [resourceType.heatType for resourceType in TYPE_REGISTRY]
+
+# node types that can be the target of a get_resource reference
+REFERENCED_TYPES = tuple(sorted(set(field.targetType for resourceType in TYPE_REGISTRY for field in resourceType.references)))
+
+# reference attributes of each node type as (attribute, target type, many)
+REFERENCE_FIELDS = [[(field.attribute, field.targetType, field.many) for field in resourceType.references] for resourceType in TYPE_REGISTRY]
+
+# nodes drawn inside the cluster of the server they refer to, as (type code, reference field)
+# the ports of a cluster are listed by the server itself
+CLUSTER_MEMBER_FIELDS = [(resourceType.code, field) for resourceType in TYPE_REGISTRY for field in resourceType.references
+                         if field.targetType == SERVER and field.edge == None]
+CLUSTER_ATTRIBUTES = dict((typeCode, field.attribute) for typeCode,field in CLUSTER_MEMBER_FIELDS)
+CLUSTER_TYPES = (PORT,)+tuple(typeCode for typeCode,field in CLUSTER_MEMBER_FIELDS)
+
+# parts of a template the converter reads, see heat2dot_select
+# the type of a resource may follow its properties, so the properties
+# read by any of the handled types are selected for every resource
+# groups and nested stacks additionally need their size, member definition,
+# template and parameters, see heat2dot_nested
+GROUP_PROPERTIES = ["count", "index_var", "desired_capacity", "min_size", "template", "parameters"]
+SELECTED_PROPERTIES = ["name"]
+for resourceType in TYPE_REGISTRY:
+    if resourceType.label != None and resourceType.label.prop != None:
+        SELECTED_PROPERTIES.append(resourceType.label.prop)
+    SELECTED_PROPERTIES.extend(field.prop for field in resourceType.fields)
+SELECTED_PROPERTIES = sorted(set(SELECTED_PROPERTIES+GROUP_PROPERTIES))
+PROPERTY_SELECTION = dict.fromkeys(SELECTED_PROPERTIES, True)
+MEMBER_SELECTION = {"type": True, "properties": PROPERTY_SELECTION}
+PROPERTY_SELECTION["resource_def"] = MEMBER_SELECTION
+PROPERTY_SELECTION["resource"] = MEMBER_SELECTION
+RESOURCE_SELECTION = {"type": True, "resourceName": True, "properties": PROPERTY_SELECTION}
+TEMPLATE_SELECTION = {"heat_template_version": True, "parameters": {None: {"default": True}}, "resources": {None: RESOURCE_SELECTION}}
+
+def findIdxByName(index,name):
+    if not isinstance(name, str):
+        return None
+    return index.get(name)
+
+# problems found in single resources
+# every report is counted per code and per (code, type, field), the record
+# and its message are only kept for the first limit reports of each code
+# limit None keeps everything
+class Diagnostics:
+    def __init__(self, limit=DIAGNOSTIC_LIMIT):
+        self.limit = limit
+        self.records = []
+        self.counts = {}
+        self.groups = {}
+
+    # typeCode is a node type code or None, the message is made of args like print() does
+    # returns the message if the record is kept, otherwise None
+    def report(self, code, typeCode, key, field, *args):
+        count = self.counts.get(code, 0)+1
+        self.counts[code] = count
+        group = (code, typeCode, field)
+        self.groups[group] = self.groups.get(group, 0)+1
+        if self.limit != None and count > self.limit:
+            return None
+        message = " ".join(str(arg) for arg in args)
+        self.records.append({"code": code, "type": TYPE_NAMES[typeCode] if typeCode != None else None,
+                             "key": key, "field": field, "message": message})
+        return message
+
+    def total(self):
+        return sum(self.counts.values())
+
+    def omitted(self):
+        return self.total()-len(self.records)
+
+    # one line per (code, type, field), most frequent first
+    def summaryLines(self):
+        lines = ["Diagnostics: %d (%d omitted)" % (self.total(), self.omitted())]
+        for group,count in sorted(self.groups.items(), key=lambda item: -item[1]):
+            code, typeCode, field = group
+            lines.append("%s %s %s: \t%d" % (code, TYPE_NAMES[typeCode] if typeCode != None else "-", field, count))
+        return lines
+
+    # counts and kept records as a json serializable dict
+    def stats(self):
+        groups = []
+        for group,count in self.groups.items():
+            code, typeCode, field = group
+            groups.append({"code": code, "type": TYPE_NAMES[typeCode] if typeCode != None else None, "field": field, "count": count})
+        return {
+            "total": self.total(),
+            "omitted": self.omitted(),
+            "limit": self.limit,
+            "counts": dict(self.counts),
+            "groups": groups,
+            "records": self.records,
+        }
+
+# result of a conversion
+# dot is None if the conversion failed or was written to a stream
+# detail is the level of detail of the dot text
+# timings holds the seconds spent per pipeline stage
+# diagnostics holds the problems found in single resources, see Diagnostics
+class DotResult:
+    def __init__(self, diagnosticLimit=DIAGNOSTIC_LIMIT):
+        self.success = False
+        self.format = None
+        self.dot = None
+        self.graph = None
+        self.detail = None
+        self.counts = {}
+        self.messages = []
+        self.timings = {}
+        self.inputBytes = None
+        self.diagnostics = Diagnostics(diagnosticLimit)
+
+    # collect a message, arguments are joined like print() does
+    def log(self, *args):
+        self.messages.append(" ".join(str(arg) for arg in args))
+
+    # collect a diagnostic, its message is only added while below the limit
+    def report(self, code, typeCode, key, field, *args):
+        message = self.diagnostics.report(code, typeCode, key, field, *args)
+        if message != None:
+            self.messages.append(message)
+
+    # log the diagnostics summary if diagnostics were omitted
+    def logOmitted(self):
+        if self.diagnostics.omitted() > 0:
+            self.log("------")
+            for line in self.diagnostics.summaryLines():
+                self.log(line)
+
+    def messageText(self):
+        return "\n".join(self.messages)
+
+    # sizes, counts and stage timings as a json serializable dict
+    def metrics(self):
+        metrics = {
+            "success": self.success,
+            "format": self.format,
+            "detail": self.detail,
+            "inputBytes": self.inputBytes,
+            "resources": self.counts,
+            "messages": len(self.messages),
+            "diagnostics": self.diagnostics.counts,
+            "timings": self.timings,
+        }
+        if self.graph != None:
+            metrics["nodes"] = self.graph.nodeCount()
+            metrics["edges"] = self.graph.edgeCount()
+        return metrics
+
+# resolved graph
+# nodes holds one list per node type code
+# edges are stored column-wise, one entry per edge in the three arrays
+class Graph:
+    __slots__ = ("nodes", "edgeKinds", "edgeFrom", "edgeTo")
+
+    def __init__(self):
+        self.nodes = [[] for typeCode in range(NODE_TYPE_COUNT)]
+        self.edgeKinds = array("B")
+        self.edgeFrom = array("l")
+        self.edgeTo = array("l")
+
+    # add an edge, skipped if one end could not be resolved
+    def addEdge(self, kind, fromIdx, toIdx):
+        if fromIdx == None or toIdx == None:
+            return
+        self.edgeKinds.append(kind)
+        self.edgeFrom.append(fromIdx)
+        self.edgeTo.append(toIdx)
+
+    def edgeCount(self):
+        return len(self.edgeKinds)
+
+    def nodeCount(self):
+        return sum(len(nodes) for nodes in self.nodes)
+
+    @property
+    def servers(self):
+        return self.nodes[SERVER]
+
+    @property
+    def ports(self):
+        return self.nodes[PORT]
+
+    @property
+    def nets(self):
+        return self.nodes[NET]
+
+    @property
+    def subnets(self):
+        return self.nodes[SUBNET]
+
+    @property
+    def routers(self):
+        return self.nodes[ROUTER]
+
+    @property
+    def routerInterfaces(self):
+        return self.nodes[ROUTERINTERFACE]
+
+    @property
+    def floatings(self):
+        return self.nodes[FLOATINGIP]
+
+# guess the template format from the first non-whitespace character
+# json documents start with { or [, everything else is left to yaml
+def sniffFormat(text):
+    head = text[:1024]
+    if isinstance(head, bytes):
+        head = head.decode("UTF-8", "ignore")
+    head = head.lstrip("\ufeff \t\r\n")
+    if head[:1] in ("{", "["):
+        return "json"
+    return "yaml"
+
+# read a template file in one go
+# returns the content as bytes and the format hint from the file extension
+def readTemplate(path):
+    with open(path, "rb") as templateFile:
+        text = templateFile.read()
+    extension = os.path.splitext(path)[1].lower()
+    return text, FORMAT_EXTENSIONS.get(extension)
+
+# parse json or yaml text (str or bytes)
+# the json parser is only tried if the format hint or the content suggests json
+# selective only builds the parts of the template the converter reads
+# returns the parsed object or None
+def parseTemplate(text, result, formatHint=None, selective=True):
+    start = time.perf_counter()
+    result.inputBytes = len(text)
+    textobj = loadTemplate(text, result, formatHint, selective)
+    result.timings["parse"] = time.perf_counter()-start
+    return textobj
+
+def loadTemplate(text, result, formatHint, selective):
+    log = result.log
+    if formatHint == None:
+        formatHint = sniffFormat(text)
+
+    # only the parts in TEMPLATE_SELECTION are built, whatever the selective
+    # parsers cannot handle is parsed again in full, also for the error messages
+    if selective:
+        try:
+            if formatHint == "json":
+                textobj = heat2dot_select.loadJson(text, TEMPLATE_SELECTION)
+                log("Parsed as JSON")
+            else:
+                textobj = heat2dot_select.loadYaml(text, TEMPLATE_SELECTION, YamlLoader)
+                log("Parsed as YAML")
+            result.format = formatHint
+            return textobj
+        except heat2dot_select.SelectionError:
+            pass
+
+    if formatHint == "json":
+        try:
+            textobj = json.loads(text)
+            result.format = "json"
+            log("Parsed as JSON")
+            return textobj
+        except Exception as e:
+            log("JSON parse failure")
+            log(e)
+
+    # json is a subset of yaml, so yaml is the fallback for every input
     try:
-        textobj = yaml.load(text)
+        textobj = yaml.load(text, Loader=YamlLoader)
+        result.format = "yaml"
+        log("Parsed as YAML")
+        return textobj
     except Exception as e:
-        eprint("YAML parse failure")
-        eprint(e)
-        yamlFile = False
-else:
-    yamlFile = False
-
-if jsonFile == False and yamlFile == False:
-    eprint("Parsing unsuccessful")
-    exit(1)
-
-if jsonFile == True:
-    eprint("Parsed as JSON")
-
-if yamlFile == True:
-    eprint("Parsed as YAML")
-
-if "heat_template_version" in textobj:
-    eprint("heat_template_version",textobj["heat_template_version"])
-
-if not "resources" in textobj:
-    eprint("Failed to find resources array")
-    exit(1)
-
-# sort resources according to resource type
-
-resources = textobj["resources"]
-servers = []
-ports = []
-nets = []
-subnets = []
-routers = []
-routerinterfaces = []
-floatings = []
-withouttype = 0
-others = {}
-
-for resourceName in resources:
-    obj = resources[resourceName]
+        log("YAML parse failure")
+        log(e)
+
+    log("Parsing unsuccessful")
+    return None
+
+# type code of a resource, None for entries without type and unknown types
+# problems with the type are reported
+def classifyResource(key, obj, report):
+    if not isinstance(obj, dict):
+        return None
     if "resourceName" in obj:
-        eprint("Did not expect that resourceName is a resource attribute.")
-    obj["resourceName"] = resourceName
+        report(RESERVED_ATTRIBUTE,None,str(key),"resourceName","Did not expect that resourceName is a resource attribute.")
     if "type" not in obj:
-        withouttype += 1
-        continue
-    if obj["type"] == "OS::Nova::Server":
-        servers.append(obj)
-    elif obj["type"] == "OS::Neutron::Port":
-        ports.append(obj)
-    elif obj["type"] == "OS::Neutron::Net":
-        nets.append(obj)
-    elif obj["type"] == "OS::Neutron::Subnet":
-        subnets.append(obj)
-    elif obj["type"] == "OS::Neutron::Router":
-        routers.append(obj)
-    elif obj["type"] == "OS::Neutron::RouterInterface":
-        routerinterfaces.append(obj)
-    elif obj["type"] == "OS::Neutron::FloatingIP":
-        floatings.append(obj)
-    else:
-        eprint("Unknown resource type",obj["type"])
-        others[obj.type] += 1
-
-eprint("------")
-eprint("Servers: \t\t",str(len(servers)))
-eprint("Ports: \t\t\t",str(len(ports)))
-eprint("Nets: \t\t\t",str(len(nets)))
-eprint("Subnets: \t\t",str(len(subnets)))
-eprint("Routers: \t\t",str(len(routers)))
-eprint("RouterInterfaces: \t",str(len(routerinterfaces)))
-eprint("FloatingIPs: \t\t",str(len(floatings)))
-
-if withouttype > 0:
-    eprint("------")
-    eprint("Without type: \t\t",str(withouttype))
+        return None
+    typeCode = RESOURCE_TYPES.get(obj["type"]) if isinstance(obj["type"], str) else None
+    if typeCode == None:
+        report(UNKNOWN_TYPE,None,str(key),"type","Unknown resource type",obj["type"])
+    return typeCode
 
-if len(others)>0:
-    eprint("------")
-    eprint("Unknown types:")
-    for typus in others:
-        eprint(typus+": \t\t",str(others[typus]))
-eprint("------")
-
-# create wrapper objects for known types
-
-dotServers = []
-dotPorts = []
-dotNets = []
-dotSubnets = []
-dotRouters = []
-dotRouterinterfaces = []
-dotFloatings = []
-
-# create graph objects
-for idx,jsonServer in enumerate(servers):
-    failure = False
-    server = Server(idx,longName="server"+str(idx),shortName="server"+str(idx))
-    # check available attributes
-    if "properties" not in jsonServer:
-        eprint("missing properties in OS::Nova::Server object",str(jsonServer["resourceName"]))
-        server.broken = True
-    else:
-        if "name" not in jsonServer["properties"]:
-            eprint("missing name in OS::Nova::Server object",str(jsonServer["resourceName"]))
-            server.broken = True
-        else:
-            server.longName = jsonServer["properties"]["name"]
-            server.shortName = jsonServer["properties"]["name"].split(":")[0]
+# resources of a template as (key, resource) pairs, None if there are none
+def templateResources(textobj, result):
+    log = result.log
+
+    if not isinstance(textobj, dict):
+        log("Template is not a mapping")
+        return None
+
+    if "heat_template_version" in textobj:
+        log("heat_template_version",textobj["heat_template_version"])
+
+    if not "resources" in textobj or not isinstance(textobj["resources"], dict):
+        log("Failed to find resources array")
+        return None
+    return textobj["resources"].items()
+
+# log the resource counts, resources without type and unknown types
+# others counts the resources per unknown type
+def logCounts(result, counts, withouttype, others):
+    log = result.log
+    result.counts = {}
+    for resourceType in TYPE_REGISTRY:
+        result.counts[resourceType.heatType] = counts[resourceType.code]
+
+    log("------")
+    for resourceType in TYPE_REGISTRY:
+        log(resourceType.countLabel,str(counts[resourceType.code]))
 
-        if "networks" not in jsonServer["properties"]:
-            eprint("missing networks in OS::Nova::Server object",str(jsonServer["resourceName"]))
-            server.broken = True
+    if withouttype > 0:
+        log("------")
+        log("Without type: \t\t",str(withouttype))
+
+    if len(others)>0:
+        log("------")
+        log("Unknown types:")
+        for typus in others:
+            log(str(typus)+": \t\t",str(others[typus]))
+    log("------")
+
+# names a resource can be referred to by, its key first and its properties.name if any
+def resourceNames(key, obj):
+    names = [key]
+    properties = obj.get("properties")
+    if isinstance(properties, dict) and isinstance(properties.get("name"), str):
+        names.append(properties["name"])
+    return names
+
+# label the node from the value of its label rule
+def setLabel(resourceType, node, key, value, report):
+    label = resourceType.label
+    if not isinstance(value, str):
+        # e.g. an intrinsic function, optional labels fall back to the key silently
+        if label.required:
+            report(UNEXPECTED_NAME,resourceType.code,key,label.prop,"Name of "+resourceType.heatType+" object is not a string",key+"\n  use resource key instead")
+        node.longName = key
+        node.shortName = key
+        return
+    node.longName = value
+    node.shortName = value
+    if label.parts == None:
+        return
+    parts = value.split(":", label.parts)
+    if len(parts) < label.parts:
+        if label.prop == None:
+            report(UNEXPECTED_NAME,resourceType.code,key,"resourceName","Unexpected resource name of "+resourceType.heatType+" object.",key+"\n  use long name: ",value)
         else:
-            networks = jsonServer["properties"]["networks"]
-            for net in networks:
-                if "port" not in net:
-                    eprint("missing port in networks in OS::Nova::Server object",str(jsonServer["resourceName"]))
-                    server.broken = True
-                elif "get_resource" not in net["port"]:
-                    eprint("missing get_resource in port in networks in OS::Nova::Server object",str(jsonServer["resourceName"]))
-                    server.broken = True
-                else:
-                    portIdx = findPortIdxByName(ports,net["port"]["get_resource"])
-                    if portIdx == None:
-                        eprint("Port",net["port"]["get_resource"],"for OS::Nova::Server object not found",str(jsonServer["resourceName"]))
-                        server.broken = True
-                    server.portIdx.append(portIdx)
-    dotServers.append(server)    
-
-for idx,jsonPort in enumerate(ports):
-    port = Port(idx,longName="port"+str(idx),shortName="port"+str(idx))
-    if "properties" not in jsonPort:
-        eprint("missing properties in OS::Neutron::Port object",str(jsonPort["resourceName"]))
-        port.broken = True
+            report(UNEXPECTED_NAME,resourceType.code,key,label.prop,"Name of "+resourceType.heatType+" object unexpected",key+"\n  use full name instead:",value)
     else:
-        if "name" not in jsonPort["properties"]:
-            eprint("missing name in OS::Neutron::Port object",str(jsonPort["resourceName"]))
-            port.broken = True
-        else:
-            port.longName = jsonPort["properties"]["name"]
-            port.shortName = jsonPort["properties"]["name"].split(":")
-            if len(port.shortName)<3:
-                eprint("Name of OS::Neutron::Port object unexpected",str(jsonPort["resourceName"]))
-                eprint("  use full name instead:",port.longName)
-                port.shortName = port.longName
-            else:
-                port.shortName = port.shortName[0]+":"+port.shortName[1]+":"+port.shortName[2]
-    
-        if "network" not in jsonPort["properties"]:
-            eprint("missing network in OS::Neutron::Port object",str(jsonPort["resourceName"]))
-            port.broken = True
-        elif "get_resource" not in jsonPort["properties"]["network"]:
-            eprint("missing get_resource in network in OS::Neutron::Port object",str(jsonPort["resourceName"]))
-            port.broken = True
+        node.shortName = ":".join(parts[:label.parts])
+
+# create the node for a resource of a registered type and check its properties
+# its get_resource references are appended to refs as node, field and name,
+# flat so no object is kept per reference, they are resolved once all
+# resources are known, see resolveReferences
+def readResource(resourceType, idx, key, obj, report, refs):
+    heatType = resourceType.heatType
+    typeCode = resourceType.code
+    name = resourceType.defaultName+str(idx)
+    node = resourceType.nodeClass(idx,longName=name,shortName=name,key=key)
+    key = str(key)
+    label = resourceType.label
+    if label != None and label.prop == None:
+        setLabel(resourceType, node, key, key, report)
+
+    properties = obj.get("properties")
+    if not isinstance(properties, dict):
+        if resourceType.needsProperties:
+            report(MISSING_PROPERTY,typeCode,key,"properties","missing properties in "+heatType+" object",key)
+            node.broken = True
+            return node
+        properties = {}
+
+    if label != None and label.prop != None:
+        if label.prop in properties:
+            setLabel(resourceType, node, key, properties[label.prop], report)
+        elif label.required:
+            report(MISSING_PROPERTY,typeCode,key,label.prop,"missing "+label.prop+" in "+heatType+" object",key)
+            node.broken = True
         else:
-            port.netIdx = findNetIdxByName(nets,jsonPort["properties"]["network"]["get_resource"])
-            if port.netIdx == None:
-                eprint("Net",jsonPort["properties"]["network"]["get_resource"],"for OS::Neutron::Port object",port.shortName,"not found",str(jsonPort["resourceName"]))
-                port.broken = True
-    dotPorts.append(port)
-
-for idx,jsonNet in enumerate(nets):
-    net = Net(idx,longName="net"+str(idx),shortName="net"+str(idx))
-    if "properties" not in jsonNet:
-        eprint("missing properties in OS::Neutron::Net object",str(jsonNet["resourceName"]))
-        net.broken = True
-    else:
-        if "name" not in jsonNet["properties"]:
-            eprint("missing name in OS::Neutron::Net object",str(jsonNet["resourceName"]))
-            net.broken = True
+            node.longName = key
+            node.shortName = key
+
+    for field in resourceType.fields:
+        prop = field.prop
+        if prop not in properties:
+            if field.required:
+                report(MISSING_PROPERTY,typeCode,key,prop,"missing "+prop+" in "+heatType+" object",key)
+                node.broken = True
+            continue
+        value = properties[prop]
+        if field.targetType == None:
+            setattr(node, field.attribute, value)
+        elif not field.many:
+            target = value.get("get_resource") if isinstance(value, dict) else None
+            if target != None:
+                refs.extend((node, field, target))
+            elif field.required:
+                reportGetResource(resourceType, node, key, field, report)
         else:
-            net.longName = jsonNet["properties"]["name"]
-            net.shortName =net.longName.split(":")
-            if len(net.shortName)<2:
-                eprint("Name of OS::Neutron::Net object unexpected",str(jsonNet["resourceName"]))
-                eprint("  use full name instead:",net.longName)
-                net.shortName = net.longName
+            item = field.item
+            for entry in (value if isinstance(value, list) else (value,)):
+                if item != None:
+                    if not isinstance(entry, dict) or item not in entry:
+                        if field.required:
+                            report(MISSING_PROPERTY,typeCode,key,field.name,"missing "+item+" in "+prop+" in "+heatType+" object",key)
+                            node.broken = True
+                        continue
+                    entry = entry[item]
+                target = entry.get("get_resource") if isinstance(entry, dict) else None
+                if target != None:
+                    refs.extend((node, field, target))
+                elif field.required:
+                    reportGetResource(resourceType, node, key, field, report)
+    return node
+
+def reportGetResource(resourceType, node, key, field, report):
+    where = field.prop if field.item == None else field.item+" in "+field.prop
+    report(MISSING_GET_RESOURCE,resourceType.code,key,field.name,"missing get_resource in "+where+" in "+resourceType.heatType+" object",key)
+    node.broken = True
+
+# resolve the references collected by readResource
+# indexes holds an index per referenced type code, see buildIndex
+def resolveReferences(refs, indexes, report):
+    for refIdx in range(0, len(refs), 3):
+        node, field, target = refs[refIdx:refIdx+3]
+        targetIdx = findIdxByName(indexes[field.targetType], target)
+        if targetIdx == None:
+            resourceType = TYPE_REGISTRY[node.TYPE]
+            key = str(node.key)
+            where = "for "+resourceType.heatType+" object"
+            if field.labelInMessage:
+                report(UNRESOLVED_REFERENCE,resourceType.code,key,field.name,TYPE_REGISTRY[field.targetType].refName,target,where,node.shortName,"not found",key)
             else:
-                net.shortName = net.shortName[0]+":"+net.shortName[1]
-    dotNets.append(net)
-
-for idx,jsonSubnet in enumerate(subnets):
-    subnet = Subnet(idx,longName="subnet"+str(idx),shortName="subnet"+str(idx))
-    if "properties" not in jsonSubnet:
-        eprint("missing properties in OS::Neutron::Subnet object",str(jsonSubnet["resourceName"]))
-        subnet.broken = True
-    else:
-        if "name" not in jsonSubnet["properties"]:
-            eprint("missing name in OS::Neutron::Subnet object",str(jsonSubnet["resourceName"]))
-            subnet.broken = True
+                report(UNRESOLVED_REFERENCE,resourceType.code,key,field.name,TYPE_REGISTRY[field.targetType].refName,target,where+" not found",key)
+            node.broken = True
+        elif field.many:
+            targets = getattr(node, field.attribute)
+            if not targets:
+                targets = array("l")
+                setattr(node, field.attribute, targets)
+            targets.append(targetIdx)
         else:
-            subnet.longName = jsonSubnet["properties"]["name"]
-            subnet.shortName = subnet.longName.split(":")
-            if len(subnet.shortName)<2:
-                eprint("Name of OS::Neutron::Subnet object unexpected",str(jsonSubnet["resourceName"]))
-                eprint("  use full name instead:",subnet.longName)
-                subnet.shortName = subnet.longName
+            setattr(node, field.attribute, targetIdx)
+
+# index of the resources of one type keyed by properties.name and by heat resource key
+# names maps properties.name and keys maps the keys to the position of the first
+# resource having them, names take precedence like a linear scan over names would
+def buildIndex(names, keys):
+    index = dict(keys)
+    index.update(names)
+    return index
+
+# create the graph of a template in one pass over its resources
+# every resource is classified, read into a node and its references are collected,
+# which are resolved against the names of all resources afterwards
+# returns None if the template has no resources
+def buildGraph(template, result):
+    report = result.report
+    resources = templateResources(template, result)
+    if resources == None:
+        return None
+
+    start = time.perf_counter()
+    graph = Graph()
+    counts = [0]*NODE_TYPE_COUNT
+    withouttype = 0
+    others = {}
+    names = [{} for typeCode in range(NODE_TYPE_COUNT)]
+    keys = [{} for typeCode in range(NODE_TYPE_COUNT)]
+    refs = []
+    for key,obj in resources:
+        typeCode = classifyResource(key, obj, report)
+        if typeCode == None:
+            if isinstance(obj, dict) and "type" in obj:
+                others[str(obj["type"])] = others.get(str(obj["type"]), 0) + 1
             else:
-                subnet.shortName = subnet.shortName[0]+":"+subnet.shortName[1]
-        if "cidr" not in jsonSubnet["properties"]:
-            eprint("missing cidr in OS::Neutron::Subnet object",str(jsonSubnet["resourceName"]))
-            subnet.broken = True
-        else:
-            subnet.cidr = jsonSubnet["properties"]["cidr"]
-        if "gateway_ip" not in jsonSubnet["properties"]:
-            eprint("missing gateway_ip in OS::Neutron::Subnet object",str(jsonSubnet["resourceName"]))
-            subnet.broken = True
-        else:
-            subnet.gatewayIp = jsonSubnet["properties"]["gateway_ip"]
-        if "network" not in jsonSubnet["properties"]:
-            eprint("missing network in OS::Neutron::Subnet object",str(jsonSubnet["resourceName"]))
-            subnet.broken = True
-        elif "get_resource" not in jsonSubnet["properties"]["network"]:
-            eprint("missing get_resource in network in OS::Neutron::Subnet object",str(jsonSubnet["resourceName"]))
-            subnet.broken = True
+                withouttype += 1
+            continue
+        resourceType = TYPE_REGISTRY[typeCode]
+        nodes = graph.nodes[typeCode]
+        idx = len(nodes)
+        node = readResource(resourceType, idx, key, obj, report, refs)
+        nodes.append(node)
+        counts[typeCode] += 1
+        keys[typeCode].setdefault(key, idx)
+        properties = obj.get("properties")
+        if isinstance(properties, dict) and isinstance(properties.get("name"), str):
+            names[typeCode].setdefault(properties["name"], idx)
+    resources = None
+    result.timings["classify"] = time.perf_counter()-start
+
+    start = time.perf_counter()
+    indexes = [None]*NODE_TYPE_COUNT
+    for typeCode in REFERENCED_TYPES:
+        indexes[typeCode] = buildIndex(names[typeCode], keys[typeCode])
+    resolveReferences(refs, indexes, report)
+    buildEdges(graph)
+    result.timings["resolve"] = time.perf_counter()-start
+
+    logCounts(result, counts, withouttype, others)
+    result.logOmitted()
+    return graph
+
+# edges of a node as (edge kind, from index, to index), see buildEdges
+def nodeEdges(typeCode, idx, node):
+    for field in TYPE_REGISTRY[typeCode].edgeFields:
+        value = getattr(node, field.attribute)
+        reverse = EDGE_TYPES[field.edge][0] != typeCode
+        for targetIdx in (value if field.many else (value,)):
+            if targetIdx == None:
+                continue
+            if reverse:
+                yield field.edge, targetIdx, idx
+            else:
+                yield field.edge, idx, targetIdx
+
+# create edge arrays from the resolved references of the nodes
+def buildEdges(graph):
+    graph.edgeKinds = array("B")
+    graph.edgeFrom = array("l")
+    graph.edgeTo = array("l")
+    addEdge = graph.addEdge
+    for typeCode,nodes in enumerate(graph.nodes):
+        if not TYPE_REGISTRY[typeCode].edgeFields:
+            continue
+        for idx,node in enumerate(nodes):
+            for kind,fromIdx,toIdx in nodeEdges(typeCode, idx, node):
+                addEdge(kind, fromIdx, toIdx)
+
+# subgraph queries
+# around: resources within hops edges of the named resource
+# reachable: everything connected to the named resource, routers other than
+#   the named one are included but not passed, so a net yields its own segment
+# broken: broken resources and the resources within hops edges of them
+QUERY_AROUND = "around"
+QUERY_REACHABLE = "reachable"
+QUERY_BROKEN = "broken"
+QUERY_KINDS = [QUERY_AROUND, QUERY_REACHABLE, QUERY_BROKEN]
+
+class Query:
+    def __init__(self, kind, name=None, hops=1):
+        if kind not in QUERY_KINDS:
+            raise ValueError("Unknown query: "+str(kind))
+        if kind != QUERY_BROKEN and name == None:
+            raise ValueError("Query "+kind+" needs a resource name")
+        self.kind = kind
+        self.name = name
+        self.hops = hops
+
+    def describe(self):
+        if self.kind == QUERY_BROKEN:
+            return "broken resources within "+str(self.hops)+" hops"
+        if self.kind == QUERY_AROUND:
+            return str(self.hops)+" hops around "+self.name
+        return "reachable from "+self.name
+
+# neighbours of every node as (type code, index), per type code and index
+# nodes are connected by their resolved references, which includes
+# the nodes drawn inside server clusters
+def adjacency(graph):
+    neighbours = [[[] for node in nodes] for nodes in graph.nodes]
+    for typeCode,nodes in enumerate(graph.nodes):
+        fields = REFERENCE_FIELDS[typeCode]
+        if not fields:
+            continue
+        for idx,node in enumerate(nodes):
+            for field,targetType,many in fields:
+                value = getattr(node, field)
+                for targetIdx in (value if many else (value,)):
+                    if targetIdx != None:
+                        neighbours[typeCode][idx].append((targetType, targetIdx))
+                        neighbours[targetType][targetIdx].append((typeCode, idx))
+    return neighbours
+
+# nodes selected by a query as one bytearray per type code
+def selectNodes(graph, query, log):
+    selected = [bytearray(len(nodes)) for nodes in graph.nodes]
+    start = []
+    for typeCode,nodes in enumerate(graph.nodes):
+        for idx,node in enumerate(nodes):
+            if query.kind == QUERY_BROKEN:
+                if node.broken:
+                    start.append((typeCode, idx))
+            elif query.name == node.key or query.name == node.longName or query.name == node.shortName:
+                start.append((typeCode, idx))
+    if not start:
+        if query.kind == QUERY_BROKEN:
+            log("Query: no broken resources")
         else:
-            subnet.netIdx = findNetIdxByName(nets,jsonSubnet["properties"]["network"]["get_resource"])
-            if subnet.netIdx == None:
-                eprint("Net",jsonSubnet["properties"]["network"]["get_resource"],"for OS::Neutron::Subnet object",subnet.shortName,"not found",str(jsonSubnet["resourceName"]))
-                subnet.broken = True
-    dotSubnets.append(subnet)
-
-for idx,jsonRouter in enumerate(routers):
-    router = Router(idx,longName="router"+str(idx),shortName="router"+str(idx))
-    if "properties" not in jsonRouter:
-        eprint("missing properties in OS::Neutron::Router object",str(jsonRouter["resourceName"]))
-        router.broken = True
+            log("Query: resource",query.name,"not found")
+        return selected
+
+    # breadth first search, hops is unlimited for reachable
+    neighbours = adjacency(graph)
+    hops = None if query.kind == QUERY_REACHABLE else query.hops
+    queue = deque()
+    for typeCode,idx in start:
+        selected[typeCode][idx] = 1
+        queue.append((typeCode, idx, 0))
+    while queue:
+        typeCode, idx, distance = queue.popleft()
+        if hops != None and distance >= hops:
+            continue
+        if query.kind == QUERY_REACHABLE and typeCode == ROUTER and distance > 0:
+            continue
+        for neighbourType,neighbourIdx in neighbours[typeCode][idx]:
+            if not selected[neighbourType][neighbourIdx]:
+                selected[neighbourType][neighbourIdx] = 1
+                queue.append((neighbourType, neighbourIdx, distance+1))
+
+    # ports and other cluster members are drawn inside the cluster of their server,
+    # so their server is selected with them
+    servers = selected[SERVER]
+    for typeCode,owners in enumerate(clusterOwners(graph)):
+        if owners == None:
+            continue
+        for idx,flag in enumerate(selected[typeCode]):
+            if flag and owners[idx] != -1:
+                servers[owners[idx]] = 1
+    return selected
+
+# split a graph by a part number per node (one array per type code), -1 drops the node
+# nodes are copied with their references renumbered to the positions in their part,
+# references to nodes in other parts or to dropped nodes are removed
+# node.idx and so the dot ids stay the same as in the original graph
+def partitionGraph(graph, labels, count):
+    parts = [Graph() for part in range(count)]
+    positions = []
+    for typeCode,nodes in enumerate(graph.nodes):
+        typeLabels = labels[typeCode]
+        typePositions = array("l", [-1])*len(nodes)
+        for idx,node in enumerate(nodes):
+            part = typeLabels[idx]
+            if part >= 0:
+                partNodes = parts[part].nodes[typeCode]
+                typePositions[idx] = len(partNodes)
+                partNodes.append(node)
+        positions.append(typePositions)
+
+    def position(targetType, idx, part):
+        if idx == None or labels[targetType][idx] != part:
+            return None
+        return positions[targetType][idx]
+
+    for part,partGraph in enumerate(parts):
+        for typeCode,nodes in enumerate(partGraph.nodes):
+            fields = REFERENCE_FIELDS[typeCode]
+            for localIdx,node in enumerate(nodes):
+                node = copy.copy(node)
+                for field,targetType,many in fields:
+                    if many:
+                        targetLabels = labels[targetType]
+                        targetPositions = positions[targetType]
+                        setattr(node, field, array("l", [targetPositions[targetIdx] for targetIdx in getattr(node, field) if targetLabels[targetIdx] == part]))
+                    else:
+                        setattr(node, field, position(targetType, getattr(node, field), part))
+                nodes[localIdx] = node
+        buildEdges(partGraph)
+    return parts
+
+# graph of the selected nodes, see partitionGraph
+def subgraph(graph, selected):
+    labels = [array("l", [0 if flag else -1 for flag in flags]) for flags in selected]
+    return partitionGraph(graph, labels, 1)[0]
+
+# connected component number of every node, one array per type code, and the number of components
+def componentLabels(graph):
+    neighbours = adjacency(graph)
+    labels = [array("l", [-1])*len(nodes) for nodes in graph.nodes]
+    count = 0
+    for typeCode,nodes in enumerate(graph.nodes):
+        for idx in range(len(nodes)):
+            if labels[typeCode][idx] != -1:
+                continue
+            labels[typeCode][idx] = count
+            stack = [(typeCode, idx)]
+            while stack:
+                nodeType, nodeIdx = stack.pop()
+                for neighbourType,neighbourIdx in neighbours[nodeType][nodeIdx]:
+                    if labels[neighbourType][neighbourIdx] == -1:
+                        labels[neighbourType][neighbourIdx] = count
+                        stack.append((neighbourType, neighbourIdx))
+            count += 1
+    return labels, count
+
+# component labels with the components of the servers of a group joined,
+# at grouped detail a group is drawn as one node, see serverGroups
+def groupComponentLabels(graph, labels, count):
+    serverLabels = labels[SERVER]
+    joined = list(range(count))
+
+    def find(label):
+        while joined[label] != label:
+            joined[label] = joined[joined[label]]
+            label = joined[label]
+        return label
+
+    for idx,representative in enumerate(serverGroups(graph)):
+        first = find(serverLabels[representative])
+        other = find(serverLabels[idx])
+        if first != other:
+            joined[max(first, other)] = min(first, other)
+    numbers = {}
+    for label in range(count):
+        numbers.setdefault(find(label), len(numbers))
+    return [array("l", [numbers[find(label)] for label in typeLabels]) for typeLabels in labels], len(numbers)
+
+# connected components of a graph as separate graphs, largest first
+# grouped keeps the servers of a group in one graph, for drawing at grouped detail
+def splitComponents(graph, grouped=False):
+    labels, count = componentLabels(graph)
+    if count > 1 and grouped:
+        labels, count = groupComponentLabels(graph, labels, count)
+    if count == 1:
+        return [graph]
+    parts = partitionGraph(graph, labels, count)
+    parts.sort(key=lambda part: part.nodeCount(), reverse=True)
+    return parts
+
+DOT_LEGEND = "\n".join([
+    "subgraph cluster_legend {",
+    "label=\"Legend\";",
+    # server legend
+    "subgraph cluster_legend_server {",
+    "label=\"server\";",
+    "fillcolor=lightblue1;",
+    "style=filled;",
+    Port("legend",shortName="port").dot(),
+    "}",
+    Net("legend",shortName="net").dot(),
+    Subnet("legend",shortName="subnet").dot(),
+    Router("legend",shortName="router").dot(),
+    "routerInterfacelegend [shape=triangle,label=\"router interface\"];",
+    "floatinglegend [shape=egg,label=\"floating ip\"];",
+    "}",
+])
+
+# legends of the reduced levels of detail
+DOT_LEGEND_SERVERS = "\n".join([
+    "subgraph cluster_legend {",
+    "label=\"Legend\";",
+    Server("legend",shortName="server\\nports").dot(),
+    Net("legend",shortName="net").dot(),
+    Subnet("legend",shortName="subnet").dot(),
+    Router("legend",shortName="router").dot(),
+    "routerInterfacelegend [shape=triangle,label=\"router interface\"];",
+    "floatinglegend [shape=egg,label=\"floating ip\"];",
+    "}",
+])
+
+DOT_LEGEND_BACKBONE = "\n".join([
+    "subgraph cluster_legend {",
+    "label=\"Legend\";",
+    Net("legend",shortName="net\\nports").dot(),
+    Subnet("legend",shortName="subnet").dot(),
+    Router("legend",shortName="router").dot(),
+    "routerInterfacelegend [shape=triangle,label=\"router interface\"];",
+    "}",
+])
+
+# levels of detail, finest first
+# servers: every server cluster is collapsed into one node with its port count
+# grouped: servers with the same ports on the same nets are merged into one node
+# backbone: only nets, subnets, routers and router interfaces
+DETAIL_FULL = "full"
+DETAIL_SERVERS = "servers"
+DETAIL_GROUPED = "grouped"
+DETAIL_BACKBONE = "backbone"
+DETAIL_LEVELS = [DETAIL_FULL, DETAIL_SERVERS, DETAIL_GROUPED, DETAIL_BACKBONE]
+
+# node types drawn at the backbone level
+BACKBONE_TYPES = (NET, SUBNET, ROUTER, ROUTERINTERFACE)
+
+# number of lines collected before a chunk is handed out
+CHUNK_LINES = 4096
+
+# dot ids of the nodes, one list per type code
+# the same as the positions except in graphs from partitionGraph
+def nodeIds(graph):
+    return [[node.idx for node in nodes] for nodes in graph.nodes]
+
+# legend of a level of detail
+# types with a legend label in TYPE_REGISTRY are only listed if the graph has nodes of them
+def legendText(graph, detail=DETAIL_FULL):
+    if detail == DETAIL_BACKBONE:
+        return DOT_LEGEND_BACKBONE
+    legend = DOT_LEGEND if detail == DETAIL_FULL else DOT_LEGEND_SERVERS
+    extra = []
+    for resourceType in TYPE_REGISTRY:
+        if resourceType.legend == None or not graph.nodes[resourceType.code]:
+            continue
+        # collapsed into the servers
+        if detail != DETAIL_FULL and resourceType.code in CLUSTER_TYPES:
+            continue
+        extra.append(resourceType.nodeClass("legend",shortName=resourceType.legend).dot())
+    if not extra:
+        return legend
+    return legend[:-1]+"\n".join(extra)+"\n}"
+
+# dot text of the legend as a graph of its own, see componentDots
+def legendDot(graph, detail=DETAIL_FULL):
+    return "graph legend {\n"+legendText(graph, detail)+"\n}\n"
+
+# nodes drawn inside server clusters besides the ports listed by the servers
+# as lists of (type code, index) per server index, servers without any are left out
+def clusterMembers(graph):
+    members = {}
+    for typeCode,field in CLUSTER_MEMBER_FIELDS:
+        for idx,node in enumerate(graph.nodes[typeCode]):
+            serverIdx = getattr(node, field.attribute)
+            if serverIdx != None:
+                members.setdefault(serverIdx, []).append((typeCode, idx))
+    return members
+
+# generate the dot text for the graph as a sequence of string chunks
+# detail is one of DETAIL_LEVELS
+def iterDot(graph, chunkLines=CHUNK_LINES, detail=DETAIL_FULL, legend=True):
+    if detail != DETAIL_FULL:
+        yield from iterDotReduced(graph, detail, chunkLines, legend)
+        return
+
+    lines = []
+    out = lines.append
+
+    out("graph heat {")
+    #out("layout=patchwork;")
+
+    ports = graph.ports
+    members = clusterMembers(graph)
+    for idx,server in enumerate(graph.servers):
+        out(Server.DOT_BEGIN % (server.idx, server.shortName))
+        for portIx in server.portIdx:
+            out(ports[portIx].dot())
+        for typeCode,memberIdx in members.get(idx, ()):
+            out(graph.nodes[typeCode][memberIdx].dot())
+        out(Server.DOT_END)
+        if len(lines) >= chunkLines:
+            yield "\n".join(lines)+"\n"
+            lines = []
+            out = lines.append
+
+    # ports are only drawn inside clusters, other cluster members without server on their own
+    for typeCode,nodes in enumerate(graph.nodes):
+        if typeCode == SERVER or typeCode == PORT:
+            continue
+        for idx,node in enumerate(nodes):
+            if typeCode in CLUSTER_ATTRIBUTES and getattr(node, CLUSTER_ATTRIBUTES[typeCode]) != None:
+                continue
+            out(node.dot())
+            if len(lines) >= chunkLines:
+                yield "\n".join(lines)+"\n"
+                lines = []
+                out = lines.append
+
+    ids = nodeIds(graph)
+    edgeTemplates = [(template, ids[fromType], ids[toType]) for fromType,toType,template in EDGE_TYPES]
+    edgeFrom = graph.edgeFrom
+    edgeTo = graph.edgeTo
+    for edgeIdx,kind in enumerate(graph.edgeKinds):
+        template, fromIds, toIds = edgeTemplates[kind]
+        out(template % (fromIds[edgeFrom[edgeIdx]], toIds[edgeTo[edgeIdx]]))
+        if len(lines) >= chunkLines:
+            yield "\n".join(lines)+"\n"
+            lines = []
+            out = lines.append
+
+    if legend:
+        out(legendText(graph))
+    out("}")
+    yield "\n".join(lines)+"\n"
+
+# dot text of every connected component and of the legend as separate graphs
+# for laying out the components in parallel, see heat2dot_render.renderComponents
+def componentDots(graph, detail=DETAIL_FULL):
+    dots = ["".join(iterDot(component, detail=detail, legend=False)) for component in splitComponents(graph, detail == DETAIL_GROUPED)]
+    dots.append(legendDot(graph, detail))
+    return dots
+
+# write the dot text for the graph to a file-like object
+def writeDot(graph, out, detail=DETAIL_FULL):
+    for chunk in iterDot(graph, detail=detail):
+        out.write(chunk)
+
+# server whose cluster draws each node, one array per type in CLUSTER_TYPES and None
+# for other types, -1 for nodes outside of any server, ports belong to the first server
+def clusterOwners(graph):
+    owners = [None]*NODE_TYPE_COUNT
+    portOwners = array("l", [-1])*len(graph.ports)
+    for idx,server in enumerate(graph.servers):
+        for portIx in server.portIdx:
+            if portOwners[portIx] == -1:
+                portOwners[portIx] = idx
+    owners[PORT] = portOwners
+    for typeCode,field in CLUSTER_MEMBER_FIELDS:
+        owners[typeCode] = array("l", [-1 if getattr(node, field.attribute) == None else getattr(node, field.attribute) for node in graph.nodes[typeCode]])
+    return owners
+
+# index of the first server with the same nets and the same state for each server
+def serverGroups(graph):
+    ports = graph.ports
+    groups = {}
+    representatives = array("l", [0])*len(graph.servers)
+    for idx,server in enumerate(graph.servers):
+        broken = server.broken
+        nets = []
+        for portIx in server.portIdx:
+            port = ports[portIx]
+            broken = broken or port.broken
+            nets.append(-1 if port.netIdx == None else port.netIdx)
+        nets.sort()
+        representatives[idx] = groups.setdefault((broken, tuple(nets)), idx)
+    return representatives
+
+# number of nodes drawn at a level of detail, the legend is not counted
+def detailNodeCount(graph, detail):
+    if detail == DETAIL_FULL:
+        return graph.nodeCount()
+    if detail == DETAIL_BACKBONE:
+        return sum(len(graph.nodes[typeCode]) for typeCode in BACKBONE_TYPES)
+    count = graph.nodeCount()-len(graph.servers)
+    for owners in clusterOwners(graph):
+        if owners != None:
+            count -= len(owners)-owners.count(-1)
+    if detail == DETAIL_SERVERS:
+        return count+len(graph.servers)
+    return count+len(set(serverGroups(graph)))
+
+# finest level of detail, not finer than detail, whose node count fits the budget
+# the coarsest level is used if none fits
+def chooseDetail(graph, nodeBudget, detail=DETAIL_FULL):
+    if nodeBudget == None:
+        return detail
+    levels = DETAIL_LEVELS[DETAIL_LEVELS.index(detail):]
+    for level in levels:
+        if detailNodeCount(graph, level) <= nodeBudget:
+            return level
+    return levels[-1]
+
+# dot text for the reduced levels of detail, see iterDot
+def iterDotReduced(graph, detail, chunkLines=CHUNK_LINES, legend=True):
+    lines = []
+    out = lines.append
+
+    out("graph heat {")
+
+    servers = graph.servers
+    ids = nodeIds(graph)
+    edgeTemplates = [(template, ids[fromType], ids[toType]) for fromType,toType,template in EDGE_TYPES]
+    edgeKinds = graph.edgeKinds
+    edgeFrom = graph.edgeFrom
+    edgeTo = graph.edgeTo
+
+    if detail == DETAIL_BACKBONE:
+        netPorts = [0]*len(graph.nets)
+        for edgeIdx,kind in enumerate(edgeKinds):
+            if kind == EDGE_PORT_NET:
+                netPorts[edgeTo[edgeIdx]] += 1
+        for idx,net in enumerate(graph.nets):
+            out(net.dot("%s\\n%d ports" % (net.shortName, netPorts[idx])))
+        for typeCode in BACKBONE_TYPES:
+            if typeCode == NET:
+                continue
+            for node in graph.nodes[typeCode]:
+                out(node.dot())
+                if len(lines) >= chunkLines:
+                    yield "\n".join(lines)+"\n"
+                    lines = []
+                    out = lines.append
+        for edgeIdx,kind in enumerate(edgeKinds):
+            fromType, toType = EDGE_TYPES[kind][:2]
+            if fromType not in BACKBONE_TYPES or toType not in BACKBONE_TYPES:
+                continue
+            template, fromIds, toIds = edgeTemplates[kind]
+            out(template % (fromIds[edgeFrom[edgeIdx]], toIds[edgeTo[edgeIdx]]))
+            if len(lines) >= chunkLines:
+                yield "\n".join(lines)+"\n"
+                lines = []
+                out = lines.append
+        if legend:
+            out(DOT_LEGEND_BACKBONE)
+        out("}")
+        yield "\n".join(lines)+"\n"
+        return
+
+    owners = clusterOwners(graph)
+    if detail == DETAIL_GROUPED:
+        representatives = serverGroups(graph)
     else:
-        if "name" not in jsonRouter["properties"]:
-            eprint("missing name in OS::Neutron::Router object",str(jsonRouter["resourceName"]))
-            router.broken = True
+        representatives = range(len(servers))
+    members = [0]*len(servers)
+    for representative in representatives:
+        members[representative] += 1
+
+    for idx,server in enumerate(servers):
+        if representatives[idx] != idx:
+            continue
+        if members[idx] > 1:
+            out(server.dot("%s x%d\\n%d ports" % (server.shortName, members[idx], len(server.portIdx))))
         else:
-            router.longName = jsonRouter["properties"]["name"]
-            router.shortName = router.longName.split(":")
-            if len(router.shortName)<2:
-                eprint("Name of OS::Neutron::Router object unexpected",str(jsonRouter["resourceName"]))
-                eprint("  use full name instead:",router.longName)
-                router.shortName = router.longName
-            else:
-                router.shortName = router.shortName[0]+":"+router.shortName[1];
-    dotRouters.append(router)
-
-for idx,jsonRouterInterface in enumerate(routerinterfaces):
-    routerInterface = RouterInterface(idx,longName="ri"+str(idx),shortName="ri"+str(idx))
-    routerInterface.longName = jsonRouterInterface["resourceName"]
-    routerInterface.shortName = routerInterface.longName.split(":")
-    if len(routerInterface.shortName)<3:
-        eprint("Unexpected resource name of OS::Neutron::RouterInterface object.",str(jsonRouterInterface["resourceName"]))
-        eprint("  use long name: ",routerInterface.longName)
-        routerInterface.shortName = routerInterface.longName
+            out(server.dot("%s\\n%d ports" % (server.shortName, len(server.portIdx))))
+        if len(lines) >= chunkLines:
+            yield "\n".join(lines)+"\n"
+            lines = []
+            out = lines.append
+
+    # ports and other cluster members outside of servers are still drawn
+    for typeCode,nodes in enumerate(graph.nodes):
+        if typeCode == SERVER:
+            continue
+        typeOwners = owners[typeCode]
+        for idx,node in enumerate(nodes):
+            if typeOwners != None and typeOwners[idx] != -1:
+                continue
+            out(node.dot())
+            if len(lines) >= chunkLines:
+                yield "\n".join(lines)+"\n"
+                lines = []
+                out = lines.append
+
+    # edges of cluster members end at the server node, each server edge is drawn once
+    seen = set()
+    for edgeIdx,kind in enumerate(edgeKinds):
+        fromIdx = edgeFrom[edgeIdx]
+        toIdx = edgeTo[edgeIdx]
+        template, fromIds, toIds = edgeTemplates[kind]
+        fromOwners = owners[EDGE_TYPES[kind][0]]
+        if kind in SERVER_EDGE_TEMPLATES and fromOwners[fromIdx] != -1:
+            edge = (kind, representatives[fromOwners[fromIdx]], toIdx)
+            if edge in seen:
+                continue
+            seen.add(edge)
+            out(SERVER_EDGE_TEMPLATES[kind] % (ids[SERVER][edge[1]], toIds[toIdx]))
+        else:
+            out(template % (fromIds[fromIdx], toIds[toIdx]))
+        if len(lines) >= chunkLines:
+            yield "\n".join(lines)+"\n"
+            lines = []
+            out = lines.append
+
+    if legend:
+        out(legendText(graph, detail))
+    out("}")
+    yield "\n".join(lines)+"\n"
+
+# expand resource groups and nested stacks into one flat template
+# nested template files are only loaded with a heat2dot_nested.TemplateLoader
+# text and formatHint are the source of template if it was parsed from text
+def expandTemplate(template, result, loader=None, text=None, formatHint=None):
+    if not isinstance(template, dict) or not isinstance(template.get("resources"), dict):
+        return template
+    for obj in template["resources"].values():
+        if isinstance(obj, dict) and isinstance(obj.get("type"), str) and obj["type"] not in RESOURCE_TYPES:
+            import heat2dot_nested
+            return heat2dot_nested.expand(template, result, loader, text, formatHint)
+    return template
+
+# parse a heat template and resolve its resources without generating dot text
+# template is json/yaml text (str or bytes) or an already parsed template
+# formatHint ("json" or "yaml") skips format detection
+# selective=False parses the whole template instead of the parts the converter reads
+# with a heat2dot_nested.TemplateLoader nested templates are loaded and expanded
+# messages are added to result if given
+def resolve(template, formatHint=None, result=None, selective=True, loader=None):
+    if result == None:
+        result = DotResult()
+
+    text = None
+    if isinstance(template, (str, bytes)):
+        text = template
+        template = parseTemplate(text, result, formatHint, selective)
+        if template == None:
+            return result
+    template = expandTemplate(template, result, loader, text, formatHint)
+
+    result.graph = buildGraph(template, result)
+    if result.graph == None:
+        return result
+    result.success = True
+    return result
+
+# convert a heat template to a dot graph
+# if out is given the dot text is written to it instead of result.dot
+# detail is one of DETAIL_LEVELS, with nodeBudget coarser levels are used
+# until the graph has at most nodeBudget nodes, the level used is result.detail
+# with a Query only the selected subgraph is drawn, result.graph is that subgraph
+def convert(template, out=None, formatHint=None, result=None, detail=DETAIL_FULL, nodeBudget=None, query=None, selective=True, loader=None):
+    if detail not in DETAIL_LEVELS:
+        raise ValueError("Unknown level of detail: "+str(detail))
+    result = resolve(template, formatHint, result, selective, loader)
+    if not result.success:
+        return result
+    if query != None:
+        start = time.perf_counter()
+        result.graph = subgraph(result.graph, selectNodes(result.graph, query, result.log))
+        result.timings["query"] = time.perf_counter()-start
+        result.log("Query",query.describe()+":",result.graph.nodeCount(),"resources selected")
+    start = time.perf_counter()
+    result.detail = chooseDetail(result.graph, nodeBudget, detail)
+    if result.detail != detail:
+        result.log("Graph reduced to level of detail", result.detail, "to fit the node budget of", nodeBudget)
+    if out == None:
+        result.dot = "".join(iterDot(result.graph, detail=result.detail))
     else:
-        routerInterface.shortName = routerInterface.shortName[0]+":"+routerInterface.shortName[1]+":"+routerInterface.shortName[2]
-    if "properties" not in jsonRouterInterface:
-        eprint("missing properties in OS::Neutron::RouterInterface object",str(jsonRouterInterface["resourceName"]))
-        routerInterface.broken = True
+        writeDot(result.graph, out, result.detail)
+    result.timings["emit"] = time.perf_counter()-start
+    return result
+
+# replace the output file in one step so viewers never read a partial graph
+def writeOutput(path, text):
+    tmpPath = path+".tmp"
+    with open(tmpPath, "w") as outFile:
+        outFile.write(text)
+    os.replace(tmpPath, path)
+
+# render a converted graph, returns None and fails the result on errors
+# connected components are laid out on parallel workers if there are several
+# engine selects graphviz or the built-in layout, see heat2dot_render.chooseEngine
+def renderResult(result, outputFormat, workers, engine="auto"):
+    import heat2dot_render
+    scheduler = heat2dot_render.RenderScheduler(workers=workers, timeout=None, backend="process")
+    start = time.perf_counter()
+    try:
+        engine = heat2dot_render.chooseEngine(engine, detailNodeCount(result.graph, result.detail), outputFormat=outputFormat)
+        if engine == heat2dot_render.ENGINE_BUILTIN:
+            return heat2dot_render.renderBuiltin(result.dot, outputFormat)
+        if workers > 1 and heat2dot_render.canPack():
+            dots = componentDots(result.graph, result.detail)
+            # one component and the legend
+            if len(dots) > 2:
+                return scheduler.renderComponents(dots, outputFormat)
+        return scheduler.render(result.dot, outputFormat)
+    except heat2dot_render.RenderError as e:
+        result.log("Rendering failed:", e)
+        result.success = False
+        return None
+    finally:
+        result.timings["layout"] = time.perf_counter()-start
+        scheduler.executor.shutdown()
+
+# modification times of a template and the nested templates loaded for it, None if unreadable
+def watchedMtimes(path, loader):
+    try:
+        mtimes = [os.stat(path).st_mtime_ns]
+    except OSError as e:
+        eprint("Cannot read template: "+str(e))
+        return None
+    if loader != None:
+        for nestedPath in sorted(loader.paths()):
+            try:
+                mtimes.append(os.stat(nestedPath).st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+    return mtimes
+
+# poll the template and its nested templates and convert it incrementally on every change
+def watch(path, outputPath, formatHint, interval, loader=None):
+    import heat2dot_incremental
+    converter = heat2dot_incremental.IncrementalConverter(loader)
+    lastMtimes = None
+    while True:
+        mtimes = watchedMtimes(path, loader)
+        if mtimes != None and mtimes != lastMtimes:
+            text, hint = readTemplate(path)
+            start = time.perf_counter()
+            result = converter.update(text, formatHint or hint)
+            # nested templates seen for the first time are watched from now on
+            lastMtimes = watchedMtimes(path, loader)
+            for message in result.messages:
+                eprint(message)
+            if result.success:
+                writeOutput(outputPath, result.dot)
+                eprint("Updated "+outputPath+": %d resources resolved%s in %.3f seconds" % (converter.resolvedCount,
+                    " (full rebuild)" if converter.fullRebuild else "", time.perf_counter()-start))
+        try:
+            time.sleep(interval)
+        except KeyboardInterrupt:
+            return
+
+def main():
+    parser = argparse.ArgumentParser(description="Generates dot graph from heat template")
+    parser.add_argument("template", nargs="?", help="json or yaml template file, default stdin")
+    parser.add_argument("--format", choices=["json","yaml"], help="skip format detection")
+    parser.add_argument("--watch", action="store_true", help="convert again whenever the template changes, requires --output")
+    parser.add_argument("-o", "--output", help="dot output file, default stdout")
+    parser.add_argument("--interval", type=float, default=0.5, help="seconds between checks in watch mode")
+    parser.add_argument("--detail", choices=DETAIL_LEVELS, default=DETAIL_FULL, help="level of detail, default full")
+    parser.add_argument("--node-budget", type=int, help="use coarser levels of detail until at most this many nodes are drawn")
+    queryGroup = parser.add_mutually_exclusive_group()
+    queryGroup.add_argument("--around", metavar="NAME", help="only draw resources within --hops of this resource")
+    queryGroup.add_argument("--reachable", metavar="NAME", help="only draw resources reachable from this resource, e.g. a net or router")
+    queryGroup.add_argument("--broken", action="store_true", help="only draw broken resources and resources within --hops of them")
+    parser.add_argument("--hops", type=int, default=1, help="neighbourhood size for --around and --broken, default 1")
+    parser.add_argument("--render", metavar="FORMAT", help="render instead of writing dot, e.g. svg, see --engine")
+    parser.add_argument("--engine", choices=["auto", "graphviz", "builtin"], default="auto",
+                        help="layout for --render, builtin is a fast layered layout writing svg, auto uses it for large graphs and without Graphviz")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="workers loading nested templates and laying out connected components with --render")
+    parser.add_argument("--metrics", metavar="FILE", help="write stage timings, sizes and counts as json, - for stderr")
+    parser.add_argument("--profile", metavar="FILE", help="write a cProfile profile of the conversion")
+    parser.add_argument("--trace-memory", action="store_true", help="add tracemalloc peak and top allocations to --metrics")
+    parser.add_argument("--full-parse", action="store_true", help="build the whole template instead of only the resources and properties that are drawn")
+    parser.add_argument("--diagnostics", metavar="FILE", help="write the problems found in resources as json, - for stderr")
+    parser.add_argument("--diagnostics-limit", type=int, default=DIAGNOSTIC_LIMIT,
+                        help="problems listed per kind, further ones are only counted, 0 lists all, default %d" % DIAGNOSTIC_LIMIT)
+    args = parser.parse_args()
+
+    query = None
+    if args.around != None:
+        query = Query(QUERY_AROUND, args.around, args.hops)
+    elif args.reachable != None:
+        query = Query(QUERY_REACHABLE, args.reachable)
+    elif args.broken:
+        query = Query(QUERY_BROKEN, hops=args.hops)
+
+    # nested templates are relative to the template file
+    import heat2dot_nested
+
+    if args.watch:
+        if args.template == None or args.output == None:
+            parser.error("--watch requires a template file and --output")
+        if args.detail != DETAIL_FULL or args.node_budget != None or query != None or args.render != None:
+            parser.error("--watch only supports the full graph as dot")
+        loader = heat2dot_nested.TemplateLoader(args.template, args.jobs, not args.full_parse)
+        try:
+            watch(args.template, args.output, args.format, args.interval, loader)
+        finally:
+            loader.close()
+        return
+
+    if args.metrics != None or args.profile != None or args.trace_memory:
+        import heat2dot_metrics
+    if args.trace_memory:
+        import tracemalloc
+        tracemalloc.start()
+
+    if args.template == None:
+        text = sys.stdin.buffer.read()
+        formatHint = None
     else:
-        if "router" not in jsonRouterInterface["properties"]:
-            eprint("missing router in OS::Neutron::RouterInterface object",str(jsonRouterInterface["resourceName"]))
-            routerInterface.broken = True
-        elif "get_resource" not in jsonRouterInterface["properties"]["router"]:
-            eprint("missing get_resource in router in OS::Neutron::RouterInterface object",str(jsonRouterInterface["resourceName"]))
-            routerInterface.broken = True
+        text, formatHint = readTemplate(args.template)
+    if args.format != None:
+        formatHint = args.format
+
+    loader = heat2dot_nested.TemplateLoader(args.template, args.jobs, not args.full_parse)
+
+    def work():
+        result = DotResult(args.diagnostics_limit or None)
+        if args.render != None:
+            result = convert(text, formatHint=formatHint, result=result, detail=args.detail, nodeBudget=args.node_budget, query=query,
+                             selective=not args.full_parse, loader=loader)
+            if result.success:
+                data = renderResult(result, args.render, args.jobs, args.engine)
+            if result.success:
+                if args.output == None:
+                    sys.stdout.buffer.write(data)
+                else:
+                    with open(args.output, "wb") as outFile:
+                        outFile.write(data)
+        elif args.output == None:
+            result = convert(text, out=sys.stdout, formatHint=formatHint, result=result, detail=args.detail, nodeBudget=args.node_budget, query=query,
+                             selective=not args.full_parse, loader=loader)
         else:
-            routerInterface.routerIdx = findRouterIdxByName(routers,jsonRouterInterface["properties"]["router"]["get_resource"])
-            if routerInterface.routerIdx == None:
-                eprint("Router",jsonRouterInterface["properties"]["router"]["get_resource"],"for OS::Neutron::RouterInterface object not found",str(jsonRouterInterface["resourceName"]))
-                routerInterface.broken = True
-        if "subnet" not in jsonRouterInterface["properties"]:
-            eprint("missing subnet in OS::Neutron::RouterInterface object",str(jsonRouterInterface["resourceName"]))
-            routerInterface.broken = True
-        elif "get_resource" not in jsonRouterInterface["properties"]["subnet"]:
-            eprint("missing get_resource in subnet in OS::Neutron::RouterInterface object",str(jsonRouterInterface["resourceName"]))
-            routerInterface.broken = True
+            # streamed to a temporary file that replaces the output in one step
+            tmpPath = args.output+".tmp"
+            with open(tmpPath, "w") as outFile:
+                result = convert(text, out=outFile, formatHint=formatHint, result=result, detail=args.detail, nodeBudget=args.node_budget, query=query,
+                             selective=not args.full_parse, loader=loader)
+            if result.success:
+                os.replace(tmpPath, args.output)
+            else:
+                os.remove(tmpPath)
+        return result
+
+    try:
+        if args.profile != None:
+            result = heat2dot_metrics.profileCall(args.profile, work)
         else:
-            routerInterface.subnetIdx = findSubnetIdxByName(subnets,jsonRouterInterface["properties"]["subnet"]["get_resource"])
-            if routerInterface.subnetIdx == None:
-                eprint("Subnet",jsonRouterInterface["properties"]["subnet"]["get_resource"],"for OS::Neutron::RouterInterface object not found",str(jsonRouterInterface["resourceName"]))
-                routerInterface.broken = True
-    dotRouterinterfaces.append(routerInterface)
-
-for idx,jsonFloating in enumerate(floatings):
-    floating = FloatingIP(idx,longName="fip"+str(idx),shortName="fip"+str(idx))
-    if "properties" not in jsonFloating:
-        eprint("missing properties in OS::Neutron::FloatingIP object",str(jsonFloating["resourceName"]))
-        floating.broken = True
-    else:
-        if "port_id" not in jsonFloating["properties"]:
-            eprint("missing port_id in OS::Neutron::FloatingIP object",str(jsonFloating["resourceName"]))
-            floating.broken = True
-        elif "get_resource" not in jsonFloating["properties"]["port_id"]:
-            eprint("missing get_resource in port_id in OS::Neutron::FloatingIP object",str(jsonFloating["resourceName"]))
-            floating.broken = True
+            result = work()
+    finally:
+        loader.close()
+    for message in result.messages:
+        eprint(message)
+
+    if args.metrics != None:
+        metrics = result.metrics()
+        metrics["peakRssBytes"] = heat2dot_metrics.peakRss()
+        if args.trace_memory:
+            metrics["memory"] = heat2dot_metrics.memoryReport()
+        if args.metrics == "-":
+            eprint(json.dumps(metrics, indent=1))
         else:
-            floating.portIdx = findPortIdxByName(ports,jsonFloating["properties"]["port_id"]["get_resource"])
-            if floating.portIdx == None:
-                eprint("Port",jsonFloating["properties"]["port_id"]["get_resource"],"for OS::Neutron::FloatingIP object not found",str(jsonFloating["resourceName"]))
-                floating.broken = True
-    dotFloatings.append(floating)
-
-# printing graph
-print("graph heat {")
-#print("layout=patchwork;")
-
-
-for idx,server in enumerate(dotServers):
-    print("subgraph cluster_server"+str(idx)+" {")
-    print("label=\""+server.shortName+"\";")
-    print("fillcolor=lightblue1;")
-    print("style=filled;")
-    for portIx in server.portIdx:
-        if portIx == None:
-            pass
+            with open(args.metrics, "w") as metricsFile:
+                json.dump(metrics, metricsFile, indent=1)
+    if args.diagnostics != None:
+        if args.diagnostics == "-":
+            eprint(json.dumps(result.diagnostics.stats(), indent=1))
         else:
-            port = dotPorts[portIx]
-            print(port.dot())
-    print("}")
-
-# nets
-for idx,net in enumerate(dotNets):
-    print(net.dot())
-
-# subnets
-for idx,subnet in enumerate(dotSubnets):
-    print(subnet.dot())
-
-# routers
-for idx,router in enumerate(dotRouters):
-    print(router.dot())
-
-# router interfaces
-for idx,routerInterface in enumerate(dotRouterinterfaces):
-    print(routerInterface.dot())
-
-# floating ips
-for idx,floating in enumerate(dotFloatings):
-    print(floating.dot())
-
-# connect ports to nets
-for idx,port in enumerate(dotPorts):
-    print("port"+str(idx),"--","net"+str(port.netIdx)+";")
-# connect subnets to nets
-for idx,subnet in enumerate(dotSubnets):
-    print("subnet"+str(idx),"--","net"+str(subnet.netIdx)+";")
-# connect router interfaces to subnets and routers
-for idx,routerInterface in enumerate(dotRouterinterfaces):
-    print("subnet"+str(routerInterface.subnetIdx),"--","routerInterface"+str(idx)+";")
-    print("routerInterface"+str(idx),"--","router"+str(routerInterface.routerIdx)+";")
-# connect floating ip to port
-for idx,floating in enumerate(dotFloatings):
-    print("port"+str(floating.portIdx),"--","floating"+str(idx)+";")
-
-# legend
-print("subgraph cluster_legend {")
-print("label=\"Legend\";")
-# server legend
-print("subgraph cluster_legend_server {")
-print("label=\"server\";")
-print("fillcolor=lightblue1;")
-print("style=filled;")
-print(Port("legend",shortName="port").dot())
-print("}")
-# net legend
-print(Net("legend",shortName="net").dot())
-# subnet legend
-print(Subnet("legend",shortName="subnet").dot())
-# router legend
-print(Router("legend",shortName="router").dot())
-# router interface legend
-print("routerInterfacelegend [shape=triangle,label=\"router interface\"];")
-# floating ip legend
-print("floatinglegend [shape=egg,label=\"floating ip\"];")
-print("}")
-print("}")
-eprint("------")
-eprint("Exiting")
-eprint("------")
-
+            with open(args.diagnostics, "w") as diagnosticsFile:
+                json.dump(result.diagnostics.stats(), diagnosticsFile, indent=1)
+    if not result.success:
+        exit(1)
+    eprint("------")
+    eprint("Exiting")
+    eprint("------")
 
+if __name__ == '__main__':
+    main()
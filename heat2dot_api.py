@@ -0,0 +1,225 @@
+# Raw body api of the heat2dot servers
+# The template is the request body, optionally gzip or zstd compressed, the
+# render options are query parameters. The result is returned without html
+# as dot, svg, svgz, png or json graph, compressed if the client accepts gzip.
+# Nothing is written to files on the way. The form of the server pages and the
+# render options read from it are kept here for both servers.
+
+# Optional dependency:
+# * zstandard for zstd compressed templates
+
+import json
+import zlib
+import gzip
+import base64
+import heat2dot
+import heat2dot_layout
+import heat2dot_render
+import heat2dot_positions
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+OUTPUT_FORMATS = ["dot", "svg", "svgz", "png", "json"]
+# what is kept in the cache entry for each output format,
+# svgz is the svg compressed when it is sent
+ENTRY_FORMATS = {"dot": "dot", "svg": "svg", "svgz": "svg", "png": "png", "json": "json"}
+# entry formats drawn by graphviz or the built-in layout
+RENDERED_FORMATS = ("svg", "png")
+CONTENT_TYPES = {
+    "dot": "text/vnd.graphviz; charset=utf-8",
+    "svg": "image/svg+xml",
+    "svgz": "image/svg+xml",
+    "png": "image/png",
+    "json": "application/json",
+}
+# outputs sent with gzip Content-Encoding if the client accepts it and they are not smaller
+TEXT_FORMATS = ("dot", "svg", "json")
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_LEVEL = 6
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+# zstd input is decompressed in slices of this size, each one expands to a few MiB at most
+ZSTD_SLICE = 1024
+
+# a request that cannot be served, status is the http status
+class ApiError(Exception):
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+# page and api form of the servers, the api takes its fields as query parameters
+FORM = ("<form method=\"POST\" action=\"convert\">"
+        "Enter json or yaml text:<br/>"
+        "<textarea name=\"text\"></textarea><br/>"
+        "Level of detail: <select name=\"detail\">"
+        +"".join("<option>"+detail+"</option>" for detail in heat2dot.DETAIL_LEVELS)+
+        "</select><br/>"
+        "Only draw: <select name=\"query\"><option value=\"\">everything</option>"
+        +"".join("<option>"+kind+"</option>" for kind in heat2dot.QUERY_KINDS)+
+        "</select> resource <input name=\"resource\"/> hops <input name=\"hops\" value=\"1\" size=\"3\"/><br/>"
+        "Layout: <select name=\"engine\">"
+        +"".join("<option>"+engine+"</option>" for engine in heat2dot_render.LAYOUT_ENGINES)+
+        "</select> stack name <input name=\"stack\"/><br/>"
+        "<input type=\"submit\"/>"
+        "</form>")
+
+# render options from the form fields (or query parameters) of a request, None if invalid
+# query is [kind, resource name, hops] or None for the whole graph
+# stack names the stack whose layout positions are kept, see heat2dot_positions.stackId
+def formOptions(form, nodeBudget=None, diagnosticLimit=heat2dot.DIAGNOSTIC_LIMIT):
+    options = {"format": "svg", "detail": form.get("detail", heat2dot.DETAIL_FULL), "nodeBudget": nodeBudget, "query": None,
+               "diagnosticLimit": diagnosticLimit, "engine": form.get("engine", heat2dot_render.ENGINE_AUTO),
+               "stack": form.get("stack") or None}
+    if options["detail"] not in heat2dot.DETAIL_LEVELS or options["engine"] not in heat2dot_render.LAYOUT_ENGINES:
+        return None
+    kind = form.get("query", "")
+    if kind != "":
+        name = form.get("resource") or None
+        try:
+            hops = int(form.get("hops", 1))
+        except ValueError:
+            return None
+        if kind not in heat2dot.QUERY_KINDS or hops < 0 or (name == None and kind != heat2dot.QUERY_BROKEN):
+            return None
+        options["query"] = [kind, name, hops]
+    return options
+
+# output format of a request, sets the entry format of the render options
+# None if the format is unknown or the options are invalid (see formOptions)
+def apiFormat(options, query):
+    outputFormat = query.get("format", "svg")
+    if options == None or outputFormat not in OUTPUT_FORMATS:
+        return None
+    options["format"] = ENTRY_FORMATS[outputFormat]
+    # the built-in layout only writes svg
+    if options.get("engine") == heat2dot_render.ENGINE_BUILTIN and options["format"] == "png":
+        return None
+    return outputFormat
+
+# template bytes of a request body with Content-Encoding contentEncoding
+# at most limit bytes are decompressed, larger templates are rejected
+# bodies without the magic number of their encoding were already decoded by the
+# web framework (aiohttp does so for gzip) and are passed on
+def decodeBody(data, contentEncoding, limit):
+    encoding = (contentEncoding or "identity").strip().lower()
+    if encoding in ("gzip", "x-gzip") and data.startswith(GZIP_MAGIC):
+        decompressor = zlib.decompressobj(16+zlib.MAX_WBITS)
+        try:
+            data = decompressor.decompress(data, limit+1)
+        except zlib.error as e:
+            raise ApiError(400, "Invalid gzip body: "+str(e))
+        if not decompressor.eof and len(data) <= limit:
+            raise ApiError(400, "Truncated gzip body")
+    elif encoding == "zstd" and data.startswith(ZSTD_MAGIC):
+        if zstandard == None:
+            raise ApiError(415, "zstd bodies need the zstandard module")
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+        chunks = []
+        size = 0
+        try:
+            for start in range(0, len(data), ZSTD_SLICE):
+                chunk = decompressor.decompress(data[start:start+ZSTD_SLICE])
+                chunks.append(chunk)
+                size += len(chunk)
+                if size > limit or decompressor.eof:
+                    break
+        except zstandard.ZstdError as e:
+            raise ApiError(400, "Invalid zstd body: "+str(e))
+        if not decompressor.eof and size <= limit:
+            raise ApiError(400, "Truncated zstd body")
+        data = b"".join(chunks)
+    elif encoding not in ("identity", "gzip", "x-gzip", "zstd"):
+        raise ApiError(415, "Unsupported Content-Encoding "+encoding)
+    if len(data) > limit:
+        raise ApiError(413, "Template larger than %d bytes" % limit)
+    return data
+
+# true if an Accept-Encoding header allows gzip
+def acceptsGzip(acceptEncoding):
+    if acceptEncoding == None:
+        return False
+    accepted = {}
+    for item in acceptEncoding.split(","):
+        parts = item.strip().split(";")
+        quality = 1.0
+        for parameter in parts[1:]:
+            name, _, value = parameter.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[parts[0].strip().lower()] = quality
+    return accepted.get("gzip", accepted.get("x-gzip", accepted.get("*", 0.0))) > 0
+
+# keep rendered data in a cache entry, entries are json so png is kept as base64
+def setOutput(entry, entryFormat, data):
+    if entryFormat == "png":
+        entry["png"] = base64.b64encode(data).decode("ascii")
+    else:
+        entry[entryFormat] = data.decode("UTF-8")
+
+# the drawn graph of a converted result as json text
+# nodes have their dot id, resource key and type, label lines, broken state and the
+# key of the server whose cluster they are drawn in, edges are pairs of dot ids
+# the legend is left out
+def graphJson(result):
+    keys = heat2dot_positions.dotKeys(result.graph, result.detail)
+    resources = {}
+    for typeCode,nodes in enumerate(result.graph.nodes):
+        prefix = heat2dot.TYPE_REGISTRY[typeCode].nodeClass.DOT
+        prefix = prefix[:prefix.index("%")]
+        for node in nodes:
+            resources[prefix+str(node.idx)] = (typeCode, node)
+    drawn = heat2dot_layout.parseDot(result.dot)
+    clusters = []
+    for idx,name in enumerate(drawn.clusterNames):
+        if name.startswith("cluster_") and name[8:] in resources:
+            clusters.append({"id": name, "key": resources[name[8:]][1].key, "label": drawn.clusterAttrs[idx].get("label")})
+    nodes = []
+    for idx,dotId in enumerate(drawn.ids):
+        if drawn.layers[idx] == heat2dot_layout.LEGEND_LAYER:
+            continue
+        typeCode, node = resources.get(dotId, (None, None))
+        cluster = drawn.clusters[idx]
+        clusterName = drawn.clusterNames[cluster] if cluster != -1 else ""
+        nodes.append({
+            "id": dotId,
+            "key": keys.get(dotId),
+            "type": heat2dot.TYPE_NAMES[typeCode] if typeCode != None else None,
+            "label": drawn.labels[idx],
+            "broken": node.broken if node != None else False,
+            "server": resources[clusterName[8:]][1].key if clusterName[8:] in resources else None,
+        })
+    edges = [[drawn.ids[fromIdx], drawn.ids[toIdx]] for fromIdx,toIdx in zip(drawn.edgeFrom, drawn.edgeTo)]
+    return json.dumps({"detail": result.detail, "messages": result.messageText(), "nodes": nodes, "clusters": clusters, "edges": edges})
+
+def jsonBody(value):
+    return json.dumps(value).encode("UTF-8")
+
+# status, body and headers of an error response
+def errorResponse(status, message):
+    return status, jsonBody({"success": False, "messages": message}), {"Content-Type": CONTENT_TYPES["json"]}
+
+# status, body and headers of the response to a cache entry
+# failed conversions are answered with 422 and their messages as json
+def entryResponse(entry, outputFormat, acceptEncoding=None):
+    if not entry["success"]:
+        return errorResponse(422, entry["messages"])
+    headers = {"Content-Type": CONTENT_TYPES[outputFormat]}
+    if outputFormat == "png":
+        body = base64.b64decode(entry["png"])
+    else:
+        body = entry[ENTRY_FORMATS[outputFormat]].encode("UTF-8")
+    if outputFormat == "svgz":
+        body = gzip.compress(body, COMPRESS_LEVEL, mtime=0)
+    elif outputFormat in TEXT_FORMATS:
+        headers["Vary"] = "Accept-Encoding"
+        if len(body) >= COMPRESS_MIN_BYTES and acceptsGzip(acceptEncoding):
+            body = gzip.compress(body, COMPRESS_LEVEL, mtime=0)
+            headers["Content-Encoding"] = "gzip"
+    return 200, body, headers
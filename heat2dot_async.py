@@ -0,0 +1,500 @@
+# asyncio based serving mode for heat2dot_server
+# Conversion runs in a process pool, Graphviz runs as a subprocess
+# whose svg output is streamed to the client while it is produced.
+# A client that disconnects cancels its request and kills the layout.
+
+# Dependencies:
+# * aiohttp
+
+import html
+import time
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from aiohttp import web
+import heat2dot
+import heat2dot_api
+import heat2dot_jobs
+import heat2dot_cache
+import heat2dot_render
+import heat2dot_metrics
+import heat2dot_positions
+from heat2dot_render import RenderError, RenderTimeout, RenderQueueFull
+
+PAGE_BEGIN = "<html><head><title>heat2dot</title></head><body>"
+PAGE_END = "</body></html>"
+# parse and convert a template, runs in a worker process
+# returns the cache key of the normalized template (None if parsing failed) and the entry
+# graphs with at least parallelLayoutNodes nodes get the dot text of their
+# connected components in entry["components"], entry["metrics"] holds the
+# stage timings, both are not meant to be cached
+# with profileDir a cProfile profile of the conversion is written there
+# with positions entry["keys"] maps the dot ids to resource keys (see heat2dot_positions.dotKeys), it is not cached either
+# graphs drawn by the built-in layout (see heat2dot_render.chooseEngine with builtinNodes) are
+# rendered right here into entry["svg"], a failure of that render is returned in
+# entry["renderError"], which is not cached
+# options["format"] is what the entry holds besides the dot text, see heat2dot_server.render
+def convertTemplate(text, options, parallelLayoutNodes=None, profileDir=None, positions=False, builtinNodes=None):
+    if profileDir != None:
+        return heat2dot_metrics.profileCall(heat2dot_metrics.profilePath(profileDir), convertTemplate, text, options, parallelLayoutNodes, None, positions,
+                                            builtinNodes)
+    result = heat2dot.DotResult(options["diagnosticLimit"])
+    textobj = heat2dot.parseTemplate(text, result)
+    if textobj == None:
+        return None, {"success": False, "messages": result.messageText(), "dot": None, "svg": None, "components": None, "keys": None,
+                      "renderError": None, "metrics": result.metrics()}
+    key = heat2dot_cache.templateKey(textobj, options)
+    query = None if options["query"] == None else heat2dot.Query(*options["query"])
+    result = heat2dot.convert(textobj, result=result, detail=options["detail"], nodeBudget=options["nodeBudget"], query=query)
+    entry = {"success": result.success, "messages": result.messageText(), "dot": result.dot, "svg": None, "components": None, "keys": None,
+             "renderError": None, "metrics": None}
+    if result.success and options["format"] == "json":
+        entry["json"] = heat2dot_api.graphJson(result)
+    if not result.success or options["format"] not in heat2dot_api.RENDERED_FORMATS:
+        entry["metrics"] = result.metrics()
+        return key, entry
+    if heat2dot_render.chooseEngine(options["engine"], heat2dot.detailNodeCount(result.graph, result.detail), builtinNodes, options["format"]) == heat2dot_render.ENGINE_BUILTIN:
+        start = time.perf_counter()
+        try:
+            heat2dot_api.setOutput(entry, options["format"], heat2dot_render.renderBuiltin(result.dot, options["format"]))
+        except RenderError as e:
+            entry["renderError"] = str(e)
+        result.timings["layout"] = time.perf_counter()-start
+        entry["metrics"] = result.metrics()
+        return key, entry
+    if positions:
+        entry["keys"] = heat2dot_positions.dotKeys(result.graph, result.detail)
+    if parallelLayoutNodes != None and heat2dot.detailNodeCount(result.graph, result.detail) >= parallelLayoutNodes:
+        components = heat2dot.componentDots(result.graph, result.detail)
+        # one component and the legend
+        if len(components) > 2:
+            entry["components"] = components
+    entry["metrics"] = result.metrics()
+    return key, entry
+
+def failurePage(message, status=200):
+    return web.Response(text=PAGE_BEGIN+"Failure<br/><pre>"+html.escape(message)+"</pre>"+PAGE_END, status=status, content_type="text/html")
+
+def svgPage(entry):
+    page = PAGE_BEGIN+entry["svg"]
+    if entry["messages"] != None:
+        page += "<br/><pre>"+html.escape(entry["messages"])+"</pre>"
+    return web.Response(text=page+PAGE_END, content_type="text/html")
+
+# runs dot subprocesses, at most workers at a time
+# at most queueSize renders wait for a worker, further renders are rejected
+class AsyncRenderer:
+    def __init__(self, workers, queueSize, timeout):
+        self.workers = workers
+        self.queueSize = queueSize
+        self.timeout = timeout
+        self.semaphore = asyncio.Semaphore(workers)
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.cancelled = 0
+
+    # render dot text, yields svg chunks as graphviz writes them
+    # with components (see heat2dot.componentDots) they are laid out in parallel
+    # and packed first, the packed graph is drawn instead of dot
+    # positioned dot text has a pos for every node and is drawn without layout
+    # with onLayout the graph is laid out first and the coroutine onLayout is
+    # awaited with the laid out dot text before it is drawn
+    # the process is killed on timeout and when the consumer stops iterating
+    async def stream(self, dot, outputFormat="svg", components=None, positioned=False, onLayout=None):
+        if self.active >= self.workers+self.queueSize:
+            self.rejected += 1
+            raise RenderQueueFull("Render queue is full")
+        self.active += 1
+        try:
+            command = ["dot", "-T"+outputFormat]
+            if components != None or onLayout != None:
+                if components != None:
+                    dot = await self.pack(components)
+                else:
+                    async with self.semaphore:
+                        dot = await self.collect(dot, ["dot", "-Tdot"])
+                if onLayout != None:
+                    await onLayout(dot)
+                positioned = True
+            if positioned:
+                command = heat2dot_render.PACKED_RENDER_COMMAND+["-T"+outputFormat]
+            async with self.semaphore:
+                chunks = self.run(dot, command)
+                try:
+                    async for chunk in chunks:
+                        yield chunk
+                finally:
+                    await chunks.aclose()
+            self.completed += 1
+        except RenderTimeout:
+            self.timeouts += 1
+            self.failed += 1
+            raise
+        except RenderError:
+            self.failed += 1
+            raise
+        except (asyncio.CancelledError, GeneratorExit):
+            self.cancelled += 1
+            raise
+        finally:
+            self.active -= 1
+
+    # lay out the components on the workers and pack them with gvpack
+    # every batch of components takes a worker, packing runs outside of the pool
+    async def pack(self, components):
+        async def layout(batch):
+            async with self.semaphore:
+                return await self.collect("".join(batch), ["dot", "-Tdot"])
+
+        batches = heat2dot_render.batchBySize(components, self.workers)
+        laidOut = await asyncio.gather(*[layout(batch) for batch in batches])
+        return await self.collect(b"".join(laidOut), heat2dot_render.PACK_COMMAND)
+
+    async def collect(self, data, command):
+        chunks = self.run(data, command)
+        try:
+            return b"".join([chunk async for chunk in chunks])
+        finally:
+            await chunks.aclose()
+
+    # run a graphviz command with data on stdin, yields its output
+    async def run(self, data, command):
+        if isinstance(data, str):
+            data = data.encode("UTF-8")
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()+self.timeout
+        try:
+            process = await asyncio.create_subprocess_exec(*command,
+                stdin=asyncio.subprocess.PIPE,stdout=asyncio.subprocess.PIPE,stderr=asyncio.subprocess.PIPE)
+        except OSError as e:
+            raise RenderError("Failed to start "+command[0]+": "+str(e))
+        # stderr is drained concurrently so warnings cannot block graphviz
+        stderrTask = asyncio.ensure_future(process.stderr.read())
+        try:
+            process.stdin.write(data)
+            await process.stdin.drain()
+            process.stdin.close()
+            while True:
+                remaining = deadline-loop.time()
+                if remaining <= 0:
+                    raise RenderTimeout("Layout did not finish within "+str(self.timeout)+" seconds")
+                try:
+                    chunk = await asyncio.wait_for(process.stdout.read(64*1024), remaining)
+                except asyncio.TimeoutError:
+                    raise RenderTimeout("Layout did not finish within "+str(self.timeout)+" seconds")
+                if not chunk:
+                    break
+                yield chunk
+            returncode = await process.wait()
+            if returncode != 0:
+                raise RenderError(command[0]+" failed: "+(await stderrTask).decode("UTF-8", "replace"))
+        except (BrokenPipeError, ConnectionResetError):
+            raise RenderError(command[0]+" failed: "+(await stderrTask).decode("UTF-8", "replace"))
+        finally:
+            if process.returncode == None:
+                process.kill()
+                await process.wait()
+            stderrTask.cancel()
+
+    def stats(self):
+        return {
+            "backend": "asyncio",
+            "workers": self.workers,
+            "queueSize": self.queueSize,
+            "pending": self.active,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "cancelled": self.cancelled,
+        }
+
+async def main(request):
+    return web.Response(text=PAGE_BEGIN+heat2dot_api.FORM+PAGE_END, content_type="text/html")
+
+# cached entry of a template or its conversion, used by convert and apiConvert
+# returns the entry and None if it is complete (cached, failed or drawn by the
+# built-in layout, it is cached and recorded then), otherwise the entry and what
+# rendering it needs: (text key, cache key, components, position keys, metrics)
+# raises RenderError if the built-in layout failed
+async def lookupEntry(app, text, options):
+    renderCache = app["cache"]
+    metrics = app["metrics"]
+    loop = asyncio.get_running_loop()
+
+    # cache lookups may read from disk
+    textKey = heat2dot_cache.textKey(text, options)
+    entry = await loop.run_in_executor(None, renderCache.get, textKey, False)
+    if entry != None:
+        metrics.record(None, "text")
+        return entry, None
+
+    positions = app["positions"]
+    key, entry = await loop.run_in_executor(app["converters"], convertTemplate, text, options, app["parallelLayoutNodes"], app["profileDir"],
+                                            positions != None, app["builtinLayoutNodes"])
+    components = entry.pop("components")
+    keys = entry.pop("keys")
+    renderError = entry.pop("renderError")
+    resultMetrics = entry.pop("metrics")
+    if key == None:
+        metrics.record(resultMetrics, "miss")
+        return entry, None
+    cached = await loop.run_in_executor(None, renderCache.get, key)
+    if cached != None:
+        metrics.record(None, "template")
+        renderCache.alias(textKey, key)
+        return cached, None
+    if renderError != None:
+        metrics.record(resultMetrics, "miss")
+        raise RenderError(renderError)
+    # failed, drawn by the built-in layout in the worker or nothing to draw
+    if not entry["success"] or options["format"] not in heat2dot_api.RENDERED_FORMATS or entry.get(options["format"]) != None:
+        metrics.record(resultMetrics, "miss")
+        await loop.run_in_executor(None, renderCache.put, key, entry)
+        renderCache.alias(textKey, key)
+        return entry, None
+    return entry, (textKey, key, components, keys, resultMetrics)
+
+# dot text and render arguments of an entry, see AsyncRenderer.stream
+# a stack drawn before keeps the positions of its nodes, stack is its name, see heat2dot_positions.stackId
+async def renderArgs(app, dot, components, keys, detail, stack=None):
+    positions = app["positions"]
+    if keys == None:
+        return dot, components, False, None
+    loop = asyncio.get_running_loop()
+    layoutId = heat2dot_positions.stackId(keys, detail, stack)
+    layout = positions.lookup(layoutId)
+    seeded = None
+    if layout != None:
+        seeded = await loop.run_in_executor(None, positions.seed, layoutId, layout, dot, keys)
+    if seeded != None:
+        return seeded, None, True, None
+
+    async def onLayout(laidOut):
+        positions.put(layoutId, await loop.run_in_executor(None, heat2dot_positions.readLayout, laidOut, keys, detail))
+    return dot, components, False, onLayout
+
+async def convert(request):
+    app = request.app
+    renderCache = app["cache"]
+    renderer = app["renderer"]
+    metrics = app["metrics"]
+    loop = asyncio.get_running_loop()
+
+    form = await request.post()
+    if "text" not in form:
+        return web.Response(text=PAGE_BEGIN+"Text not found"+PAGE_END, status=403, content_type="text/html")
+    options = heat2dot_api.formOptions(form, app["nodeBudget"], app["diagnosticLimit"])
+    if options == None:
+        return web.Response(text=PAGE_BEGIN+"Invalid options"+PAGE_END, status=403, content_type="text/html")
+
+    try:
+        entry, pending = await lookupEntry(app, form["text"], options)
+    except RenderError as e:
+        return failurePage(str(e))
+    if pending == None:
+        return svgPage(entry) if entry["success"] else failurePage(entry["messages"])
+    textKey, key, components, keys, resultMetrics = pending
+    dot, components, positioned, onLayout = await renderArgs(app, entry["dot"], components, keys, resultMetrics["detail"], options.get("stack"))
+
+    # the response is only started once graphviz produced the first chunk,
+    # until then failures can still be reported as a normal page
+    start = time.perf_counter()
+    svgChunks = renderer.stream(dot, components=components, positioned=positioned, onLayout=onLayout)
+    layoutSeconds = None
+    try:
+        try:
+            first = await svgChunks.__anext__()
+        except StopAsyncIteration:
+            first = b""
+        except RenderQueueFull:
+            return web.Response(text=PAGE_BEGIN+"Server busy, try again later"+PAGE_END, status=503, content_type="text/html")
+        except RenderError as e:
+            return failurePage(str(e))
+
+        response = web.StreamResponse(headers={"Content-Type": "text/html; charset=utf-8"})
+        await response.prepare(request)
+        await response.write(PAGE_BEGIN.encode("UTF-8"))
+        svg = [first]
+        await response.write(first)
+        try:
+            async for chunk in svgChunks:
+                svg.append(chunk)
+                await response.write(chunk)
+        except RenderError as e:
+            await response.write(("<br/><pre>"+html.escape(str(e))+"</pre>"+PAGE_END).encode("UTF-8"))
+            await response.write_eof()
+            return response
+        layoutSeconds = time.perf_counter()-start
+        await response.write(("<br/><pre>"+html.escape(entry["messages"])+"</pre>"+PAGE_END).encode("UTF-8"))
+        await response.write_eof()
+    finally:
+        await svgChunks.aclose()
+        metrics.record(resultMetrics, "miss", layoutSeconds)
+
+    entry["svg"] = b"".join(svg).decode("UTF-8")
+    await loop.run_in_executor(None, renderCache.put, key, entry)
+    renderCache.alias(textKey, key)
+    return response
+
+def apiResponse(response):
+    status, body, headers = response
+    return web.Response(body=body, status=status, headers=headers)
+
+# options, output format and template of an api request, see heat2dot_api
+# raises ApiError for invalid requests
+async def apiRequest(request):
+    app = request.app
+    options = heat2dot_api.formOptions(request.query, app["nodeBudget"], app["diagnosticLimit"])
+    outputFormat = heat2dot_api.apiFormat(options, request.query)
+    if outputFormat == None:
+        raise heat2dot_api.ApiError(400, "Invalid options")
+    text = heat2dot_api.decodeBody(await request.read(), request.headers.get("Content-Encoding"), app["maxUpload"])
+    return options, outputFormat, text
+
+# cached or newly rendered entry of a template, the output is collected completely
+# raises RenderError, e.g. RenderQueueFull if the renderer is busy
+async def renderEntry(app, text, options):
+    entry, pending = await lookupEntry(app, text, options)
+    if pending == None:
+        return entry
+    renderCache = app["cache"]
+    loop = asyncio.get_running_loop()
+    textKey, key, components, keys, resultMetrics = pending
+    dot, components, positioned, onLayout = await renderArgs(app, entry["dot"], components, keys, resultMetrics["detail"], options.get("stack"))
+    start = time.perf_counter()
+    chunks = app["renderer"].stream(dot, options["format"], components, positioned, onLayout)
+    layoutSeconds = None
+    try:
+        data = b"".join([chunk async for chunk in chunks])
+        layoutSeconds = time.perf_counter()-start
+    finally:
+        await chunks.aclose()
+        app["metrics"].record(resultMetrics, "miss", layoutSeconds)
+    heat2dot_api.setOutput(entry, options["format"], data)
+    await loop.run_in_executor(None, renderCache.put, key, entry)
+    renderCache.alias(textKey, key)
+    return entry
+
+# the template is the request body, the options are query parameters, see heat2dot_api
+# the result is sent once it is complete
+async def apiConvert(request):
+    try:
+        options, outputFormat, text = await apiRequest(request)
+        entry = await renderEntry(request.app, text, options)
+    except heat2dot_api.ApiError as e:
+        return apiResponse(heat2dot_api.errorResponse(e.status, str(e)))
+    except RenderQueueFull:
+        return apiResponse(heat2dot_api.errorResponse(503, "Server busy, try again later"))
+    except RenderError as e:
+        return apiResponse(heat2dot_api.errorResponse(500, str(e)))
+    return apiResponse(heat2dot_api.entryResponse(entry, outputFormat, request.headers.get("Accept-Encoding")))
+
+# queue a render like apiConvert, identical jobs of all replicas are rendered once
+async def submitJob(request):
+    app = request.app
+    jobs = app["jobs"]
+    if jobs == None:
+        return apiResponse(heat2dot_api.errorResponse(404, "Jobs are not enabled, see HEAT2DOT_JOB_DB"))
+    try:
+        options, outputFormat, text = await apiRequest(request)
+    except heat2dot_api.ApiError as e:
+        return apiResponse(heat2dot_api.errorResponse(e.status, str(e)))
+    jobId = heat2dot_jobs.jobId(text, options, outputFormat)
+    state, coalesced = await asyncio.get_running_loop().run_in_executor(None, jobs.submit, jobId, text, options, outputFormat)
+    app["jobWorkers"].notify()
+    return apiResponse(heat2dot_jobs.submitResponse(jobId, state, coalesced))
+
+# the result of a finished job or its state, wait=SECONDS waits for it to finish
+async def getJob(request):
+    jobs = request.app["jobs"]
+    if jobs == None:
+        return apiResponse(heat2dot_api.errorResponse(404, "Jobs are not enabled, see HEAT2DOT_JOB_DB"))
+    try:
+        wait = float(request.query.get("wait", 0))
+    except ValueError:
+        return apiResponse(heat2dot_api.errorResponse(400, "Invalid wait"))
+    loop = asyncio.get_running_loop()
+    deadline = loop.time()+min(wait, heat2dot_jobs.MAX_WAIT)
+    while True:
+        job = await loop.run_in_executor(None, jobs.get, request.match_info["jobId"])
+        if job == None or job["state"] in (heat2dot_jobs.DONE, heat2dot_jobs.FAILED) or loop.time() >= deadline:
+            break
+        await asyncio.sleep(heat2dot_jobs.POLL_INTERVAL)
+    return apiResponse(heat2dot_jobs.jobResponse(job, request.headers.get("Accept-Encoding")))
+
+async def cache(request):
+    return web.json_response(request.app["cache"].stats())
+
+async def render(request):
+    return web.json_response(request.app["renderer"].stats())
+
+async def metricsStats(request):
+    stats = request.app["metrics"].stats()
+    stats["cacheStats"] = request.app["cache"].stats()
+    stats["render"] = request.app["renderer"].stats()
+    if request.app["positions"] != None:
+        stats["positions"] = request.app["positions"].stats()
+    if request.app["jobs"] != None:
+        stats["jobs"] = request.app["jobs"].stats()
+    return web.json_response(stats)
+
+async def startup(app):
+    app["renderer"] = AsyncRenderer(app["workers"], app["queueSize"], app["timeout"])
+    app["converters"] = ProcessPoolExecutor(max_workers=app["workers"])
+    # job workers are threads, their renders run on the event loop
+    if app["jobs"] != None:
+        loop = asyncio.get_running_loop()
+        def renderJob(text, options):
+            return asyncio.run_coroutine_threadsafe(renderEntry(app, text, options), loop).result()
+        app["jobWorkers"] = heat2dot_jobs.JobWorkers(app["jobs"], renderJob, app["jobWorkerCount"])
+
+async def cleanup(app):
+    app["converters"].shutdown()
+
+# parallelLayoutNodes enables parallel layout of connected components for graphs of that size
+# positionCache (a heat2dot_positions.PositionCache) keeps the node positions of drawn stacks
+# graphs with at least builtinLayoutNodes nodes are drawn by the built-in layout, see heat2dot_render.chooseEngine
+# jobStore (a heat2dot_jobs.JobStore) enables the shared job queue, jobWorkers jobs run at a time
+def createApp(renderCache, workers, queueSize, timeout, maxUpload, nodeBudget=None, parallelLayoutNodes=None, profileDir=None,
+              diagnosticLimit=heat2dot.DIAGNOSTIC_LIMIT, positionCache=None, builtinLayoutNodes=heat2dot_render.BUILTIN_LAYOUT_NODES,
+              jobStore=None, jobWorkers=None):
+    app = web.Application(client_max_size=maxUpload)
+    app["cache"] = renderCache
+    app["metrics"] = heat2dot_metrics.PipelineMetrics()
+    app["profileDir"] = profileDir
+    app["nodeBudget"] = nodeBudget
+    app["diagnosticLimit"] = diagnosticLimit
+    if workers < 2 or not heat2dot_render.canPack():
+        parallelLayoutNodes = None
+    app["parallelLayoutNodes"] = parallelLayoutNodes
+    if not heat2dot_render.canDrawPositioned():
+        positionCache = None
+    app["positions"] = positionCache
+    app["builtinLayoutNodes"] = builtinLayoutNodes
+    app["maxUpload"] = maxUpload
+    app["jobs"] = jobStore
+    app["jobWorkerCount"] = jobWorkers or workers
+    app["workers"] = workers
+    app["queueSize"] = queueSize
+    app["timeout"] = timeout
+    app.on_startup.append(startup)
+    app.on_cleanup.append(cleanup)
+    app.router.add_get("/", main)
+    app.router.add_post("/convert", convert)
+    app.router.add_post("/api/convert", apiConvert)
+    app.router.add_post("/jobs", submitJob)
+    app.router.add_get("/jobs/{jobId}", getJob)
+    app.router.add_get("/cache", cache)
+    app.router.add_get("/render", render)
+    app.router.add_get("/metrics", metricsStats)
+    return app
+
+def run(host, port, renderCache, workers, queueSize, timeout, maxUpload=64*1024*1024, nodeBudget=None, parallelLayoutNodes=None, profileDir=None,
+        diagnosticLimit=heat2dot.DIAGNOSTIC_LIMIT, positionCache=None, builtinLayoutNodes=heat2dot_render.BUILTIN_LAYOUT_NODES,
+        jobStore=None, jobWorkers=None):
+    web.run_app(createApp(renderCache, workers, queueSize, timeout, maxUpload, nodeBudget, parallelLayoutNodes, profileDir, diagnosticLimit,
+                          positionCache, builtinLayoutNodes, jobStore, jobWorkers),
+                host=host, port=port)
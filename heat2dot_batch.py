@@ -0,0 +1,201 @@
+#!/usr/bin/python3
+# Converts many heat templates in one run
+# Templates are given as files, directories, glob patterns or a manifest
+# and are converted on a process pool. Outputs are written next to the inputs.
+# Templates whose content did not change since the last run are skipped.
+
+# Dependencies:
+# * PyYaml
+# * Graphviz or numpy for --render
+
+import os
+import sys
+import glob
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import heat2dot
+import heat2dot_render
+
+STATE_FILE = ".heat2dot-batch.json"
+# broken resources listed per template in the summary
+SUMMARY_NAMES = 5
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+# hidden files such as the state file are not templates
+def isTemplate(name):
+    return not name.startswith(".") and os.path.splitext(name)[1].lower() in heat2dot.FORMAT_EXTENSIONS
+
+# expand files, directories and glob patterns to template paths
+def findTemplates(patterns):
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, dirs, files in os.walk(pattern):
+                dirs[:] = sorted(name for name in dirs if not name.startswith("."))
+                for name in sorted(files):
+                    if isTemplate(name):
+                        paths.append(os.path.join(root, name))
+        elif glob.has_magic(pattern):
+            paths.extend(path for path in sorted(glob.glob(pattern, recursive=True)) if os.path.isfile(path))
+        else:
+            paths.append(pattern)
+    return paths
+
+# one path per line, empty lines and lines starting with # are ignored
+def readManifest(path):
+    if path == "-":
+        lines = sys.stdin.read().splitlines()
+        base = ""
+    else:
+        with open(path, "r") as manifestFile:
+            lines = manifestFile.read().splitlines()
+        base = os.path.dirname(path)
+    paths = []
+    for line in lines:
+        line = line.strip()
+        if line == "" or line.startswith("#"):
+            continue
+        paths.append(os.path.join(base, line))
+    return paths
+
+def outputPaths(path, renderFormat):
+    stem = os.path.splitext(path)[0]
+    outputs = [stem+".dot"]
+    if renderFormat != None:
+        outputs.append(stem+"."+renderFormat)
+    return outputs
+
+def writeFile(path, data):
+    tmpPath = path+".tmp"
+    with open(tmpPath, "wb") as outFile:
+        outFile.write(data)
+    os.replace(tmpPath, path)
+
+# convert one template, runs in a worker process
+# job is (path, renderFormat, timeout, detail, nodeBudget, layout engine, hash of the previous run or None)
+def convertFile(job):
+    path, renderFormat, timeout, detail, nodeBudget, engine, previousHash = job
+    summary = {"path": path, "status": "failed", "hash": None, "broken": [], "messages": 0, "error": None}
+    try:
+        text, formatHint = heat2dot.readTemplate(path)
+    except OSError as e:
+        summary["error"] = str(e)
+        return summary
+
+    digest = hashlib.sha256(text)
+    digest.update(json.dumps([renderFormat, detail, nodeBudget, engine]).encode("UTF-8"))
+    summary["hash"] = digest.hexdigest()
+    outputs = outputPaths(path, renderFormat)
+    if summary["hash"] == previousHash and all(os.path.exists(output) for output in outputs):
+        summary["status"] = "unchanged"
+        return summary
+
+    result = heat2dot.convert(text, formatHint=formatHint, detail=detail, nodeBudget=nodeBudget)
+    text = None
+    summary["messages"] = len(result.messages)
+    if not result.success:
+        summary["error"] = result.messageText()
+        return summary
+    for nodes in result.graph.nodes:
+        for node in nodes:
+            if node.broken:
+                summary["broken"].append(node.key)
+
+    try:
+        dot = result.dot.encode("UTF-8")
+        writeFile(outputs[0], dot)
+        if renderFormat != None:
+            if heat2dot_render.chooseEngine(engine, heat2dot.detailNodeCount(result.graph, result.detail), outputFormat=renderFormat) == heat2dot_render.ENGINE_BUILTIN:
+                writeFile(outputs[1], heat2dot_render.renderBuiltin(dot, renderFormat))
+            else:
+                writeFile(outputs[1], heat2dot_render.renderProcess(dot, renderFormat, timeout))
+    except (OSError, heat2dot_render.RenderError) as e:
+        summary["error"] = str(e)
+        return summary
+    summary["status"] = "converted"
+    return summary
+
+def loadState(path):
+    try:
+        with open(path, "r") as stateFile:
+            return json.load(stateFile)
+    except (OSError, ValueError):
+        return {}
+
+def saveState(path, state):
+    writeFile(path, json.dumps(state, indent=1, sort_keys=True).encode("UTF-8"))
+
+def printSummary(summaries):
+    counts = {"converted": 0, "unchanged": 0, "failed": 0}
+    brokenTemplates = 0
+    brokenResources = 0
+    for summary in summaries:
+        counts[summary["status"]] += 1
+        if summary["status"] == "failed":
+            eprint(summary["path"]+": failed: "+(summary["error"] or "").strip())
+        if summary["broken"]:
+            brokenTemplates += 1
+            brokenResources += len(summary["broken"])
+            names = summary["broken"][:SUMMARY_NAMES]
+            if len(summary["broken"]) > SUMMARY_NAMES:
+                names.append("...")
+            eprint(summary["path"]+": "+str(len(summary["broken"]))+" broken resources: "+", ".join(names))
+    eprint("------")
+    eprint("%d templates: %d converted, %d unchanged, %d failed" % (len(summaries), counts["converted"], counts["unchanged"], counts["failed"]))
+    eprint("%d broken resources in %d templates" % (brokenResources, brokenTemplates))
+    eprint("------")
+
+def main():
+    parser = argparse.ArgumentParser(description="Generates dot graphs for many heat templates")
+    parser.add_argument("templates", nargs="*", help="template files, directories or glob patterns")
+    parser.add_argument("--manifest", help="file listing one template per line, - for stdin")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="worker processes")
+    parser.add_argument("--render", metavar="FORMAT", help="also render with Graphviz, e.g. svg")
+    parser.add_argument("--engine", choices=heat2dot_render.LAYOUT_ENGINES, default=heat2dot_render.ENGINE_AUTO,
+                        help="layout for --render, builtin is a fast layered layout writing svg, auto uses it for large graphs and without Graphviz")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds per Graphviz layout")
+    parser.add_argument("--detail", choices=heat2dot.DETAIL_LEVELS, default=heat2dot.DETAIL_FULL, help="level of detail, default full")
+    parser.add_argument("--node-budget", type=int, help="use coarser levels of detail until at most this many nodes are drawn")
+    parser.add_argument("--state", default=STATE_FILE, help="content hashes of the last run")
+    parser.add_argument("--force", action="store_true", help="convert unchanged templates too")
+    args = parser.parse_args()
+
+    paths = findTemplates(args.templates)
+    if args.manifest != None:
+        paths.extend(readManifest(args.manifest))
+    if not paths:
+        parser.error("no templates given")
+
+    state = loadState(args.state)
+    jobs = []
+    for path in paths:
+        previous = state.get(os.path.abspath(path))
+        previousHash = previous["hash"] if previous != None and not args.force else None
+        jobs.append((path, args.render, args.timeout, args.detail, args.node_budget, args.engine, previousHash))
+
+    # small chunks keep the workers busy when template sizes differ a lot
+    chunksize = max(1, min(16, len(jobs)//(args.jobs*4)))
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        summaries = list(executor.map(convertFile, jobs, chunksize=chunksize))
+
+    for summary in summaries:
+        key = os.path.abspath(summary["path"])
+        if summary["status"] == "unchanged":
+            # keep the broken resources found when it was converted
+            summary["broken"] = state[key].get("broken", [])
+        elif summary["status"] == "converted":
+            state[key] = {"hash": summary["hash"], "broken": summary["broken"]}
+        else:
+            state.pop(key, None)
+    saveState(args.state, state)
+
+    printSummary(summaries)
+    if any(summary["status"] == "failed" for summary in summaries):
+        exit(1)
+
+if __name__ == '__main__':
+    main()
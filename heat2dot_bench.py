@@ -0,0 +1,256 @@
+#!/usr/bin/python3
+# Benchmark for heat2dot conversion
+# Generates synthetic heat templates of configurable size and shape,
+# times the conversion stages and the /convert server path under load
+# and stores results as json lines to compare runs against each other
+
+import os
+import json
+import time
+import random
+import platform
+import argparse
+import threading
+import subprocess
+import tracemalloc
+import urllib.error
+import urllib.parse
+import urllib.request
+import yaml
+import heat2dot
+
+# relative slowdown reported as regression by --compare
+REGRESSION_THRESHOLD = 0.1
+
+# generate a template with roughly the given number of resources
+# each net gets a subnet, a router interface to one of the routers,
+# floatingsPerNet floating ips and servers with portsPerServer ports
+# brokenShare of the ports and servers reference resources that do not exist
+def generateTemplate(resourceCount, serversPerNet=10, portsPerServer=2, routers=1, floatingsPerNet=1, brokenShare=0.0, seed=0):
+    rand = random.Random(seed)
+    resources = {}
+    for routerIdx in range(routers):
+        router = "router"+str(routerIdx)
+        resources[router] = {"type":"OS::Neutron::Router","properties":{"name":router+":r"}}
+    netIdx = 0
+    while len(resources) < resourceCount:
+        net = "net"+str(netIdx)
+        subnet = "subnet"+str(netIdx)
+        router = "router"+str(netIdx%routers)
+        resources[net] = {"type":"OS::Neutron::Net","properties":{"name":net+":n"}}
+        resources[subnet] = {"type":"OS::Neutron::Subnet","properties":{
+            "name":subnet+":s",
+            "cidr":"10."+str(netIdx//256%256)+"."+str(netIdx%256)+".0/24",
+            "gateway_ip":"10."+str(netIdx//256%256)+"."+str(netIdx%256)+".1",
+            "network":{"get_resource":net}}}
+        resources["ri:"+str(netIdx)+":"+router] = {"type":"OS::Neutron::RouterInterface","properties":{
+            "router":{"get_resource":router},
+            "subnet":{"get_resource":subnet}}}
+        for serverIdx in range(serversPerNet):
+            server = "server"+str(netIdx)+"_"+str(serverIdx)
+            networks = []
+            for portIdx in range(portsPerServer):
+                port = "port"+str(netIdx)+"_"+str(serverIdx)+"_"+str(portIdx)
+                portNet = net
+                if rand.random() < brokenShare:
+                    portNet = "missing_"+net
+                resources[port] = {"type":"OS::Neutron::Port","properties":{
+                    "name":port+":p:"+str(portIdx),
+                    "network":{"get_resource":portNet}}}
+                if rand.random() < brokenShare:
+                    port = "missing_"+port
+                networks.append({"port":{"get_resource":port}})
+            resources[server] = {"type":"OS::Nova::Server","properties":{
+                "name":server+":vm",
+                "networks":networks}}
+        for floatingIdx in range(min(floatingsPerNet, serversPerNet)):
+            resources["fip"+str(netIdx)+"_"+str(floatingIdx)] = {"type":"OS::Neutron::FloatingIP","properties":{
+                "port_id":{"get_resource":"port"+str(netIdx)+"_"+str(floatingIdx)+"_0"}}}
+        netIdx += 1
+    return {"heat_template_version":"2015-04-30","resources":resources}
+
+def templateText(template, templateFormat):
+    if templateFormat == "json":
+        return json.dumps(template).encode("UTF-8")
+    return yaml.dump(template, Dumper=getattr(yaml, "CSafeDumper", yaml.SafeDumper)).encode("UTF-8")
+
+# convert text repeat times, returns the run with the lowest total time
+# and the tracemalloc peak of an additional run if memory is set
+def benchConvert(text, templateFormat, repeat, memory, selective=True):
+    best = None
+    for run in range(repeat):
+        start = time.perf_counter()
+        result = heat2dot.convert(text, formatHint=templateFormat, selective=selective)
+        total = time.perf_counter()-start
+        if not result.success:
+            raise Exception("conversion failed:\n"+result.messageText())
+        if best == None or total < best["total"]:
+            best = {"total": total, "timings": result.timings, "nodes": result.graph.nodeCount(), "edges": result.graph.edgeCount()}
+        result = None
+    if memory:
+        tracemalloc.start()
+        heat2dot.convert(text, formatHint=templateFormat, selective=selective)
+        best["peakBytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return best
+
+# post templates to a running server from concurrency threads
+# every request gets a distinct template if cold is set, so the cache does not answer
+def benchServer(url, template, requestCount, concurrency, cold):
+    texts = []
+    for requestIdx in range(requestCount if cold else 1):
+        if cold:
+            template["resources"]["router0"]["properties"]["name"] = "router0:r"+str(requestIdx)
+        texts.append(urllib.parse.urlencode({"text": json.dumps(template)}).encode("UTF-8"))
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    nextRequest = [0]
+
+    def worker():
+        while True:
+            with lock:
+                requestIdx = nextRequest[0]
+                nextRequest[0] += 1
+            if requestIdx >= requestCount:
+                return
+            body = texts[requestIdx%len(texts)]
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(url.rstrip("/")+"/convert", data=body) as response:
+                    response.read()
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                status = e.code
+            except OSError:
+                status = "error"
+            latency = time.perf_counter()-start
+            with lock:
+                latencies.append(latency)
+                statuses[str(status)] = statuses.get(str(status), 0)+1
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for thread in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter()-start
+    latencies.sort()
+
+    def percentile(share):
+        return latencies[min(len(latencies)-1, int(share*len(latencies)))]
+
+    return {"total": duration, "requestsPerSecond": requestCount/duration, "statuses": statuses,
+            "p50": percentile(0.5), "p95": percentile(0.95), "p99": percentile(0.99), "max": latencies[-1]}
+
+def gitRevision():
+    try:
+        return subprocess.check_output(["git","rev-parse","--short","HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode("UTF-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# records of earlier runs, the last record per benchmark name wins
+def loadResults(path):
+    results = {}
+    with open(path, "r") as resultFile:
+        for line in resultFile:
+            if line.strip():
+                record = json.loads(line)
+                results[record["name"]] = record
+    return results
+
+# compare against earlier records, returns the number of regressions
+def compareResults(records, baseline, threshold):
+    regressions = 0
+    print("benchmark\tbaseline\tcurrent\tchange")
+    for record in records:
+        old = baseline.get(record["name"])
+        if old == None:
+            continue
+        for metric in ("total", "p95", "peakBytes"):
+            if metric not in record or metric not in old or not old[metric]:
+                continue
+            change = record[metric]/old[metric]-1
+            flag = ""
+            if change > threshold:
+                flag = "\tREGRESSION"
+                regressions += 1
+            print(record["name"]+" "+metric+"\t"+"%.4g" % old[metric]+"\t"+"%.4g" % record[metric]+"\t"+"%+.1f%%" % (change*100)+flag)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks heat2dot conversion")
+    parser.add_argument("sizes", nargs="*", type=int, default=[1000, 10000, 100000], help="resource counts")
+    parser.add_argument("--servers-per-net", type=int, default=10)
+    parser.add_argument("--ports-per-server", type=int, default=2)
+    parser.add_argument("--routers", type=int, default=1)
+    parser.add_argument("--floatings-per-net", type=int, default=1)
+    parser.add_argument("--broken-share", type=float, default=0.0, help="share of broken references, 0 to 1")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--format", choices=["json","yaml","both"], default="json", help="template text format")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per size, the fastest is reported")
+    parser.add_argument("--memory", action="store_true", help="measure the tracemalloc peak in an extra run")
+    parser.add_argument("--full-parse", action="store_true", help="parse the whole templates instead of the parts that are drawn")
+    parser.add_argument("--generate", metavar="FILE", help="only write a template of the first size, format from the extension")
+    parser.add_argument("--server", metavar="URL", help="benchmark /convert of a running server instead")
+    parser.add_argument("--requests", type=int, default=100, help="requests per size for --server")
+    parser.add_argument("--concurrency", type=int, default=8, help="parallel clients for --server")
+    parser.add_argument("--cold", action="store_true", help="distinct template per request so the cache misses")
+    parser.add_argument("--output", metavar="FILE", help="append results as json lines")
+    parser.add_argument("--compare", metavar="FILE", help="compare against results stored with --output, exit 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="relative slowdown counted as regression")
+    args = parser.parse_args()
+
+    def generate(size):
+        return generateTemplate(size, args.servers_per_net, args.ports_per_server, args.routers,
+                                args.floatings_per_net, args.broken_share, args.seed)
+
+    if args.generate != None:
+        templateFormat = heat2dot.FORMAT_EXTENSIONS.get(os.path.splitext(args.generate)[1].lower(), "json")
+        with open(args.generate, "wb") as templateFile:
+            templateFile.write(templateText(generate(args.sizes[0]), templateFormat))
+        return
+
+    shape = {"serversPerNet": args.servers_per_net, "portsPerServer": args.ports_per_server, "routers": args.routers,
+             "floatingsPerNet": args.floatings_per_net, "brokenShare": args.broken_share, "seed": args.seed}
+    shapeName = "s%d-p%d-r%d-f%d-b%g" % (args.servers_per_net, args.ports_per_server, args.routers, args.floatings_per_net, args.broken_share)
+    common = {"time": time.time(), "revision": gitRevision(), "python": platform.python_version(),
+              "machine": platform.machine(), "cpus": os.cpu_count(), "libyaml": hasattr(yaml, "CSafeLoader"), "shape": shape}
+    formats = ["json", "yaml"] if args.format == "both" else [args.format]
+
+    records = []
+    for size in args.sizes:
+        template = generate(size)
+        count = len(template["resources"])
+        if args.server != None:
+            record = dict(common, name="server-%s-%d-c%d%s" % (shapeName, count, args.concurrency, "-cold" if args.cold else ""),
+                          resources=count, requests=args.requests, concurrency=args.concurrency, cold=args.cold)
+            record.update(benchServer(args.server, template, args.requests, args.concurrency, args.cold))
+            print("%d resources\t%.1f req/s\tp50 %.3fs\tp95 %.3fs\tp99 %.3fs\t%s" % (count, record["requestsPerSecond"],
+                  record["p50"], record["p95"], record["p99"], json.dumps(record["statuses"])))
+            records.append(record)
+            continue
+        for templateFormat in formats:
+            text = templateText(template, templateFormat)
+            record = dict(common, name="convert-%s-%s-%d%s" % (templateFormat, shapeName, count, "-full" if args.full_parse else ""),
+                          resources=count, format=templateFormat, inputBytes=len(text), selective=not args.full_parse)
+            record.update(benchConvert(text, templateFormat, args.repeat, args.memory, not args.full_parse))
+            record["usPerResource"] = record["total"]/count*1e6
+            stages = " ".join("%s %.3f" % (stage, seconds) for stage,seconds in record["timings"].items())
+            print("%d resources\t%s\t%.3fs\t%.2f us/resource\t%s%s" % (count, templateFormat, record["total"], record["usPerResource"], stages,
+                  "\t%.1f MiB peak" % (record["peakBytes"]/1048576) if "peakBytes" in record else ""))
+            records.append(record)
+        template = None
+
+    if args.output != None:
+        with open(args.output, "a") as resultFile:
+            for record in records:
+                resultFile.write(json.dumps(record, sort_keys=True)+"\n")
+    if args.compare != None:
+        if compareResults(records, loadResults(args.compare), args.threshold) > 0:
+            exit(1)
+
+if __name__ == '__main__':
+    main()
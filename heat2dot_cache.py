@@ -0,0 +1,182 @@
+# Content-addressed cache for heat2dot render results
+# Entries are kept in memory with LRU eviction,
+# optionally backed by a directory on disk
+
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+# key for the raw template text, identical uploads hit without parsing
+def textKey(text, options):
+    if isinstance(text, str):
+        text = text.encode("UTF-8")
+    digest = hashlib.sha256(text)
+    digest.update(json.dumps(options, sort_keys=True).encode("UTF-8"))
+    return "t"+digest.hexdigest()
+
+# parsed template with every mapping as {"m": [[key type, key], value] pairs in key order}
+# yaml mappings can have keys of several types, which json.dumps cannot sort,
+# and the type is kept so that 1 and "1" stay different keys
+def canonical(value):
+    if isinstance(value, dict):
+        items = [((type(key).__name__, str(key)), canonical(item)) for key,item in value.items()]
+        items.sort(key=lambda item: item[0])
+        return {"m": items}
+    if isinstance(value, (list, tuple)):
+        return [canonical(item) for item in value]
+    return value
+
+# key for a parsed template, independent of format, key order and whitespace
+def templateKey(textobj, options):
+    normalized = json.dumps([canonical(textobj), options], sort_keys=True, separators=(",",":"), default=str)
+    return "n"+hashlib.sha256(normalized.encode("UTF-8")).hexdigest()
+
+# approximate size of an entry in bytes
+def entrySize(entry):
+    size = 0
+    for value in entry.values():
+        if isinstance(value, (str, bytes)):
+            size += len(value)
+    return size
+
+class RenderCache:
+    # maxBytes bounds the memory tier, maxDiskBytes the optional disk tier in directory
+    def __init__(self, maxBytes=64*1024*1024, directory=None, maxDiskBytes=1024*1024*1024, maxAliases=4096):
+        self.maxBytes = maxBytes
+        self.directory = directory
+        self.maxDiskBytes = maxDiskBytes
+        self.maxAliases = maxAliases
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+        self.aliases = OrderedDict()
+        self.diskEntries = OrderedDict()
+        self.diskSize = 0
+        self.hits = 0
+        self.diskHits = 0
+        self.misses = 0
+        self.evictions = 0
+        if directory != None:
+            self.loadDirectory()
+
+    # pick up entries of a previous run, oldest first
+    def loadDirectory(self):
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            files.append((stat.st_mtime, name[:-5], stat.st_size))
+        for mtime,key,size in sorted(files):
+            self.diskEntries[key] = size
+            self.diskSize += size
+
+    def diskPath(self, key):
+        return os.path.join(self.directory, key+".json")
+
+    # countMiss=False for lookups that are followed by a lookup under another key
+    def get(self, key, countMiss=True):
+        with self.lock:
+            key = self.aliases.get(key, key)
+            entry = self.entries.get(key)
+            if entry != None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            if key not in self.diskEntries:
+                if countMiss:
+                    self.misses += 1
+                return None
+            self.diskEntries.move_to_end(key)
+        entry = self.readDisk(key)
+        with self.lock:
+            if entry == None:
+                if countMiss:
+                    self.misses += 1
+                return None
+            self.diskHits += 1
+            self.storeMemory(key, entry)
+        return entry
+
+    def put(self, key, entry):
+        with self.lock:
+            self.storeMemory(key, entry)
+        if self.directory != None:
+            self.writeDisk(key, entry)
+
+    # make an additional key point to an existing entry
+    def alias(self, aliasKey, key):
+        if aliasKey == key:
+            return
+        with self.lock:
+            self.aliases[aliasKey] = key
+            self.aliases.move_to_end(aliasKey)
+            while len(self.aliases) > self.maxAliases:
+                self.aliases.popitem(last=False)
+
+    # caller holds the lock
+    def storeMemory(self, key, entry):
+        if key in self.entries:
+            self.size -= entrySize(self.entries.pop(key))
+        size = entrySize(entry)
+        if size > self.maxBytes:
+            return
+        self.entries[key] = entry
+        self.size += size
+        while self.size > self.maxBytes:
+            oldKey,oldEntry = self.entries.popitem(last=False)
+            self.size -= entrySize(oldEntry)
+            self.evictions += 1
+
+    def readDisk(self, key):
+        try:
+            with open(self.diskPath(key), "r") as entryFile:
+                return json.load(entryFile)
+        except (OSError, ValueError):
+            with self.lock:
+                if key in self.diskEntries:
+                    self.diskSize -= self.diskEntries.pop(key)
+            return None
+
+    # written to a temporary file first so readers never see partial entries
+    def writeDisk(self, key, entry):
+        data = json.dumps(entry).encode("UTF-8")
+        try:
+            fd, tmpPath = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as entryFile:
+                entryFile.write(data)
+            os.replace(tmpPath, self.diskPath(key))
+        except OSError:
+            return
+        removed = []
+        with self.lock:
+            if key in self.diskEntries:
+                self.diskSize -= self.diskEntries.pop(key)
+            self.diskEntries[key] = len(data)
+            self.diskSize += len(data)
+            while self.diskSize > self.maxDiskBytes and len(self.diskEntries) > 1:
+                oldKey,oldSize = self.diskEntries.popitem(last=False)
+                self.diskSize -= oldSize
+                removed.append(oldKey)
+        for oldKey in removed:
+            try:
+                os.remove(self.diskPath(oldKey))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "diskHits": self.diskHits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "diskEntries": len(self.diskEntries),
+                "diskBytes": self.diskSize,
+            }
@@ -0,0 +1,320 @@
+# Incremental re-conversion of edited heat templates
+# Keeps the resolved graph and the resources of the previous version.
+# Resources are diffed by key and content, only changed resources and the
+# resources referring to them are resolved again and the dot text is patched.
+#
+# Usage:
+#   converter = heat2dot_incremental.IncrementalConverter()
+#   result = converter.update(text)   # same result as heat2dot.convert(text)
+#   ... edit ...
+#   result = converter.update(text)
+
+import heat2dot
+from heat2dot import SERVER, PORT, NODE_TYPE_COUNT, TYPE_REGISTRY
+from heat2dot import REFERENCED_TYPES, CLUSTER_ATTRIBUTES, EDGE_TYPES
+
+# get_resource references of a resource as (target type code, name), see heat2dot.readResource
+def resourceReferences(refs):
+    return [(field.targetType, name) for field,name in zip(refs[1::3], refs[2::3]) if isinstance(name, str)]
+
+# dot text of the edges owned by a node, see heat2dot.buildEdges
+def edgeText(typeCode, idx, node):
+    text = ""
+    for kind,fromIdx,toIdx in heat2dot.nodeEdges(typeCode, idx, node):
+        text += EDGE_TYPES[kind][2] % (fromIdx, toIdx)+"\n"
+    return text
+
+# with a heat2dot_nested.TemplateLoader nested templates are loaded and expanded
+class IncrementalConverter:
+    def __init__(self, loader=None):
+        self.loader = loader
+        self.graph = None
+        # resource keys per type code in template order
+        self.keys = None
+        # per resource key
+        self.resources = {}
+        self.names = {}
+        self.refs = {}
+        # diagnostics per resource key as DotResult.report arguments,
+        # found while reading the resource and while resolving its references
+        self.readReports = {}
+        self.refReports = {}
+        # (target type code, name) -> keys of resources referring to it
+        self.dependents = {}
+        self.indexes = None
+        # per referenced type code: properties.name -> set of indexes
+        self.nameHolders = None
+        # resource key -> (type code, index)
+        self.positions = {}
+        # dot text per node: server clusters, node lines and edges
+        self.nodeText = None
+        self.edgeText = None
+        # statistics of the last update
+        self.resolvedCount = 0
+        self.fullRebuild = False
+
+    # convert a new version of the template
+    # returns a DotResult like heat2dot.convert
+    # the resources of a parsed template are kept for the next diff,
+    # so a template passed as object must not be modified afterwards
+    def update(self, template, formatHint=None):
+        result = heat2dot.DotResult()
+        text = None
+        if isinstance(template, (str, bytes)):
+            text = template
+            template = heat2dot.parseTemplate(text, result, formatHint)
+            if template == None:
+                return result
+        template = heat2dot.expandTemplate(template, result, self.loader, text, formatHint)
+        resources = heat2dot.templateResources(template, result)
+        template = None
+        if resources == None:
+            return result
+
+        # classified like heat2dot.buildGraph does, order holds every resource
+        # in template order with the problems found in its type
+        classified = [[] for typeCode in range(NODE_TYPE_COUNT)]
+        order = []
+        withouttype = 0
+        others = {}
+        for key,obj in resources:
+            typeReports = []
+
+            def report(*args):
+                typeReports.append(args)
+
+            typeCode = heat2dot.classifyResource(key, obj, report)
+            if typeCode == None:
+                if isinstance(obj, dict) and "type" in obj:
+                    others[str(obj["type"])] = others.get(str(obj["type"]), 0) + 1
+                else:
+                    withouttype += 1
+            else:
+                classified[typeCode].append((key, obj))
+            order.append((key, typeCode, typeReports))
+
+        keys = [[key for key,obj in objs] for objs in classified]
+        if self.graph == None or not self.appendOnly(keys):
+            self.rebuild(classified, keys)
+        else:
+            self.patch(classified, keys)
+
+        result.graph = self.graph
+        for key,typeCode,typeReports in order:
+            for args in typeReports:
+                result.report(*args)
+            if typeCode != None:
+                for args in self.readReports[key]:
+                    result.report(*args)
+        for key,typeCode,typeReports in order:
+            if typeCode != None:
+                for args in self.refReports[key]:
+                    result.report(*args)
+        heat2dot.logCounts(result, [len(typeKeys) for typeKeys in keys], withouttype, others)
+        result.logOmitted()
+        result.dot = self.dotText()
+        result.success = True
+        return result
+
+    # true if every type only gained resources at the end of its list,
+    # then all existing nodes keep their index
+    def appendOnly(self, keys):
+        for typeCode in range(NODE_TYPE_COUNT):
+            oldKeys = self.keys[typeCode]
+            if keys[typeCode][:len(oldKeys)] != oldKeys:
+                return False
+        return True
+
+    def rebuild(self, classified, keys):
+        self.graph = heat2dot.Graph()
+        self.keys = keys
+        self.resources = {}
+        self.names = {}
+        self.refs = {}
+        self.readReports = {}
+        self.refReports = {}
+        self.dependents = {}
+        self.positions = {}
+        for typeCode in range(NODE_TYPE_COUNT):
+            for idx,key in enumerate(keys[typeCode]):
+                self.positions[key] = (typeCode, idx)
+        self.indexes = [None]*NODE_TYPE_COUNT
+        self.nameHolders = [None]*NODE_TYPE_COUNT
+        for typeCode in REFERENCED_TYPES:
+            names = {}
+            typeKeys = {}
+            for idx,(key,obj) in enumerate(classified[typeCode]):
+                typeKeys.setdefault(key, idx)
+                for name in heat2dot.resourceNames(key, obj)[1:]:
+                    names.setdefault(name, idx)
+            self.indexes[typeCode] = heat2dot.buildIndex(names, typeKeys)
+            self.nameHolders[typeCode] = {}
+        self.nodeText = [[] for typeCode in range(NODE_TYPE_COUNT)]
+        self.edgeText = [[] for typeCode in range(NODE_TYPE_COUNT)]
+        # servers are resolved first but their clusters contain ports and other members
+        for typeCode in range(NODE_TYPE_COUNT):
+            for idx,(key,obj) in enumerate(classified[typeCode]):
+                self.updateNames(typeCode, idx, key, obj)
+                self.resolve(typeCode, idx, key, obj)
+        members = heat2dot.clusterMembers(self.graph)
+        for idx in range(len(self.graph.servers)):
+            self.nodeText[SERVER][idx] = self.serverText(idx, members)
+        heat2dot.buildEdges(self.graph)
+        self.resolvedCount = len(self.resources)
+        self.fullRebuild = True
+
+    # index entry for a name, same precedence as heat2dot.buildIndex:
+    # the first resource with that properties.name, else the resource with that key
+    def indexEntry(self, typeCode, name):
+        holders = self.nameHolders[typeCode].get(name)
+        if holders:
+            return min(holders)
+        position = self.positions.get(name)
+        if position != None and position[0] == typeCode:
+            return position[1]
+        return None
+
+    def patch(self, classified, keys):
+        # appended resources get the next index of their type
+        for typeCode in range(NODE_TYPE_COUNT):
+            for idx in range(len(self.keys[typeCode]), len(keys[typeCode])):
+                self.positions[keys[typeCode][idx]] = (typeCode, idx)
+        self.keys = keys
+
+        changed = []
+        for typeCode in range(NODE_TYPE_COUNT):
+            for idx,(key,obj) in enumerate(classified[typeCode]):
+                if self.resources.get(key) != obj:
+                    changed.append((typeCode, idx))
+
+        redrawServers = set()
+        for typeCode,idx in changed:
+            if typeCode == PORT and idx < len(self.graph.ports):
+                # clusters that contained the port before the change
+                redrawServers.update(self.portServers(idx))
+
+        # references by name only need to be resolved again if an index entry moved
+        todo = set(changed)
+        for typeCode,idx in changed:
+            if typeCode not in REFERENCED_TYPES:
+                continue
+            key, obj = classified[typeCode][idx]
+            oldNames = self.names.get(key, [])
+            self.updateNames(typeCode, idx, key, obj)
+            for name in set(oldNames+self.names[key]):
+                index = self.indexes[typeCode]
+                entry = self.indexEntry(typeCode, name)
+                if index.get(name) == entry:
+                    continue
+                if entry == None:
+                    del index[name]
+                else:
+                    index[name] = entry
+                for dependent in self.dependents.get((typeCode, name), ()):
+                    todo.add(self.positions[dependent])
+
+        for typeCode,idx in sorted(todo):
+            nodes = self.graph.nodes[typeCode]
+            # clusters that contained the member before and after the change
+            if typeCode in CLUSTER_ATTRIBUTES and idx < len(nodes):
+                redrawServers.add(getattr(nodes[idx], CLUSTER_ATTRIBUTES[typeCode]))
+            key, obj = classified[typeCode][idx]
+            self.resolve(typeCode, idx, key, obj)
+            if typeCode == SERVER:
+                redrawServers.add(idx)
+            elif typeCode == PORT:
+                redrawServers.update(self.portServers(idx))
+            elif typeCode in CLUSTER_ATTRIBUTES:
+                redrawServers.add(getattr(nodes[idx], CLUSTER_ATTRIBUTES[typeCode]))
+        redrawServers.discard(None)
+        if redrawServers:
+            members = heat2dot.clusterMembers(self.graph)
+            for idx in redrawServers:
+                self.nodeText[SERVER][idx] = self.serverText(idx, members)
+        heat2dot.buildEdges(self.graph)
+        self.resolvedCount = len(todo)
+        self.fullRebuild = False
+
+    # record the names a resource can be referred to by
+    def updateNames(self, typeCode, idx, key, obj):
+        names = heat2dot.resourceNames(key, obj)
+        if typeCode in REFERENCED_TYPES:
+            holders = self.nameHolders[typeCode]
+            for name in self.names.get(key, [])[1:]:
+                holders[name].discard(idx)
+            for name in names[1:]:
+                holders.setdefault(name, set()).add(idx)
+        self.names[key] = names
+
+    # servers whose cluster contains the port
+    def portServers(self, portIdx):
+        servers = []
+        for name in self.names[self.keys[PORT][portIdx]]:
+            for dependent in self.dependents.get((PORT, name), ()):
+                typeCode,idx = self.positions[dependent]
+                if typeCode == SERVER:
+                    servers.append(idx)
+        return servers
+
+    # resolve one resource and update the node, its text and the reference bookkeeping
+    def resolve(self, typeCode, idx, key, obj):
+        readReports = []
+        refReports = []
+
+        def readReport(*args):
+            readReports.append(args)
+
+        def refReport(*args):
+            refReports.append(args)
+
+        resourceType = TYPE_REGISTRY[typeCode]
+        refs = []
+        node = heat2dot.readResource(resourceType, idx, key, obj, readReport, refs)
+        heat2dot.resolveReferences(refs, self.indexes, refReport)
+        nodes = self.graph.nodes[typeCode]
+        if idx < len(nodes):
+            nodes[idx] = node
+            self.edgeText[typeCode][idx] = edgeText(typeCode, idx, node)
+            self.nodeText[typeCode][idx] = self.nodeLine(typeCode, node)
+        else:
+            nodes.append(node)
+            self.edgeText[typeCode].append(edgeText(typeCode, idx, node))
+            self.nodeText[typeCode].append(self.nodeLine(typeCode, node))
+        self.readReports[key] = readReports
+        self.refReports[key] = refReports
+
+        for ref in self.refs.get(key, ()):
+            self.dependents[ref].discard(key)
+        refs = resourceReferences(refs)
+        for ref in refs:
+            self.dependents.setdefault(ref, set()).add(key)
+        self.refs[key] = refs
+        self.resources[key] = obj
+
+    # server clusters are drawn separately, ports and other members only appear inside them
+    def nodeLine(self, typeCode, node):
+        if typeCode == SERVER or typeCode == PORT:
+            return ""
+        if typeCode in CLUSTER_ATTRIBUTES and getattr(node, CLUSTER_ATTRIBUTES[typeCode]) != None:
+            return ""
+        return node.dot()+"\n"
+
+    # members are the cluster members from heat2dot.clusterMembers
+    def serverText(self, idx, members):
+        server = self.graph.servers[idx]
+        ports = self.graph.ports
+        text = heat2dot.Server.DOT_BEGIN % (idx, server.shortName)+"\n"
+        for portIx in server.portIdx:
+            text += ports[portIx].dot()+"\n"
+        for typeCode,memberIdx in members.get(idx, ()):
+            text += self.graph.nodes[typeCode][memberIdx].dot()+"\n"
+        return text+heat2dot.Server.DOT_END+"\n"
+
+    def dotText(self):
+        parts = ["graph heat {\n"]
+        for typeCode in range(NODE_TYPE_COUNT):
+            parts.extend(self.nodeText[typeCode])
+        for typeCode in range(NODE_TYPE_COUNT):
+            parts.extend(self.edgeText[typeCode])
+        parts.append(heat2dot.legendText(self.graph)+"\n}\n")
+        return "".join(parts)
@@ -0,0 +1,284 @@
+# Shared job queue and result store for heat2dot server replicas
+# Jobs and their results are kept in a SQLite database that all replicas open,
+# e.g. on a volume shared by the containers of one host. A job is identified by
+# its template and options, so identical submissions, also to different replicas,
+# share one job and are rendered once. Every replica runs workers that claim
+# queued jobs; jobs of a replica that stopped sending heartbeats are claimed
+# again by the others.
+
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+import heat2dot_api
+import heat2dot_cache
+from heat2dot_render import RenderQueueFull
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+JOB_STATES = [QUEUED, RUNNING, DONE, FAILED]
+
+# seconds between heartbeats of the running jobs of a replica, running jobs
+# without heartbeat for lease seconds are claimed again
+HEARTBEAT = 5
+LEASE = 30
+# claims of a job before it is failed, e.g. if it keeps killing its replica
+MAX_ATTEMPTS = 3
+# seconds between database polls of idle workers and of waiting requests
+POLL_INTERVAL = 0.25
+# longest wait of a long poll in seconds
+MAX_WAIT = 60
+# finished jobs are kept this many seconds
+TTL = 24*60*60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    format TEXT NOT NULL,
+    options TEXT NOT NULL,
+    template BLOB,
+    entry TEXT,
+    error TEXT,
+    owner TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    submitted REAL NOT NULL,
+    started REAL,
+    heartbeat REAL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, submitted);
+"""
+
+# id of the job rendering a template with options into outputFormat
+def jobId(text, options, outputFormat):
+    return "j"+heat2dot_cache.textKey(text, [options, outputFormat])[1:]
+
+class JobStore:
+    # path is the database file shared by the replicas
+    def __init__(self, path, ttl=TTL, lease=LEASE):
+        self.path = path
+        self.ttl = ttl
+        self.lease = lease
+        self.replica = socket.gethostname()+"-"+uuid.uuid4().hex[:8]
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.coalesced = 0
+        self.completed = 0
+        self.failed = 0
+        self.reclaimed = 0
+        self.connection().executescript(SCHEMA)
+
+    # one connection per thread, sqlite connections cannot be shared
+    def connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection == None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            # readers do not block the writer
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return connection
+
+    # run function(connection) in a write transaction
+    def transaction(self, function):
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            value = function(connection)
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return value
+
+    # queue a job unless the same one is queued, running or done already
+    # failed jobs are queued again, returns the state and true if an existing job was joined
+    def submit(self, jobId, text, options, outputFormat):
+        if isinstance(text, str):
+            text = text.encode("UTF-8")
+        def submitJob(connection):
+            row = connection.execute("SELECT state FROM jobs WHERE id=?", (jobId,)).fetchone()
+            if row != None and row[0] != FAILED:
+                return row[0], True
+            connection.execute("INSERT OR REPLACE INTO jobs (id, state, format, options, template, submitted, attempts) VALUES (?, ?, ?, ?, ?, ?, 0)",
+                               (jobId, QUEUED, outputFormat, json.dumps(options), text, time.time()))
+            return QUEUED, False
+        state, coalesced = self.transaction(submitJob)
+        with self.lock:
+            self.submitted += 1
+            if coalesced:
+                self.coalesced += 1
+        return state, coalesced
+
+    # take the oldest queued job or a running one whose replica stopped,
+    # returns (job id, template, options) or None
+    def claim(self):
+        now = time.time()
+        def claimJob(connection):
+            while True:
+                row = connection.execute("SELECT id, template, options, state, attempts FROM jobs WHERE state=? OR (state=? AND heartbeat<?) "
+                                         "ORDER BY submitted LIMIT 1", (QUEUED, RUNNING, now-self.lease)).fetchone()
+                if row == None:
+                    return None
+                jobId, text, options, state, attempts = row
+                if attempts >= MAX_ATTEMPTS:
+                    connection.execute("UPDATE jobs SET state=?, error=?, template=NULL, finished=? WHERE id=?",
+                                       (FAILED, "Gave up after %d attempts" % attempts, now, jobId))
+                    continue
+                connection.execute("UPDATE jobs SET state=?, owner=?, attempts=attempts+1, started=?, heartbeat=? WHERE id=?",
+                                   (RUNNING, self.replica, now, now, jobId))
+                return jobId, text, json.loads(options), state
+        job = self.transaction(claimJob)
+        if job == None:
+            return None
+        if job[3] == RUNNING:
+            with self.lock:
+                self.reclaimed += 1
+        return job[:3]
+
+    # the jobs of this replica are still running
+    def heartbeat(self):
+        self.transaction(lambda connection: connection.execute("UPDATE jobs SET heartbeat=? WHERE owner=? AND state=?",
+                                                               (time.time(), self.replica, RUNNING)))
+
+    # store the result of a claimed job, unless another replica took it over meanwhile
+    def finish(self, jobId, entry):
+        self.transaction(lambda connection: connection.execute("UPDATE jobs SET state=?, entry=?, template=NULL, finished=? WHERE id=? AND owner=? AND state=?",
+                                                               (DONE, json.dumps(entry), time.time(), jobId, self.replica, RUNNING)))
+        with self.lock:
+            self.completed += 1
+
+    def fail(self, jobId, message):
+        self.transaction(lambda connection: connection.execute("UPDATE jobs SET state=?, error=?, template=NULL, finished=? WHERE id=? AND owner=? AND state=?",
+                                                               (FAILED, message, time.time(), jobId, self.replica, RUNNING)))
+        with self.lock:
+            self.failed += 1
+
+    # put a claimed job back into the queue, e.g. if the renderers are busy
+    def release(self, jobId):
+        self.transaction(lambda connection: connection.execute("UPDATE jobs SET state=?, owner=NULL, attempts=attempts-1 WHERE id=? AND owner=? AND state=?",
+                                                               (QUEUED, jobId, self.replica, RUNNING)))
+
+    # state of a job as dict, the entry is only read for done jobs, None for unknown jobs
+    def get(self, jobId):
+        row = self.connection().execute("SELECT state, format, error, attempts, submitted, started, finished FROM jobs WHERE id=?", (jobId,)).fetchone()
+        if row == None:
+            return None
+        job = {"id": jobId, "state": row[0], "format": row[1], "error": row[2], "attempts": row[3],
+               "submitted": row[4], "started": row[5], "finished": row[6]}
+        if job["state"] == DONE:
+            entry = self.connection().execute("SELECT entry FROM jobs WHERE id=?", (jobId,)).fetchone()
+            if entry == None:
+                return None
+            job["entry"] = json.loads(entry[0])
+        return job
+
+    # block until a job is finished or seconds passed, returns the job as get
+    def wait(self, jobId, seconds):
+        deadline = time.monotonic()+min(seconds, MAX_WAIT)
+        while True:
+            job = self.get(jobId)
+            if job == None or job["state"] in (DONE, FAILED) or time.monotonic() >= deadline:
+                return job
+            time.sleep(POLL_INTERVAL)
+
+    # forget jobs finished more than ttl seconds ago
+    def purge(self):
+        self.transaction(lambda connection: connection.execute("DELETE FROM jobs WHERE state IN (?, ?) AND finished<?",
+                                                               (DONE, FAILED, time.time()-self.ttl)))
+
+    def stats(self):
+        counts = dict((state, 0) for state in JOB_STATES)
+        for state,count in self.connection().execute("SELECT state, count(*) FROM jobs GROUP BY state"):
+            counts[state] = count
+        with self.lock:
+            return {
+                "replica": self.replica,
+                "jobs": counts,
+                "submitted": self.submitted,
+                "coalesced": self.coalesced,
+                "completed": self.completed,
+                "failed": self.failed,
+                "reclaimed": self.reclaimed,
+            }
+
+# runs claimed jobs on worker threads of this replica
+# handler(text, options) returns the cache entry of a job, see heat2dot_server.render
+class JobWorkers:
+    def __init__(self, store, handler, workers):
+        self.store = store
+        self.handler = handler
+        self.wakeup = threading.Event()
+        self.threads = [threading.Thread(target=self.work, daemon=True) for worker in range(workers)]
+        self.threads.append(threading.Thread(target=self.beat, daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    # wake idle workers, e.g. after a local submit
+    def notify(self):
+        self.wakeup.set()
+
+    def work(self):
+        while True:
+            try:
+                job = self.store.claim()
+            except sqlite3.Error as e:
+                print("Claiming a job failed:", e)
+                job = None
+            if job == None:
+                self.wakeup.wait(4*POLL_INTERVAL)
+                self.wakeup.clear()
+                continue
+            self.run(*job)
+
+    def run(self, jobId, text, options):
+        try:
+            entry = self.handler(text, options)
+        except RenderQueueFull:
+            self.store.release(jobId)
+            time.sleep(POLL_INTERVAL)
+            return
+        except Exception as e:
+            self.store.fail(jobId, str(e))
+            return
+        self.store.finish(jobId, entry)
+
+    # heartbeats of the running jobs, finished jobs are purged now and then
+    def beat(self):
+        beats = 0
+        while True:
+            time.sleep(HEARTBEAT)
+            try:
+                self.store.heartbeat()
+                if beats%60 == 0:
+                    self.store.purge()
+            except sqlite3.Error as e:
+                print("Job heartbeat failed:", e)
+            beats += 1
+
+# status, body and headers answering a job
+# finished jobs are answered like heat2dot_api.entryResponse, others with their state
+def jobResponse(job, acceptEncoding=None):
+    if job == None:
+        return heat2dot_api.errorResponse(404, "Unknown job")
+    if job["state"] == DONE:
+        return heat2dot_api.entryResponse(job["entry"], job["format"], acceptEncoding)
+    if job["state"] == FAILED:
+        return heat2dot_api.errorResponse(500, job["error"])
+    return 202, heat2dot_api.jsonBody(statusJson(job)), {"Content-Type": heat2dot_api.CONTENT_TYPES["json"], "Retry-After": "1"}
+
+def statusJson(job):
+    return {"id": job["id"], "state": job["state"], "href": "/jobs/"+job["id"], "attempts": job["attempts"],
+            "submitted": job["submitted"], "started": job["started"]}
+
+# status, body and headers answering a submit
+def submitResponse(jobId, state, coalesced):
+    status = 200 if state == DONE else 202
+    body = {"id": jobId, "state": state, "coalesced": coalesced, "href": "/jobs/"+jobId}
+    return status, heat2dot_api.jsonBody(body), {"Content-Type": heat2dot_api.CONTENT_TYPES["json"], "Location": "/jobs/"+jobId}
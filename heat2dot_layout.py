@@ -0,0 +1,511 @@
+# Built-in layout and svg writer for heat2dot graphs
+# Graphviz dot does not finish on graphs with tens of thousands of nodes and
+# is not installed everywhere. This engine lays out the dot text written by
+# heat2dot.iterDot in layers following the heat topology, floating ips, ports
+# in their server clusters, nets, subnets, router interfaces and routers,
+# and writes svg directly. The order within the layers is improved by
+# barycenter sweeps, x coordinates are the closest ones to the neighbours that
+# keep the order (isotonic regression), so every step is n log n at most.
+# Edges are drawn as straight lines.
+
+# Dependencies:
+# * numpy
+
+import re
+import html
+import heat2dot
+import heat2dot_positions
+from heat2dot_render import RenderError
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# layer of every node type, top to bottom
+TYPE_LAYERS = {
+    heat2dot.FLOATINGIP: 0,
+    heat2dot.POOL: 0,
+    heat2dot.SERVER: 1,
+    heat2dot.PORT: 1,
+    heat2dot.VOLUMEATTACHMENT: 1,
+    heat2dot.POOLMEMBER: 1,
+    heat2dot.SECURITYGROUP: 2,
+    heat2dot.VOLUME: 2,
+    heat2dot.NET: 3,
+    heat2dot.SUBNET: 4,
+    heat2dot.ROUTERINTERFACE: 5,
+    heat2dot.ROUTER: 6,
+}
+# nodes of unknown types and of the legend
+OTHER_LAYER = 2
+LEGEND_LAYER = -1
+
+# node type of every dot id prefix
+ID_TYPES = dict((resourceType.nodeClass.DOT[:resourceType.nodeClass.DOT.index("%")], resourceType.code)
+                for resourceType in heat2dot.TYPE_REGISTRY)
+NODE_ID = re.compile(r'([A-Za-z]+?)(\d+|legend)$')
+# graph attributes of clusters, e.g. label="web";
+GRAPH_ATTRIBUTE = re.compile(r'(\w+)=("(?:[^"\\]|\\.)*"|[^;]*);$')
+
+# barycenter sweeps ordering the layers and passes placing them
+SWEEPS = 4
+PASSES = 4
+# distances in points
+MARGIN = 8
+NODE_SEP = 18
+BLOCK_SEP = 27
+RANK_SEP = 54
+CLUSTER_PAD = 8
+CLUSTER_LABEL = 22
+BAND_SEP = 108
+# width to height ratio the layers are folded into
+ASPECT = 1.6
+FONT_SIZE = 14
+LINE_HEIGHT = 16
+
+# shapes drawn as polygons, corners relative to the node size
+POLYGONS = {
+    "box": [(-0.5,-0.5),(0.5,-0.5),(0.5,0.5),(-0.5,0.5)],
+    "diamond": [(0,-0.5),(0.5,0),(0,0.5),(-0.5,0)],
+    "triangle": [(0,-0.5),(0.5,0.5),(-0.5,0.5)],
+    "octagon": [(-0.5,-0.2),(-0.2,-0.5),(0.2,-0.5),(0.5,-0.2),(0.5,0.2),(0.2,0.5),(-0.2,0.5),(-0.5,0.2)],
+    "hexagon": [(-0.5,0),(-0.25,-0.5),(0.25,-0.5),(0.5,0),(0.25,0.5),(-0.25,0.5)],
+    "house": [(0,-0.5),(0.5,-0.15),(0.5,0.5),(-0.5,0.5),(-0.5,-0.15)],
+    "invhouse": [(-0.5,-0.5),(0.5,-0.5),(0.5,0.15),(0,0.5),(-0.5,0.15)],
+}
+# shapes that need more room than the label, width and height factors
+SHAPE_SCALES = {
+    "diamond": (1.6, 1.5),
+    "triangle": (1.8, 1.5),
+    "house": (1.2, 1.3),
+    "invhouse": (1.2, 1.3),
+    "hexagon": (1.2, 1.0),
+    "octagon": (1.1, 1.0),
+    "cylinder": (1.0, 1.4),
+}
+
+# true if numpy is installed
+def available():
+    return numpy != None
+
+# nodes, clusters and edges of a heat2dot dot text
+# clusters are indexes into the cluster lists, -1 for nodes outside of clusters
+class LayoutGraph:
+    def __init__(self):
+        self.ids = []
+        self.labels = []
+        self.attrs = []
+        self.layers = []
+        self.clusters = []
+        self.widths = []
+        self.heights = []
+        self.clusterNames = []
+        self.clusterAttrs = []
+        self.clusterParents = []
+        self.edgeFrom = []
+        self.edgeTo = []
+        # coordinates of the node centers and cluster boxes, set by layout
+        self.x = None
+        self.y = None
+        self.boxes = None
+        self.width = 0
+        self.height = 0
+
+    def nodeCount(self):
+        return len(self.ids)
+
+def labelLines(label):
+    return label.replace("\\\"", "\"").split("\\n")
+
+# read the dot text written by heat2dot.iterDot
+def parseDot(dot):
+    graph = LayoutGraph()
+    index = {}
+    opened = []
+    legend = 0
+    # attributes besides the label are shared by the nodes of a type
+    styles = {}
+    for line in dot.split("\n"):
+        # most lines are nodes or edges, the regular expressions are only tried on likely lines
+        match = heat2dot_positions.NODE_LINE.match(line) if line.endswith("];") else None
+        if match != None:
+            dotId, attrText = match.groups()
+            label = heat2dot_positions.LABEL.search(attrText)
+            if label != None:
+                lines = labelLines(label.group(1))
+                attrText = attrText[:label.start()]+attrText[label.end():]
+            else:
+                lines = [dotId]
+            attrs = styles.get(attrText)
+            if attrs == None:
+                attrs = styles[attrText] = heat2dot_positions.attributes(attrText)
+            idMatch = NODE_ID.match(dotId)
+            typeCode = ID_TYPES.get(idMatch.group(1)) if idMatch != None else None
+            if legend > 0:
+                layer = LEGEND_LAYER
+            else:
+                layer = TYPE_LAYERS.get(typeCode, OTHER_LAYER)
+            width, height = heat2dot_positions.labelSize(lines)
+            scale = SHAPE_SCALES.get(attrs.get("shape"), (1, 1))
+            index[dotId] = len(graph.ids)
+            graph.ids.append(dotId)
+            graph.labels.append(lines)
+            graph.attrs.append(attrs)
+            graph.layers.append(layer)
+            graph.clusters.append(opened[-1] if opened else -1)
+            graph.widths.append(width*scale[0])
+            graph.heights.append(height*scale[1])
+            continue
+        match = heat2dot_positions.EDGE_LINE.match(line) if " -- " in line else None
+        if match != None:
+            fromIdx = index.get(match.group(1))
+            toIdx = index.get(match.group(2))
+            if fromIdx != None and toIdx != None:
+                graph.edgeFrom.append(fromIdx)
+                graph.edgeTo.append(toIdx)
+            continue
+        match = heat2dot_positions.CLUSTER_LINE.match(line) if line.startswith("subgraph ") else None
+        if match != None:
+            graph.clusterParents.append(opened[-1] if opened else -1)
+            graph.clusterNames.append(match.group(1))
+            graph.clusterAttrs.append({})
+            opened.append(len(graph.clusterNames)-1)
+            if match.group(1).startswith("cluster_legend"):
+                legend += 1
+        elif line == "}" and opened:
+            if graph.clusterNames[opened.pop()].startswith("cluster_legend"):
+                legend -= 1
+        elif opened:
+            match = GRAPH_ATTRIBUTE.match(line)
+            if match != None:
+                graph.clusterAttrs[opened[-1]][match.group(1)] = heat2dot_positions.unquote(match.group(2))
+    return graph
+
+# pool adjacent violators, the non-decreasing sequence closest to values
+# in the weighted least squares sense
+def isotonic(values, weights):
+    means = []
+    sums = []
+    counts = []
+    for value,weight in zip(values, weights):
+        count = 1
+        while means and means[-1] > value:
+            previousWeight = sums.pop()
+            value = (means.pop()*previousWeight+value*weight)/(previousWeight+weight)
+            weight += previousWeight
+            count += counts.pop()
+        means.append(value)
+        sums.append(weight)
+        counts.append(count)
+    return numpy.repeat(means, counts)
+
+# mean of values[src] for every dst, fallback where a dst has no src
+def neighbourMeans(src, dst, values, nodes, fallback):
+    count = len(values)
+    sums = numpy.bincount(dst, weights=values[src], minlength=count)[nodes]
+    counts = numpy.bincount(dst, minlength=count)[nodes]
+    return numpy.where(counts > 0, sums/numpy.maximum(counts, 1), fallback), counts
+
+# order the nodes of a layer by the barycenters of their neighbours in src
+# members of a block stay together, blocks are ordered by the mean of their members
+def orderLayer(nodes, src, dst, pos, blockOf, blockCount):
+    keys, counts = neighbourMeans(src, dst, pos, nodes, pos[nodes])
+    blocks = blockOf[nodes]
+    blockKeys = numpy.bincount(blocks, weights=keys, minlength=blockCount)/numpy.maximum(numpy.bincount(blocks, minlength=blockCount), 1)
+    nodes = nodes[numpy.lexsort((keys, blocks, blockKeys[blocks]))]
+    pos[nodes] = (numpy.arange(len(nodes))+0.5)/len(nodes)
+    return nodes
+
+# offsets of the nodes of a layer from the center of their block and the block widths
+# blocks are runs of nodes with the same block, clusters are padded
+def packLayer(nodes, widths, blockOf, padding):
+    blocks = blockOf[nodes]
+    starts = numpy.flatnonzero(numpy.concatenate(([True], blocks[1:] != blocks[:-1])))
+    sizes = numpy.diff(numpy.append(starts, len(nodes)))
+    nodeWidths = widths[nodes]
+    spans = numpy.cumsum(nodeWidths+NODE_SEP)
+    blockStart = numpy.repeat(spans[starts]-nodeWidths[starts]-NODE_SEP, sizes)
+    blockPadding = padding[blocks[starts]]
+    blockWidths = numpy.add.reduceat(nodeWidths, starts)+NODE_SEP*(sizes-1)+2*blockPadding
+    offsets = spans-nodeWidths/2-NODE_SEP-blockStart+numpy.repeat(blockPadding-blockWidths/2, sizes)
+    return offsets, starts, sizes, blockWidths
+
+# x positions cutting a drawing of totalWidth into bands of about the same width
+# every cut is the candidate crossed by the fewest edges in a third of a band around
+# the even cut, the edges run from fromX to toX
+def bandCuts(candidates, fromX, toX, totalWidth, bands):
+    starts = numpy.sort(numpy.minimum(fromX, toX))
+    ends = numpy.sort(numpy.maximum(fromX, toX))
+    crossings = numpy.searchsorted(starts, candidates, side="right")-numpy.searchsorted(ends, candidates, side="right")
+    bandWidth = totalWidth/bands
+    cuts = []
+    for band in range(1, bands):
+        even = band*bandWidth
+        distances = numpy.abs(candidates-even)
+        near = numpy.flatnonzero(distances <= bandWidth/3)
+        if len(near) == 0:
+            cuts.append(even)
+        else:
+            cuts.append(candidates[near[numpy.lexsort((distances[near], crossings[near]))[0]]])
+    return numpy.array(cuts)
+
+# lay out a parsed graph, sets the node coordinates, cluster boxes and the size of the drawing
+def layout(graph, sweeps=SWEEPS, passes=PASSES):
+    if numpy == None:
+        raise RenderError("The built-in layout requires numpy")
+    count = graph.nodeCount()
+    layers = numpy.array(graph.layers, dtype=numpy.int64)
+    widths = numpy.array(graph.widths, dtype=numpy.float64)
+    heights = numpy.array(graph.heights, dtype=numpy.float64)
+    x = numpy.zeros(count)
+    y = numpy.zeros(count)
+
+    # clusters outside of the legend are blocks drawn in the layer of their first member
+    blockOf = numpy.zeros(count, dtype=numpy.int64)
+    clusterBlocks = {}
+    padding = []
+    for idx,cluster in enumerate(graph.clusters):
+        if cluster != -1 and graph.layers[idx] != LEGEND_LAYER:
+            if cluster not in clusterBlocks:
+                clusterBlocks[cluster] = (len(padding), layers[idx])
+                padding.append(CLUSTER_PAD)
+            block, layers[idx] = clusterBlocks[cluster]
+        else:
+            block = len(padding)
+            padding.append(0)
+        blockOf[idx] = block
+    blockCount = len(padding)
+    padding = numpy.array(padding, dtype=numpy.float64)
+
+    ranks = [int(layer) for layer in numpy.unique(layers) if layer != LEGEND_LAYER]
+    layerNodes = dict((layer, numpy.flatnonzero(layers == layer)) for layer in ranks)
+    edgeFrom = numpy.array(graph.edgeFrom, dtype=numpy.int64)
+    edgeTo = numpy.array(graph.edgeTo, dtype=numpy.int64)
+    src = numpy.concatenate((edgeFrom, edgeTo))
+    dst = numpy.concatenate((edgeTo, edgeFrom))
+    # edges into each layer from the layers above, below and from any other layer
+    above = {}
+    below = {}
+    other = {}
+    for layer in ranks:
+        into = layers[dst] == layer
+        for edges,mask in ((above, layers[src] < layer), (below, (layers[src] > layer) & (layers[src] != LEGEND_LAYER))):
+            edges[layer] = (src[into & mask], dst[into & mask])
+        mask = into & (layers[src] != layer) & (layers[src] != LEGEND_LAYER)
+        other[layer] = (src[mask], dst[mask])
+
+    # order within the layers
+    pos = numpy.zeros(count)
+    for layer in ranks:
+        nodes = layerNodes[layer]
+        pos[nodes] = (numpy.arange(len(nodes))+0.5)/len(nodes)
+    for sweep in range(sweeps):
+        for layer in ranks[1:]:
+            layerNodes[layer] = orderLayer(layerNodes[layer], above[layer][0], above[layer][1], pos, blockOf, blockCount)
+        for layer in reversed(ranks[:-1]):
+            layerNodes[layer] = orderLayer(layerNodes[layer], below[layer][0], below[layer][1], pos, blockOf, blockCount)
+
+    # blocks packed side by side, then moved towards their neighbours keeping the order
+    packed = {}
+    for layer in ranks:
+        nodes = layerNodes[layer]
+        offsets, starts, sizes, blockWidths = packLayer(nodes, widths, blockOf, padding)
+        separation = numpy.cumsum(numpy.concatenate(([0], (blockWidths[1:]+blockWidths[:-1])/2+BLOCK_SEP)))
+        packed[layer] = (offsets, starts, sizes, separation)
+        centers = separation-separation[-1]/2
+        x[nodes] = numpy.repeat(centers, sizes)+offsets
+    order = ranks[1:]+list(reversed(ranks[:-1]))
+    for placement in range(passes):
+        for layer in order:
+            nodes = layerNodes[layer]
+            offsets, starts, sizes, separation = packed[layer]
+            desired, counts = neighbourMeans(other[layer][0], other[layer][1], x, nodes, x[nodes])
+            connected = numpy.add.reduceat((counts > 0).astype(numpy.int64), starts)
+            desiredCenters = numpy.add.reduceat(desired-offsets, starts)/sizes
+            weights = numpy.where(connected > 0, connected, 1e-3)
+            centers = isotonic((desiredCenters-separation).tolist(), weights.tolist())+separation
+            x[nodes] = numpy.repeat(centers, sizes)+offsets
+
+    # layers top to bottom, layers with clusters leave room for the cluster labels
+    hasCluster = padding[blockOf] > 0
+    bandHeight = 0
+    for layer in ranks:
+        nodes = layerNodes[layer]
+        clustered = bool(hasCluster[nodes].any())
+        layerHeight = heights[nodes].max()
+        if clustered:
+            bandHeight += CLUSTER_PAD+CLUSTER_LABEL
+        y[nodes] = bandHeight+layerHeight/2
+        bandHeight += layerHeight+RANK_SEP
+        if clustered:
+            bandHeight += CLUSTER_PAD
+
+    # wide layers are cut into bands drawn below each other, blocks are not cut
+    # the legend is drawn in one row above them
+    drawn = numpy.flatnonzero(layers != LEGEND_LAYER)
+    legendNodes = numpy.flatnonzero(layers == LEGEND_LAYER)
+    graph.x = x
+    graph.y = y
+    top = MARGIN
+    if len(legendNodes) > 0:
+        top = placeLegend(graph, legendNodes, widths, heights)+RANK_SEP
+    if len(drawn) > 0:
+        x[drawn] -= (x[drawn]-widths[drawn]/2-padding[blockOf[drawn]]).min()
+        totalWidth = (x[drawn]+widths[drawn]/2+padding[blockOf[drawn]]).max()
+        bands = max(1, int(round((totalWidth/(ASPECT*bandHeight))**0.5)))
+        blockCenters = numpy.bincount(blockOf[drawn], weights=x[drawn], minlength=blockCount)/numpy.maximum(numpy.bincount(blockOf[drawn], minlength=blockCount), 1)
+        blockRights = numpy.zeros(blockCount)
+        numpy.maximum.at(blockRights, blockOf[drawn], x[drawn]+widths[drawn]/2+padding[blockOf[drawn]])
+        lefts = numpy.concatenate(([0], bandCuts(blockRights+BLOCK_SEP/2, x[edgeFrom], x[edgeTo], totalWidth, bands)))
+        band = numpy.searchsorted(lefts, blockCenters[blockOf[drawn]], side="right")-1
+        x[drawn] += MARGIN-lefts[band]
+        y[drawn] += top+band*(bandHeight+BAND_SEP)
+    graph.boxes = [None]*len(graph.clusterNames)
+    clusterBoxes(graph, widths, heights)
+    right = (x+widths/2).max() if count > 0 else 0
+    bottom = (y+heights/2).max() if count > 0 else 0
+    for box in graph.boxes:
+        if box != None:
+            right = max(right, box[2])
+            bottom = max(bottom, box[3])
+    graph.width = right+MARGIN
+    graph.height = bottom+MARGIN
+
+# boxes of the clusters around their members and inner clusters
+def clusterBoxes(graph, widths, heights):
+    x = graph.x
+    y = graph.y
+    clusters = numpy.array(graph.clusters, dtype=numpy.int64)
+    members = numpy.flatnonzero(clusters != -1)
+    clusterCount = len(graph.clusterNames)
+    if clusterCount == 0:
+        return
+    x1 = numpy.full(clusterCount, numpy.inf)
+    y1 = numpy.full(clusterCount, numpy.inf)
+    x2 = numpy.full(clusterCount, -numpy.inf)
+    y2 = numpy.full(clusterCount, -numpy.inf)
+    numpy.minimum.at(x1, clusters[members], x[members]-widths[members]/2)
+    numpy.minimum.at(y1, clusters[members], y[members]-heights[members]/2)
+    numpy.maximum.at(x2, clusters[members], x[members]+widths[members]/2)
+    numpy.maximum.at(y2, clusters[members], y[members]+heights[members]/2)
+    # inner clusters come after their parents
+    for cluster in reversed(range(clusterCount)):
+        if x1[cluster] > x2[cluster]:
+            continue
+        box = (x1[cluster]-CLUSTER_PAD, y1[cluster]-CLUSTER_PAD-CLUSTER_LABEL, x2[cluster]+CLUSTER_PAD, y2[cluster]+CLUSTER_PAD)
+        graph.boxes[cluster] = box
+        parent = graph.clusterParents[cluster]
+        if parent != -1:
+            x1[parent] = min(x1[parent], box[0])
+            y1[parent] = min(y1[parent], box[1])
+            x2[parent] = max(x2[parent], box[2])
+            y2[parent] = max(y2[parent], box[3])
+
+# place the legend nodes in one row at the top left, returns the bottom of the legend
+def placeLegend(graph, legendNodes, widths, heights):
+    # the legend clusters are nested, the innermost ones need the most room
+    depth = max(len(legendClusters(graph, graph.clusters[idx])) for idx in legendNodes)
+    top = MARGIN+depth*(CLUSTER_PAD+CLUSTER_LABEL)
+    rowHeight = heights[legendNodes].max()
+    left = MARGIN
+    previousClusters = []
+    for idx in legendNodes:
+        clusters = legendClusters(graph, graph.clusters[idx])
+        # room for the padding of the clusters that end or start here
+        left += CLUSTER_PAD*len([cluster for cluster in clusters if cluster not in previousClusters])
+        left += CLUSTER_PAD*len([cluster for cluster in previousClusters if cluster not in clusters])
+        graph.x[idx] = left+widths[idx]/2
+        graph.y[idx] = top+rowHeight/2
+        left += widths[idx]+NODE_SEP
+        previousClusters = clusters
+    return top+rowHeight+depth*CLUSTER_PAD
+
+# the legend clusters a legend node is drawn in, outermost first
+def legendClusters(graph, cluster):
+    clusters = []
+    while cluster != -1:
+        clusters.insert(0, cluster)
+        cluster = graph.clusterParents[cluster]
+    return clusters
+
+def escape(text):
+    return html.escape(text, quote=True)
+
+# svg elements of a node shape centered at x,y
+def shapeSvg(attrs, x, y, width, height):
+    shape = attrs.get("shape", "ellipse")
+    style = attrs.get("style", "").split(",")
+    fill = attrs.get("fillcolor", "lightgrey") if "filled" in style else "white"
+    paint = "fill=\"%s\" stroke=\"black\"" % escape(fill)
+    if shape == "box" and "rounded" in style:
+        return "<rect %s x=\"%.2f\" y=\"%.2f\" width=\"%.2f\" height=\"%.2f\" rx=\"8\" ry=\"8\"/>" % (paint, x-width/2, y-height/2, width, height)
+    if shape == "cylinder":
+        left = x-width/2
+        right = x+width/2
+        topY = y-height/2+height/8
+        bottomY = y+height/2-height/8
+        return ("<path %s d=\"M%.2f,%.2f A%.2f,%.2f 0 0 1 %.2f,%.2f L%.2f,%.2f A%.2f,%.2f 0 0 1 %.2f,%.2f Z\"/>"
+                "<path fill=\"none\" stroke=\"black\" d=\"M%.2f,%.2f A%.2f,%.2f 0 0 0 %.2f,%.2f\"/>") % (paint,
+            left, topY, width/2, height/8, right, topY, right, bottomY, width/2, height/8, left, bottomY,
+            left, topY, width/2, height/8, right, topY)
+    corners = POLYGONS.get(shape)
+    if corners == None:
+        return "<ellipse %s cx=\"%.2f\" cy=\"%.2f\" rx=\"%.2f\" ry=\"%.2f\"/>" % (paint, x, y, width/2, height/2)
+    return "<polygon %s points=\"%s\"/>" % (paint, " ".join("%.2f,%.2f" % (x+dx*width, y+dy*height) for dx,dy in corners))
+
+def textSvg(lines, x, y):
+    first = y-(len(lines)-1)*LINE_HEIGHT/2+FONT_SIZE/3
+    return "".join("<text text-anchor=\"middle\" x=\"%.2f\" y=\"%.2f\" font-family=\"Times,serif\" font-size=\"%d\">%s</text>" % (
+        x, first+lineIdx*LINE_HEIGHT, FONT_SIZE, escape(line)) for lineIdx,line in enumerate(lines))
+
+# svg text of a laid out graph as a sequence of string chunks
+def iterSvg(graph, chunkLines=heat2dot.CHUNK_LINES):
+    lines = []
+    out = lines.append
+    out("<?xml version=\"1.0\" encoding=\"UTF-8\" standalone=\"no\"?>")
+    out("<svg width=\"%dpt\" height=\"%dpt\" viewBox=\"0.00 0.00 %.2f %.2f\" xmlns=\"http://www.w3.org/2000/svg\" xmlns:xlink=\"http://www.w3.org/1999/xlink\">" % (
+        graph.width, graph.height, graph.width, graph.height))
+    out("<g id=\"graph0\" class=\"graph\">")
+    out("<title>heat</title>")
+    out("<rect fill=\"white\" stroke=\"none\" x=\"0\" y=\"0\" width=\"%.2f\" height=\"%.2f\"/>" % (graph.width, graph.height))
+
+    for cluster,box in enumerate(graph.boxes):
+        if box == None:
+            continue
+        attrs = graph.clusterAttrs[cluster]
+        fill = attrs.get("fillcolor", "white") if "filled" in attrs.get("style", "") else "none"
+        out("<g id=\"clust%d\" class=\"cluster\"><title>%s</title><rect fill=\"%s\" stroke=\"black\" x=\"%.2f\" y=\"%.2f\" width=\"%.2f\" height=\"%.2f\"/>%s</g>" % (
+            cluster+1, escape(graph.clusterNames[cluster]), escape(fill), box[0], box[1], box[2]-box[0], box[3]-box[1],
+            textSvg(labelLines(attrs.get("label", "")), (box[0]+box[2])/2, box[1]+CLUSTER_PAD+FONT_SIZE/2)))
+
+    ids = graph.ids
+    x = graph.x.tolist()
+    y = graph.y.tolist()
+    for edgeIdx,(fromIdx,toIdx) in enumerate(zip(graph.edgeFrom, graph.edgeTo)):
+        out("<g id=\"edge%d\" class=\"edge\"><title>%s&#45;&#45;%s</title><path fill=\"none\" stroke=\"black\" d=\"M%.2f,%.2fL%.2f,%.2f\"/></g>" % (
+            edgeIdx+1, ids[fromIdx], ids[toIdx], x[fromIdx], y[fromIdx], x[toIdx], y[toIdx]))
+        if len(lines) >= chunkLines:
+            yield "\n".join(lines)+"\n"
+            lines = []
+            out = lines.append
+
+    for idx,dotId in enumerate(ids):
+        out("<g id=\"node%d\" class=\"node\"><title>%s</title>%s%s</g>" % (idx+1, dotId,
+            shapeSvg(graph.attrs[idx], x[idx], y[idx], graph.widths[idx], graph.heights[idx]), textSvg(graph.labels[idx], x[idx], y[idx])))
+        if len(lines) >= chunkLines:
+            yield "\n".join(lines)+"\n"
+            lines = []
+            out = lines.append
+
+    out("</g>")
+    out("</svg>")
+    yield "\n".join(lines)+"\n"
+
+# lay out the dot text of heat2dot.iterDot and draw it as svg
+def renderSvg(dot):
+    if isinstance(dot, bytes):
+        dot = dot.decode("UTF-8")
+    graph = parseDot(dot)
+    layout(graph)
+    return "".join(iterSvg(graph)).encode("UTF-8")
@@ -0,0 +1,103 @@
+# Pipeline metrics for heat2dot
+# Stage timings and sizes come from heat2dot.DotResult.metrics(),
+# the servers aggregate them per stage and keep the most recent requests
+# Profiles can be captured with cProfile and tracemalloc for bug reports
+
+import os
+import sys
+import time
+import threading
+import cProfile
+import tracemalloc
+from collections import deque
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# allocation sites listed in memory reports
+TOP_ALLOCATIONS = 10
+
+# peak resident set size of the process in bytes, None if unknown
+def peakRss():
+    if resource == None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    if sys.platform == "darwin":
+        return peak
+    return peak*1024
+
+# run function(*args) under cProfile and write the stats to path for pstats or snakeviz
+def profileCall(path, function, *args):
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args)
+    finally:
+        profiler.dump_stats(path)
+
+# new file name for a profile in directory
+def profilePath(directory):
+    return os.path.join(directory, "heat2dot-%d-%d.prof" % (int(time.time()*1000), threading.get_ident()))
+
+# peak and largest allocation sites traced since tracemalloc.start()
+def memoryReport():
+    current, peak = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot()
+    top = []
+    for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+        frame = stat.traceback[0]
+        top.append({"location": frame.filename+":"+str(frame.lineno), "bytes": stat.size, "count": stat.count})
+    return {"tracedBytes": current, "tracedPeakBytes": peak, "topAllocations": top}
+
+# aggregated metrics of the conversions served by a server
+class PipelineMetrics:
+    def __init__(self, recentSize=100):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.inputBytes = 0
+        self.stages = {}
+        self.cacheResults = {}
+        self.recent = deque(maxlen=recentSize)
+
+    # metrics is a dict from DotResult.metrics(), None for requests served from the cache
+    # cacheResult says where the result came from, e.g. "text", "template" or "miss"
+    def record(self, metrics, cacheResult, layoutSeconds=None):
+        with self.lock:
+            self.requests += 1
+            self.cacheResults[cacheResult] = self.cacheResults.get(cacheResult, 0)+1
+            if metrics == None:
+                return
+            timings = dict(metrics["timings"])
+            if layoutSeconds != None:
+                timings["layout"] = layoutSeconds
+            if not metrics["success"]:
+                self.failures += 1
+            self.inputBytes += metrics["inputBytes"] or 0
+            for stage,seconds in timings.items():
+                stats = self.stages.setdefault(stage, {"count": 0, "seconds": 0.0, "maxSeconds": 0.0})
+                stats["count"] += 1
+                stats["seconds"] += seconds
+                stats["maxSeconds"] = max(stats["maxSeconds"], seconds)
+            recent = dict(metrics)
+            recent["timings"] = timings
+            recent["time"] = time.time()
+            recent["cache"] = cacheResult
+            self.recent.append(recent)
+
+    def stats(self):
+        with self.lock:
+            stages = {}
+            for stage,stats in self.stages.items():
+                stages[stage] = dict(stats, meanSeconds=stats["seconds"]/stats["count"])
+            return {
+                "requests": self.requests,
+                "failures": self.failures,
+                "inputBytes": self.inputBytes,
+                "cache": dict(self.cacheResults),
+                "stages": stages,
+                "recent": list(self.recent),
+                "peakRssBytes": peakRss(),
+            }
@@ -0,0 +1,333 @@
+# Expansion of nested stacks and resource groups for heat2dot
+# Resources of nested templates and group members are inlined into one flat
+# template. Their keys are prefixed with the key of the resource that created
+# them, e.g. "web/0/port" is the port of the first member of the group "web".
+# get_resource references are prefixed the same way, get_param is replaced by
+# the property passed by the parent stack or by the parameter default and the
+# index variable of a ResourceGroup by the member index.
+
+# Nested templates are local files relative to the template using them, either
+# as resource type or as get_file of an OS::Heat::Stack. Files are read and
+# parsed concurrently, memoized by path and content hash.
+
+# Library usage:
+#   loader = heat2dot_nested.TemplateLoader("stack.yaml")
+#   try:
+#       result = heat2dot.convert(text, loader=loader)
+#   finally:
+#       loader.close()
+
+import os
+import time
+import hashlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+import heat2dot
+from heat2dot import UNRESOLVED_TEMPLATE, TEMPLATE_CYCLE, INVALID_GROUP
+
+# group type -> property with the member definition, properties with the size in order of preference
+GROUP_TYPES = {
+    "OS::Heat::ResourceGroup": ("resource_def", ["count"]),
+    "OS::Heat::AutoScalingGroup": ("resource", ["desired_capacity", "min_size"]),
+}
+STACK_TYPE = "OS::Heat::Stack"
+TEMPLATE_EXTENSIONS = (".yaml", ".yml", ".json", ".template")
+INDEX_VAR = "%index%"
+KEY_SEPARATOR = "/"
+# members expanded per group, larger groups are cut
+MAX_GROUP_SIZE = 10000
+
+def isTemplateType(resourceType):
+    return isinstance(resourceType, str) and (resourceType.startswith("file://")
+        or os.path.splitext(resourceType)[1].lower() in TEMPLATE_EXTENSIONS)
+
+def templatePath(reference, directory):
+    if reference.startswith("file://"):
+        reference = reference[len("file://"):]
+    return os.path.normpath(os.path.join(directory, reference))
+
+# member definition of a group resource, None for other resources
+def groupDefinition(obj):
+    if obj.get("type") not in GROUP_TYPES:
+        return None
+    properties = obj.get("properties")
+    if not isinstance(properties, dict):
+        return None
+    definition = properties.get(GROUP_TYPES[obj["type"]][0])
+    return definition if isinstance(definition, dict) else None
+
+# true if a resource needs expansion
+def isExpandable(obj):
+    return isinstance(obj, dict) and (obj.get("type") in GROUP_TYPES or obj.get("type") == STACK_TYPE
+                                      or isTemplateType(obj.get("type")))
+
+# true if a resource or group member is a nested template taking its properties as parameters
+def hasNestedStacks(template):
+    if not isinstance(template, dict) or not isinstance(template.get("resources"), dict):
+        return False
+    for obj in template["resources"].values():
+        if isinstance(obj, dict):
+            definition = groupDefinition(obj)
+            if isTemplateType(obj.get("type")) or (definition != None and isTemplateType(definition.get("type"))):
+                return True
+    return False
+
+# paths of the nested template files a template refers to
+def nestedPaths(template, directory):
+    paths = []
+    if not isinstance(template, dict) or not isinstance(template.get("resources"), dict):
+        return paths
+    for obj in template["resources"].values():
+        if not isinstance(obj, dict):
+            continue
+        definition = groupDefinition(obj)
+        if definition != None:
+            obj = definition
+        properties = obj.get("properties")
+        if isTemplateType(obj.get("type")):
+            paths.append(templatePath(obj["type"], directory))
+        elif obj.get("type") == STACK_TYPE and isinstance(properties, dict):
+            reference = properties.get("template")
+            if isinstance(reference, dict) and isinstance(reference.get("get_file"), str):
+                paths.append(templatePath(reference["get_file"], directory))
+    return paths
+
+# parse a nested template, runs in a worker process
+# returns the template (None if parsing failed) and the parser messages
+def parseNested(text, formatHint, selective):
+    result = heat2dot.DotResult()
+    template = heat2dot.parseTemplate(text, result, formatHint, selective)
+    # nested stacks take all their properties as parameters, the selective parser drops them
+    if selective and hasNestedStacks(template):
+        template = heat2dot.parseTemplate(text, heat2dot.DotResult(), formatHint, False)
+    return template, result.messages
+
+# reads and parses nested templates
+# files are read on threads and parsed on workers processes (in the reading
+# thread with workers=1), every path is read once until its modification time
+# changes and every distinct content is parsed once
+# rootPath is the template the nested paths are relative to, None for the current directory
+class TemplateLoader:
+    def __init__(self, rootPath=None, workers=None, selective=True):
+        self.rootPath = os.path.abspath(rootPath) if rootPath != None else None
+        self.directory = os.path.dirname(self.rootPath) if rootPath != None else os.getcwd()
+        self.workers = workers or os.cpu_count() or 1
+        self.selective = selective
+        self.lock = threading.Lock()
+        # path -> (mtime, future of (template, messages))
+        self.files = {}
+        # content hash -> future of (template, messages)
+        self.templates = {}
+        self.readers = ThreadPoolExecutor(max_workers=self.workers)
+        self.parsers = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+        # statistics
+        self.reads = 0
+        self.parses = 0
+
+    def close(self):
+        self.readers.shutdown()
+        if self.parsers != None:
+            self.parsers.shutdown()
+
+    # paths of the files loaded so far, e.g. to watch them for changes
+    def paths(self):
+        with self.lock:
+            return list(self.files)
+
+    # future of (template, messages) of a file, template is None if it could not be loaded
+    def load(self, path):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = None
+        with self.lock:
+            entry = self.files.get(path)
+            if entry == None or entry[0] != mtime:
+                entry = (mtime, self.readers.submit(self.readFile, path))
+                self.files[path] = entry
+        return entry[1]
+
+    def readFile(self, path):
+        try:
+            with open(path, "rb") as templateFile:
+                text = templateFile.read()
+        except OSError as e:
+            return None, ["Cannot read template: "+str(e)]
+        with self.lock:
+            self.reads += 1
+        template, messages = self.parse(text, heat2dot.FORMAT_EXTENSIONS.get(os.path.splitext(path)[1].lower()))
+        # start loading the next level while the caller expands this one
+        for childPath in nestedPaths(template, os.path.dirname(path)):
+            self.load(childPath)
+        return template, messages
+
+    # (template, messages) of a template text, parsed once per content
+    def parse(self, text, formatHint=None):
+        digest = hashlib.sha256(text if isinstance(text, bytes) else text.encode("UTF-8")).hexdigest()
+        with self.lock:
+            future = self.templates.get(digest)
+            owner = future == None
+            if owner:
+                self.parses += 1
+                if self.parsers != None:
+                    future = self.parsers.submit(parseNested, text, formatHint, self.selective)
+                else:
+                    future = Future()
+                self.templates[digest] = future
+        if owner and self.parsers == None:
+            future.set_result(parseNested(text, formatHint, self.selective))
+        return future.result()
+
+# parameter values of a nested template: the defaults overridden by the passed properties
+def stackParameters(template, properties):
+    parameters = {}
+    if isinstance(template.get("parameters"), dict):
+        for name,spec in template["parameters"].items():
+            if isinstance(spec, dict) and "default" in spec:
+                parameters[name] = spec["default"]
+    if isinstance(properties, dict):
+        parameters.update(properties)
+    return parameters
+
+# copy of a value from a nested stack or group definition in the flat template
+# get_resource gets the prefix of the stack, get_param the value of the parameter
+# and indexVar is replaced by index in strings
+def localize(value, prefix, parameters, indexVar=None, index=None):
+    if isinstance(value, dict):
+        if len(value) == 1:
+            if isinstance(value.get("get_resource"), str):
+                return {"get_resource": prefix+localize(value["get_resource"], prefix, parameters, indexVar, index)}
+            if "get_param" in value:
+                path = value["get_param"]
+                if not isinstance(path, list):
+                    path = [path]
+                if len(path) > 0 and isinstance(path[0], str) and path[0] in parameters:
+                    selected = parameters[path[0]]
+                    for step in path[1:]:
+                        try:
+                            selected = selected[step]
+                        except (KeyError, IndexError, TypeError):
+                            return value
+                    return selected
+        return {key: localize(item, prefix, parameters, indexVar, index) for key,item in value.items()}
+    if isinstance(value, list):
+        return [localize(item, prefix, parameters, indexVar, index) for item in value]
+    if indexVar != None and isinstance(value, str):
+        return value.replace(indexVar, str(index))
+    return value
+
+# inlines the resources of nested stacks and group members into resources
+class StackExpander:
+    def __init__(self, result, loader):
+        self.result = result
+        self.loader = loader
+        self.resources = {}
+
+    # add the resources of a stack, keys are prefixed with prefix
+    # ancestors are the template files of the enclosing stacks
+    def stack(self, template, prefix, parameters, directory, ancestors):
+        for key,obj in template["resources"].items():
+            self.resource(prefix+str(key), obj, prefix, parameters, directory, ancestors)
+
+    # add one resource of a stack, key is already prefixed
+    def resource(self, key, obj, prefix, parameters, directory, ancestors, indexVar=None, index=None):
+        if not isExpandable(obj):
+            if prefix != "" or indexVar != None:
+                obj = localize(obj, prefix, parameters, indexVar, index)
+            self.resources[key] = obj
+            return
+        properties = localize(obj.get("properties"), prefix, parameters, indexVar, index)
+        if not isinstance(properties, dict):
+            properties = {}
+
+        if obj["type"] in GROUP_TYPES:
+            self.group(key, obj["type"], properties, prefix, parameters, directory, ancestors)
+            return
+
+        if obj["type"] == STACK_TYPE:
+            reference = properties.get("template")
+            childParameters = properties.get("parameters")
+            if isinstance(reference, dict) and isinstance(reference.get("get_file"), str):
+                path = reference["get_file"]
+            elif isinstance(reference, str):
+                # inline template text, nested paths stay relative to this template
+                template, messages = self.loader.parse(reference) if self.loader != None else parseNested(reference, None, True)
+                self.nested(key, template, messages, "template", childParameters, directory, ancestors)
+                return
+            else:
+                self.result.report(UNRESOLVED_TEMPLATE,None,key,"template","Missing template in",STACK_TYPE,"object",key)
+                return
+        else:
+            path = obj["type"]
+            childParameters = properties
+
+        if self.loader == None:
+            self.result.report(UNRESOLVED_TEMPLATE,None,key,"type","Nested template",path,"of",key,"not loaded, only templates read from files can load them")
+            self.resources[key] = obj
+            return
+        path = templatePath(path, directory)
+        if path in ancestors:
+            self.result.report(TEMPLATE_CYCLE,None,key,"type","Nested template",path,"includes itself in",key)
+            return
+        template, messages = self.loader.load(path).result()
+        self.nested(key, template, messages, path, childParameters, os.path.dirname(path), ancestors+(path,))
+
+    def nested(self, key, template, messages, source, parameters, directory, ancestors):
+        if template == None:
+            self.result.report(UNRESOLVED_TEMPLATE,None,key,"type","Nested template",source,"of",key,"not loaded"+"".join("\n  "+str(message) for message in messages))
+            return
+        if not isinstance(template, dict) or not isinstance(template.get("resources"), dict):
+            self.result.report(UNRESOLVED_TEMPLATE,None,key,"type","Nested template",source,"of",key,"has no resources")
+            return
+        self.stack(template, key+KEY_SEPARATOR, stackParameters(template, parameters), directory, ancestors)
+
+    def group(self, key, groupType, properties, prefix, parameters, directory, ancestors):
+        definitionField, sizeFields = GROUP_TYPES[groupType]
+        definition = properties.get(definitionField)
+        if not isinstance(definition, dict) or not isinstance(definition.get("type"), str):
+            self.result.report(INVALID_GROUP,None,key,definitionField,"missing",definitionField,"in",groupType,"object",key)
+            return
+        size = None
+        for field in sizeFields:
+            if field in properties:
+                size = properties[field]
+                break
+        if size == None and groupType == "OS::Heat::ResourceGroup":
+            size = 1
+        if isinstance(size, str) and size.isdigit():
+            size = int(size)
+        if not isinstance(size, int) or isinstance(size, bool) or size < 0:
+            self.result.report(INVALID_GROUP,None,key,sizeFields[0],"size",size,"of",groupType,"object",key,"not known, drawing one member")
+            size = 1
+        elif size > MAX_GROUP_SIZE:
+            self.result.report(INVALID_GROUP,None,key,sizeFields[0],"size",size,"of",groupType,"object",key,"cut to",MAX_GROUP_SIZE)
+            size = MAX_GROUP_SIZE
+
+        indexVar = None
+        if groupType == "OS::Heat::ResourceGroup":
+            indexVar = properties.get("index_var", INDEX_VAR)
+            if not isinstance(indexVar, str) or indexVar == "":
+                indexVar = None
+        # properties were localized with the group, only the index is left to replace
+        member = {"type": definition["type"], "properties": definition.get("properties")}
+        for index in range(size):
+            self.resource(key+KEY_SEPARATOR+str(index), member, "", {}, directory, ancestors, indexVar, index)
+
+# expand groups and nested stacks of a parsed template, see heat2dot.expandTemplate
+# returns a template with the resources of all stacks and group members
+def expand(template, result, loader=None, text=None, formatHint=None):
+    if not any(isExpandable(obj) for obj in template["resources"].values()):
+        return template
+    start = time.perf_counter()
+    if loader != None and loader.selective and text != None and hasNestedStacks(template):
+        # nested stacks take all their properties as parameters, the selective parser drops them
+        template = parseNested(text, formatHint, False)[0]
+    expander = StackExpander(result, loader)
+    ancestors = (loader.rootPath,) if loader != None and loader.rootPath != None else ()
+    directory = loader.directory if loader != None else None
+    expander.stack(template, "", stackParameters(template, None), directory, ancestors)
+    expanded = {"resources": expander.resources}
+    if "heat_template_version" in template:
+        expanded["heat_template_version"] = template["heat_template_version"]
+    result.timings["expand"] = time.perf_counter()-start
+    return expanded
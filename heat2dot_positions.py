@@ -0,0 +1,380 @@
+# Layout position cache for heat2dot renders
+# Node coordinates of finished layouts are kept per stack, keyed by the heat
+# resource key instead of the positional dot ids, and fed back to Graphviz
+# when the same stack is drawn again. A stack is identified by the name the
+# client gives it, or else by all of its resource keys. Nodes without a stored
+# position are placed next to their neighbours, then neato -n2 draws the graph
+# with every node where it was before instead of running a new layout.
+
+import re
+import hashlib
+import threading
+from collections import OrderedDict, deque
+import heat2dot
+
+# largest share of new nodes that is placed without a new layout
+MAX_NEW_SHARE = 0.2
+
+# free space kept around placed nodes and the step of the search for it, in points
+PLACE_GAP = 18
+PLACE_STEP = 36
+PLACE_RINGS = 40
+# cluster margin and room for the cluster label above the members, in points
+CLUSTER_MARGIN = 8
+CLUSTER_LABEL = 22
+# distance of the cluster label position below the top of the cluster
+LABEL_OFFSET = 11.5
+
+# graphviz -Tdot output, long lines are continued with a backslash
+QUOTED = r'"(?:[^"\\]|\\.)*"'
+ID = r'(?:\w+|'+QUOTED+r')'
+ATTRS = r'\[((?:'+QUOTED+r'|[^\]"])*)\]'
+STATEMENT = re.compile(r'subgraph\s+('+ID+r')\s*\{|(\})|('+ID+r')\s*--\s*('+ID+r')\s*'+ATTRS+r'|('+ID+r')\s*'+ATTRS)
+ATTRIBUTE = re.compile(r'(\w+)\s*=\s*('+QUOTED+r'|[^,\s\]]+)')
+
+# lines of the dot text written by heat2dot.iterDot
+NODE_LINE = re.compile(r'(\w+) \[(.*)\];$')
+EDGE_LINE = re.compile(r'(\w+) -- (\w+);$')
+CLUSTER_LINE = re.compile(r'subgraph (\w+) \{$')
+LABEL = re.compile(r'label="((?:[^"\\]|\\.)*)"')
+
+# positions of one finished layout in points, keyed like layoutKey
+# nodes: (x, y, width, height) of the node centers
+# edges: graphviz pos of the edges by the keys of their ends
+# clusters: (x1, y1, x2, y2, label offset) of the cluster bounding boxes
+class Layout:
+    __slots__ = ("detail", "nodes", "edges", "clusters")
+
+    def __init__(self, detail):
+        self.detail = detail
+        self.nodes = {}
+        self.edges = {}
+        self.clusters = {}
+
+# heat resource key of the dot id of every node drawn at a level of detail
+# servers are drawn as clusters named after their id at the full level
+def dotKeys(graph, detail=heat2dot.DETAIL_FULL):
+    owners = [None]*heat2dot.NODE_TYPE_COUNT
+    if detail == heat2dot.DETAIL_SERVERS or detail == heat2dot.DETAIL_GROUPED:
+        owners = heat2dot.clusterOwners(graph)
+    if detail == heat2dot.DETAIL_GROUPED:
+        owners[heat2dot.SERVER] = heat2dot.serverGroups(graph)
+    keys = {}
+    for typeCode,nodes in enumerate(graph.nodes):
+        if detail == heat2dot.DETAIL_BACKBONE and typeCode not in heat2dot.BACKBONE_TYPES:
+            continue
+        typeOwners = owners[typeCode]
+        for idx,node in enumerate(nodes):
+            # drawn inside a collapsed server or merged into the first server of its group
+            if typeOwners != None and typeOwners[idx] != (idx if typeCode == heat2dot.SERVER else -1):
+                continue
+            keys[node.DOT[:node.DOT.index("%")]+str(node.idx)] = node.key
+    return keys
+
+# identity of a stack drawn at a level of detail, see PositionCache
+# named stacks keep their layout while resources are added or removed, unnamed
+# ones are identified by the hash of all their resource keys and so only share
+# a layout with the same set of resources
+def stackId(keys, detail, stack=None):
+    if stack != None:
+        return "name:"+detail+":"+stack
+    digest = hashlib.sha256(detail.encode("UTF-8"))
+    for key in sorted(keys.values()):
+        digest.update(b"\0"+key.encode("UTF-8"))
+    return "keys:"+digest.hexdigest()
+
+# resource key of a dot id, legend nodes keep their id
+def layoutKey(keys, dotId):
+    key = keys.get(dotId)
+    if key == None:
+        return ("legend", dotId)
+    return key
+
+# server clusters are keyed by their server
+def clusterKey(keys, name):
+    if name.startswith("cluster_"):
+        key = keys.get(name[8:])
+        if key != None:
+            return key
+    return ("legend", name)
+
+def unquote(value):
+    if value.startswith("\""):
+        return value[1:-1]
+    return value
+
+def attributes(text):
+    return dict((name, unquote(value)) for name,value in ATTRIBUTE.findall(text))
+
+def floats(value):
+    return [float(part) for part in value.replace("!", "").split(",")]
+
+# read the positions of graphviz -Tdot output (or of packed graphs from gvpack)
+# keys maps dot ids to resource keys, see dotKeys
+def readLayout(laidOut, keys, detail):
+    if isinstance(laidOut, bytes):
+        laidOut = laidOut.decode("UTF-8")
+    layout = Layout(detail)
+    subgraphs = []
+    for match in STATEMENT.finditer(laidOut.replace("\\\n", "")):
+        subgraph, close, fromId, toId, edgeAttrs, nodeId, nodeAttrs = match.groups()
+        if subgraph != None:
+            subgraphs.append(unquote(subgraph))
+        elif close != None:
+            if subgraphs:
+                subgraphs.pop()
+        elif fromId != None:
+            pos = attributes(edgeAttrs).get("pos")
+            if pos != None:
+                layout.edges[(layoutKey(keys, unquote(fromId)), layoutKey(keys, unquote(toId)))] = pos
+        else:
+            nodeId = unquote(nodeId)
+            attrs = attributes(nodeAttrs)
+            if nodeId == "graph":
+                if subgraphs and subgraphs[-1].startswith("cluster") and "bb" in attrs:
+                    x1, y1, x2, y2 = floats(attrs["bb"])
+                    offset = LABEL_OFFSET
+                    if "lp" in attrs:
+                        offset = y2-floats(attrs["lp"])[1]
+                    layout.clusters[clusterKey(keys, subgraphs[-1])] = (x1, y1, x2, y2, offset)
+            elif nodeId != "node" and nodeId != "edge" and "pos" in attrs:
+                x, y = floats(attrs["pos"])[:2]
+                layout.nodes[layoutKey(keys, nodeId)] = (x, y, float(attrs.get("width", 0.75))*72, float(attrs.get("height", 0.5))*72)
+    return layout
+
+# size of a node with a label of these lines in points, about what graphviz uses
+def labelSize(lines):
+    return max(54, 7*max(len(line) for line in lines)+22), max(36, 14*len(lines)+8)
+
+# size of a node that was never laid out, from the length of its label
+def estimateSize(attrs):
+    match = LABEL.search(attrs)
+    return labelSize(match.group(1).split("\\n") if match != None else [""])
+
+# occupied space of the drawing on a grid of PLACE_STEP cells
+class Occupancy:
+    def __init__(self):
+        self.cells = set()
+
+    def cellRange(self, x, y, width, height):
+        gap = PLACE_GAP
+        return (range(int((x-width/2-gap)//PLACE_STEP), int((x+width/2+gap)//PLACE_STEP)+1),
+                range(int((y-height/2-gap)//PLACE_STEP), int((y+height/2+gap)//PLACE_STEP)+1))
+
+    def free(self, x, y, width, height):
+        columns, rows = self.cellRange(x, y, width, height)
+        cells = self.cells
+        return all((column, row) not in cells for column in columns for row in rows)
+
+    def add(self, x, y, width, height):
+        columns, rows = self.cellRange(x, y, width, height)
+        self.cells.update((column, row) for column in columns for row in rows)
+
+    # nearest free position around x,y on rings of growing size, None if there is none close by
+    def place(self, x, y, width, height):
+        for ring in range(PLACE_RINGS):
+            for dx in range(-ring, ring+1):
+                for dy in (range(-ring, ring+1) if abs(dx) == ring else (-ring, ring)):
+                    px = x+dx*PLACE_STEP
+                    py = y+dy*PLACE_STEP
+                    if self.free(px, py, width, height):
+                        return px, py
+        return None
+
+# bounding box of node rectangles and boxes
+def boundingBox(nodes, boxes):
+    x1 = y1 = float("inf")
+    x2 = y2 = float("-inf")
+    for x, y, width, height in nodes:
+        x1 = min(x1, x-width/2)
+        y1 = min(y1, y-height/2)
+        x2 = max(x2, x+width/2)
+        y2 = max(y2, y+height/2)
+    for box in boxes:
+        x1 = min(x1, box[0])
+        y1 = min(y1, box[1])
+        x2 = max(x2, box[2])
+        y2 = max(y2, box[3])
+    if x1 > x2:
+        return None
+    return x1, y1, x2, y2
+
+# dot text of heat2dot with the positions of a stored layout set for neato -n2
+# nodes without stored position are placed next to the placed nodes of their
+# cluster or their neighbours, nodes without any in rows below the drawing
+# returns the dot text and the layout it draws, (None, None) if more than
+# maxNewShare of the nodes have no stored position
+def seedDot(dot, keys, layout, maxNewShare=MAX_NEW_SHARE):
+    lines = dot.split("\n")
+    nodeLines = {}
+    neighbours = {}
+    clusters = []
+    clusterNodes = {}
+    opened = []
+    for lineIdx,line in enumerate(lines):
+        match = NODE_LINE.match(line)
+        if match != None:
+            nodeLines[match.group(1)] = lineIdx
+            if opened:
+                clusterNodes[opened[-1]][0].append(match.group(1))
+            continue
+        match = EDGE_LINE.match(line)
+        if match != None:
+            neighbours.setdefault(match.group(1), []).append(match.group(2))
+            neighbours.setdefault(match.group(2), []).append(match.group(1))
+            continue
+        match = CLUSTER_LINE.match(line)
+        if match != None:
+            name = match.group(1)
+            clusterNodes[name] = ([], [])
+            if opened:
+                clusterNodes[opened[-1]][1].append(name)
+            opened.append(name)
+            clusters.append((name, lineIdx))
+        elif line == "}" and opened:
+            opened.pop()
+
+    stored = layout.nodes
+    nodeKeys = dict((dotId, layoutKey(keys, dotId)) for dotId in nodeLines)
+    new = [dotId for dotId,key in nodeKeys.items() if key not in stored]
+    if len(new) > maxNewShare*len(nodeLines):
+        return None, None
+
+    seeded = Layout(layout.detail)
+    positions = {}
+    occupancy = Occupancy()
+    for dotId,key in nodeKeys.items():
+        node = stored.get(key)
+        if node != None:
+            positions[dotId] = node
+            if new:
+                occupancy.add(*node)
+    memberOf = {}
+    for name,(members, children) in clusterNodes.items():
+        for dotId in members:
+            memberOf[dotId] = name
+
+    # new nodes next to placed nodes first, so chains of new nodes grow from the drawing
+    pending = set(new)
+    queue = deque(dotId for dotId in new if any(other in positions for other in neighbours.get(dotId, ())))
+    unplaced = iter(new)
+    cursor = None
+    while pending:
+        if not queue:
+            queue.append(next(dotId for dotId in unplaced if dotId in pending))
+        dotId = queue.popleft()
+        if dotId not in pending:
+            continue
+        pending.discard(dotId)
+        width, height = estimateSize(NODE_LINE.match(lines[nodeLines[dotId]]).group(2))
+        near = [positions[other] for other in clusterNodes[memberOf[dotId]][0] if other in positions] if dotId in memberOf else []
+        if not near:
+            near = [positions[other] for other in neighbours.get(dotId, ()) if other in positions]
+        position = None
+        if near:
+            position = occupancy.place(sum(node[0] for node in near)/len(near), sum(node[1] for node in near)/len(near), width, height)
+        if position == None:
+            # rows below everything drawn so far, as wide as the drawing
+            if cursor == None:
+                box = boundingBox(positions.values(), ()) or (0, 0, 0, 0)
+                cursor = [box[0], box[1]-2*PLACE_STEP, box[0], max(box[2], box[0]+20*PLACE_STEP)]
+            if cursor[0] > cursor[3]:
+                cursor[0] = cursor[2]
+                cursor[1] -= 2*PLACE_STEP
+            position = occupancy.place(cursor[0]+width/2, cursor[1]-height/2, width, height) or (cursor[0]+width/2, cursor[1]-height/2)
+            cursor[0] += width+PLACE_GAP
+        positions[dotId] = (position[0], position[1], width, height)
+        occupancy.add(*positions[dotId])
+        queue.extend(other for other in neighbours.get(dotId, ()) if other in pending)
+
+    # clusters keep their box unless new nodes were placed in them, inner clusters come first
+    boxes = {}
+    grown = set()
+    placed = set(nodeKeys[dotId] for dotId in new)
+    for name,lineIdx in reversed(clusters):
+        members, children = clusterNodes[name]
+        key = clusterKey(keys, name)
+        box = layout.clusters.get(key)
+        if box == None or any(nodeKeys[dotId] in placed for dotId in members) or any(child in grown for child in children):
+            inner = boundingBox([positions[dotId] for dotId in members], [boxes[child] for child in children if child in boxes])
+            if inner == None:
+                continue
+            offset = box[4] if box != None else LABEL_OFFSET
+            box = (inner[0]-CLUSTER_MARGIN, inner[1]-CLUSTER_MARGIN, inner[2]+CLUSTER_MARGIN, inner[3]+CLUSTER_MARGIN+CLUSTER_LABEL, offset)
+            grown.add(name)
+        boxes[name] = box
+        seeded.clusters[key] = box
+        lines[lineIdx] += "\nbb=\"%g,%g,%g,%g\";\nlp=\"%g,%g\";" % (box[0], box[1], box[2], box[3], (box[0]+box[2])/2, box[3]-box[4])
+
+    for dotId,lineIdx in nodeLines.items():
+        node = positions[dotId]
+        seeded.nodes[nodeKeys[dotId]] = node
+        lines[lineIdx] = "%s [pos=\"%g,%g\",%s];" % (dotId, node[0], node[1], NODE_LINE.match(lines[lineIdx]).group(2))
+    # edges between nodes that stayed keep their route
+    for lineIdx,line in enumerate(lines):
+        match = EDGE_LINE.match(line)
+        if match == None:
+            continue
+        edge = (layoutKey(keys, match.group(1)), layoutKey(keys, match.group(2)))
+        pos = layout.edges.get(edge)
+        if pos != None and edge[0] not in placed and edge[1] not in placed:
+            seeded.edges[edge] = pos
+            lines[lineIdx] = "%s -- %s [pos=\"%s\"];" % (match.group(1), match.group(2), pos)
+
+    box = boundingBox(positions.values(), boxes.values())
+    if box != None:
+        lines[0] += "\nbb=\"%g,%g,%g,%g\";" % (box[0]-CLUSTER_MARGIN, box[1]-CLUSTER_MARGIN, box[2]+CLUSTER_MARGIN, box[3]+CLUSTER_MARGIN)
+    return "\n".join(lines), seeded
+
+# layouts of recently drawn stacks by their stackId, least recently used ones are dropped
+class PositionCache:
+    def __init__(self, maxLayouts=64, maxNewShare=MAX_NEW_SHARE):
+        self.maxLayouts = maxLayouts
+        self.maxNewShare = maxNewShare
+        self.layouts = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.relayouts = 0
+
+    # stored layout of a stack, None if it was not drawn before
+    def lookup(self, layoutId):
+        with self.lock:
+            layout = self.layouts.get(layoutId)
+            if layout == None:
+                self.misses += 1
+                return None
+            self.layouts.move_to_end(layoutId)
+            return layout
+
+    # dot text seeded with the positions of layout, see seedDot, None if the graph needs a new layout
+    # the seeded layout replaces the stored one
+    def seed(self, layoutId, layout, dot, keys):
+        seeded, seededLayout = seedDot(dot, keys, layout, self.maxNewShare)
+        with self.lock:
+            if seeded == None:
+                self.relayouts += 1
+            else:
+                self.hits += 1
+        if seeded != None:
+            self.put(layoutId, seededLayout)
+        return seeded
+
+    # store the layout of a stack
+    def put(self, layoutId, layout):
+        with self.lock:
+            self.layouts[layoutId] = layout
+            self.layouts.move_to_end(layoutId)
+            while len(self.layouts) > self.maxLayouts:
+                self.layouts.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "layouts": len(self.layouts),
+                "maxLayouts": self.maxLayouts,
+                "nodes": sum(len(layout.nodes) for layout in self.layouts.values()),
+                "seeded": self.hits,
+                "misses": self.misses,
+                "relayouts": self.relayouts,
+            }
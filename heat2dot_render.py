@@ -0,0 +1,231 @@
+# Graphviz rendering with bounded concurrency
+# Runs the dot executable with data passed over pipes, or on request
+# the pygraphviz library bindings in-process
+# Disconnected parts of a graph can be laid out in parallel and packed afterwards,
+# graphs whose nodes already have positions are drawn without a new layout
+# Large graphs and hosts without Graphviz can use the built-in layout of heat2dot_layout
+
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import pygraphviz
+except ImportError:
+    pygraphviz = None
+
+class RenderError(Exception):
+    pass
+
+class RenderTimeout(RenderError):
+    pass
+
+class RenderQueueFull(RenderError):
+    pass
+
+# Graphviz commands that pack laid out graphs into one drawing
+PACK_COMMAND = ["gvpack", "-g"]
+# draws a packed or positioned graph keeping the positions, -s keeps the units of the layout
+PACKED_RENDER_COMMAND = ["neato", "-s", "-n2"]
+
+# layout engines, auto uses the built-in layout for large graphs and when graphviz is missing
+ENGINE_AUTO = "auto"
+ENGINE_GRAPHVIZ = "graphviz"
+ENGINE_BUILTIN = "builtin"
+LAYOUT_ENGINES = [ENGINE_AUTO, ENGINE_GRAPHVIZ, ENGINE_BUILTIN]
+# graphs with at least this many nodes are drawn by the built-in layout with auto
+BUILTIN_LAYOUT_NODES = 20000
+
+# run a graphviz command with data on stdin and return its output
+# the process is killed if it does not finish within timeout seconds
+def pipeProcess(command, data, timeout=None):
+    if isinstance(data, str):
+        data = data.encode("UTF-8")
+    try:
+        process = subprocess.Popen(command,stdin=subprocess.PIPE,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+    except OSError as e:
+        raise RenderError("Failed to start "+command[0]+": "+str(e))
+    try:
+        out, err = process.communicate(input=data, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+        raise RenderTimeout("Layout did not finish within "+str(timeout)+" seconds")
+    if process.returncode != 0:
+        raise RenderError(command[0]+" failed: "+err.decode("UTF-8", "replace"))
+    return out
+
+# render dot text with the dot executable
+def renderProcess(dot, outputFormat="svg", timeout=None, prog="dot"):
+    return pipeProcess([prog,"-T"+outputFormat], dot, timeout)
+
+# true if the graphviz commands for renderComponents are installed
+def canPack():
+    return shutil.which(PACK_COMMAND[0]) != None and shutil.which(PACKED_RENDER_COMMAND[0]) != None
+
+# true if the graphviz command drawing positioned graphs is installed
+def canDrawPositioned():
+    return shutil.which(PACKED_RENDER_COMMAND[0]) != None
+
+# true if the dot executable of the default process backend is installed
+def hasGraphviz():
+    return shutil.which("dot") != None
+
+# the engine drawing a graph with nodeCount nodes in outputFormat, auto picks the
+# built-in layout for svg from builtinNodes nodes on (None never does) and if graphviz
+# is not installed, as long as numpy is installed for it
+def chooseEngine(engine, nodeCount, builtinNodes=BUILTIN_LAYOUT_NODES, outputFormat="svg"):
+    if engine != ENGINE_AUTO:
+        return engine
+    if outputFormat != "svg":
+        return ENGINE_GRAPHVIZ
+    import heat2dot_layout
+    if heat2dot_layout.available() and (not hasGraphviz() or (builtinNodes != None and nodeCount >= builtinNodes)):
+        return ENGINE_BUILTIN
+    return ENGINE_GRAPHVIZ
+
+# lay out and draw dot text written by heat2dot with the built-in layout, only svg is written
+def renderBuiltin(dot, outputFormat="svg"):
+    if outputFormat != "svg":
+        raise RenderError("The built-in layout only writes svg, not "+outputFormat)
+    import heat2dot_layout
+    return heat2dot_layout.renderSvg(dot)
+
+# distribute graphs over at most count batches of about the same total size
+def batchBySize(dots, count):
+    batches = [[] for batch in range(min(count, len(dots)))]
+    sizes = [0]*len(batches)
+    for dot in sorted(dots, key=len, reverse=True):
+        smallest = sizes.index(min(sizes))
+        batches[smallest].append(dot)
+        sizes[smallest] += len(dot)
+    return batches
+
+# libgvc is not thread-safe, library renders run one at a time
+LIBRARY_LOCK = threading.Lock()
+
+# render dot text in-process with libgvc
+# a running layout cannot be interrupted, timeouts only apply to the process backend
+def renderLibrary(dot, outputFormat="svg", prog="dot", args=""):
+    if isinstance(dot, bytes):
+        dot = dot.decode("UTF-8")
+    try:
+        with LIBRARY_LOCK:
+            graph = pygraphviz.AGraph(string=dot)
+            graph.layout(prog=prog, args=args)
+            return graph.draw(format=outputFormat)
+    except Exception as e:
+        raise RenderError("Graphviz failed: "+str(e))
+
+# runs renders on a fixed number of workers
+# at most queueSize renders wait for a worker, further submits are rejected
+class RenderScheduler:
+    # backend is "process", "library" or "auto" (process)
+    # the library backend has to be asked for: its renders run one at a time and
+    # ignore the timeout
+    def __init__(self, workers=None, queueSize=None, timeout=60, backend="auto"):
+        if workers == None:
+            workers = os.cpu_count() or 1
+        if queueSize == None:
+            queueSize = 4*workers
+        if backend == "auto":
+            backend = "process"
+        if backend == "library" and pygraphviz == None:
+            raise RenderError("pygraphviz is not installed")
+        self.workers = workers
+        self.queueSize = queueSize
+        self.timeout = timeout
+        self.backend = backend
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.slots = threading.BoundedSemaphore(workers+queueSize)
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    # true if graphs with positions can be drawn, see render
+    def canDrawPositioned(self):
+        return self.backend == "library" or canDrawPositioned()
+
+    # dot is the text of one graph or a list of graphs rendered one after another
+    # positioned graphs have a pos for every node and are drawn without layout
+    # engine is ENGINE_GRAPHVIZ or ENGINE_BUILTIN, see chooseEngine
+    def run(self, dot, outputFormat, positioned=False, engine=ENGINE_GRAPHVIZ):
+        if engine == ENGINE_BUILTIN:
+            return renderBuiltin(dot, outputFormat)
+        if positioned:
+            if self.backend == "library":
+                return renderLibrary(dot, outputFormat, PACKED_RENDER_COMMAND[0], " ".join(PACKED_RENDER_COMMAND[1:]))
+            return pipeProcess(PACKED_RENDER_COMMAND+["-T"+outputFormat], dot, self.timeout)
+        if isinstance(dot, list):
+            if self.backend == "library":
+                return b"".join(renderLibrary(graph, outputFormat) for graph in dot)
+            # dot lays out every graph of its input in one run
+            dot = "".join(dot)
+        if self.backend == "library":
+            return renderLibrary(dot, outputFormat)
+        return renderProcess(dot, outputFormat, self.timeout)
+
+    def done(self, future):
+        with self.lock:
+            self.pending -= 1
+            if future.cancelled():
+                self.failed += 1
+            elif future.exception() == None:
+                self.completed += 1
+            else:
+                self.failed += 1
+                if isinstance(future.exception(), RenderTimeout):
+                    self.timeouts += 1
+        self.slots.release()
+
+    # queue function(*args) on a worker, returns its future
+    # raises RenderQueueFull if all workers are busy and the queue is full
+    def submitCall(self, function, *args):
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.rejected += 1
+            raise RenderQueueFull("Render queue is full")
+        with self.lock:
+            self.pending += 1
+        future = self.executor.submit(function, *args)
+        future.add_done_callback(self.done)
+        return future
+
+    # queue a render, returns a future with the rendered bytes, see submitCall
+    def submit(self, dot, outputFormat="svg", positioned=False, engine=ENGINE_GRAPHVIZ):
+        return self.submitCall(self.run, dot, outputFormat, positioned, engine)
+
+    # queue a render and wait for it
+    def render(self, dot, outputFormat="svg", positioned=False, engine=ENGINE_GRAPHVIZ):
+        return self.submit(dot, outputFormat, positioned, engine).result()
+
+    # lay out independent graphs (e.g. heat2dot.componentDots) in parallel
+    # and pack them into one graph with positions, see canPack
+    # the graphs are spread over the workers by size, gvpack places the laid out
+    # graphs next to each other, also on a worker
+    def layoutComponents(self, dots):
+        futures = [self.submit(batch, "dot") for batch in batchBySize(dots, self.workers)]
+        laidOut = b"".join(future.result() for future in futures)
+        return self.submitCall(pipeProcess, PACK_COMMAND, laidOut, self.timeout).result()
+
+    # lay out and pack independent graphs, neato draws them without moving any node
+    def renderComponents(self, dots, outputFormat="svg"):
+        return self.render(self.layoutComponents(dots), outputFormat, positioned=True)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "backend": self.backend,
+                "workers": self.workers,
+                "queueSize": self.queueSize,
+                "pending": self.pending,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+            }
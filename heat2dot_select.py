@@ -0,0 +1,232 @@
+# Selective template parsing for heat2dot
+# Walks the json text or the yaml event stream and only builds objects
+# for the parts of a template named in a selection. Everything else,
+# e.g. user_data scripts, metadata, parameters and outputs, is passed over
+# without constructing python objects for it.
+
+# A selection maps the keys of a mapping to what is kept of their values:
+# True keeps the whole value, a dict selects keys of a mapping value again,
+# the key None applies to all keys that are not listed and unlisted keys
+# are skipped. A value that is not a mapping where the selection expects
+# one is kept whole.
+
+# Dependencies:
+# * PyYaml
+
+import re
+import json
+import yaml
+from yaml.nodes import ScalarNode
+
+# raised for input the selective parsers do not handle, e.g. yaml aliases
+# or syntax errors, the caller then parses the whole template instead
+class SelectionError(Exception):
+    pass
+
+def childSelection(selection, key):
+    if selection == True:
+        return True
+    return selection.get(key, selection.get(None))
+
+# the selected part of an already constructed value
+def prune(value, selection):
+    if selection == True or not isinstance(value, dict):
+        return value
+    wildcard = selection.get(None)
+    selected = {}
+    for key,item in value.items():
+        child = selection.get(key, wildcard)
+        if child == True:
+            selected[key] = item
+        elif child != None:
+            selected[key] = prune(item, child)
+    return selected
+
+# json
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+LITERAL = re.compile(r"[-+.\w]+")
+# start of a string or a bracket, everything in between is passed over
+SKIP_TOKEN = re.compile(r'["\[\]{}]')
+decoder = json.JSONDecoder()
+
+def loadJson(text, selection):
+    try:
+        if isinstance(text, bytes):
+            text = text.decode(json.detect_encoding(text))
+        elif text.startswith("\ufeff"):
+            # json.loads rejects this, leave the error message to it
+            raise SelectionError("Unexpected UTF-8 BOM")
+        idx = WHITESPACE.match(text, 0).end()
+        value, idx = selectJson(text, idx, selection)
+    except ValueError as e:
+        raise SelectionError(str(e))
+    if WHITESPACE.match(text, idx).end() != len(text):
+        raise SelectionError("Extra data at "+str(idx))
+    return value
+
+# returns the selected part of the value starting at idx and the index after it
+# walking a mapping key by key in python is slower than decoding it in C, so only
+# the top level and mappings selected for all their keys (e.g. the resources) are
+# walked, other mappings are decoded and pruned right away, which keeps a single
+# resource with its payloads in memory at a time
+def selectJson(text, idx, selection, walk=True):
+    if selection == True or text[idx:idx+1] != "{":
+        return decoder.raw_decode(text, idx)
+    if not walk and None not in selection:
+        value, idx = decoder.raw_decode(text, idx)
+        return prune(value, selection), idx
+
+    value = {}
+    idx = WHITESPACE.match(text, idx+1).end()
+    if text[idx:idx+1] == "}":
+        return value, idx+1
+    while True:
+        if text[idx:idx+1] != "\"":
+            raise SelectionError("Expected a key at "+str(idx))
+        key, idx = json.decoder.scanstring(text, idx+1)
+        idx = WHITESPACE.match(text, idx).end()
+        if text[idx:idx+1] != ":":
+            raise SelectionError("Expected ':' at "+str(idx))
+        idx = WHITESPACE.match(text, idx+1).end()
+        child = childSelection(selection, key)
+        if child == None:
+            idx = skipJson(text, idx)
+        else:
+            value[key], idx = selectJson(text, idx, child, False)
+        idx = WHITESPACE.match(text, idx).end()
+        separator = text[idx:idx+1]
+        idx = WHITESPACE.match(text, idx+1).end()
+        if separator == "}":
+            return value, idx
+        if separator != ",":
+            raise SelectionError("Expected ',' or '}' at "+str(idx))
+
+# index after the string starting at idx
+# str.find is much faster than a regular expression on long strings with escapes
+def skipString(text, idx):
+    end = text.find("\"", idx+1)
+    while end != -1:
+        # the quote is escaped if an odd number of backslashes precedes it
+        backslashes = 0
+        while text[end-1-backslashes] == "\\":
+            backslashes += 1
+        if backslashes%2 == 0:
+            return end+1
+        end = text.find("\"", end+1)
+    raise SelectionError("Unterminated string at "+str(idx))
+
+# index after the value starting at idx, the value is not decoded or validated
+def skipJson(text, idx):
+    first = text[idx:idx+1]
+    if first == "\"":
+        return skipString(text, idx)
+    if first != "{" and first != "[":
+        match = LITERAL.match(text, idx)
+        if match == None:
+            raise SelectionError("Expected a value at "+str(idx))
+        return match.end()
+    depth = 0
+    while True:
+        match = SKIP_TOKEN.search(text, idx)
+        if match == None:
+            raise SelectionError("Unterminated value at "+str(idx))
+        idx = match.end()
+        token = text[match.start()]
+        if token == "\"":
+            idx = skipString(text, idx-1)
+        elif token == "{" or token == "[":
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return idx
+
+# yaml
+
+STR_TAG = "tag:yaml.org,2002:str"
+SEQUENCE_TAGS = (None, "!", "tag:yaml.org,2002:seq")
+MAPPING_TAGS = (None, "!", "tag:yaml.org,2002:map")
+# scalars are resolved and constructed like yaml.SafeLoader does
+resolver = yaml.resolver.Resolver()
+constructor = yaml.constructor.SafeConstructor()
+
+# Loader only provides the event parser, e.g. yaml.CSafeLoader for libyaml
+def loadYaml(text, selection, Loader=yaml.SafeLoader):
+    try:
+        events = yaml.parse(text, Loader=Loader)
+        expectEvent(next(events), yaml.StreamStartEvent)
+        event = next(events)
+        # like yaml.load an empty stream is None
+        if isinstance(event, yaml.StreamEndEvent):
+            return None
+        expectEvent(event, yaml.DocumentStartEvent)
+        value = selectYaml(events, next(events), selection)
+        expectEvent(next(events), yaml.DocumentEndEvent)
+        expectEvent(next(events), yaml.StreamEndEvent)
+        return value
+    except (yaml.YAMLError, ValueError, StopIteration) as e:
+        raise SelectionError(str(e))
+
+def expectEvent(event, eventClass):
+    if not isinstance(event, eventClass):
+        raise SelectionError("Unexpected "+type(event).__name__)
+
+# returns the selected part of the node starting with event
+def selectYaml(events, event, selection):
+    if isinstance(event, yaml.AliasEvent) or event.anchor != None:
+        raise SelectionError("Anchors and aliases are not supported")
+    if isinstance(event, yaml.ScalarEvent):
+        return yamlScalar(event)
+
+    if isinstance(event, yaml.SequenceStartEvent):
+        if event.tag not in SEQUENCE_TAGS:
+            raise SelectionError("Unsupported tag "+str(event.tag))
+        value = []
+        event = next(events)
+        while not isinstance(event, yaml.SequenceEndEvent):
+            value.append(selectYaml(events, event, True))
+            event = next(events)
+        return value
+
+    expectEvent(event, yaml.MappingStartEvent)
+    if event.tag not in MAPPING_TAGS:
+        raise SelectionError("Unsupported tag "+str(event.tag))
+    value = {}
+    event = next(events)
+    while not isinstance(event, yaml.MappingEndEvent):
+        expectEvent(event, yaml.ScalarEvent)
+        if event.anchor != None:
+            raise SelectionError("Anchors and aliases are not supported")
+        key = yamlScalar(event)
+        child = childSelection(selection, key)
+        if child == None:
+            skipYaml(events, next(events))
+        else:
+            value[key] = selectYaml(events, next(events), child)
+        event = next(events)
+    return value
+
+# pass over the node starting with event
+def skipYaml(events, event):
+    if not isinstance(event, yaml.CollectionStartEvent):
+        return
+    depth = 1
+    while depth > 0:
+        event = next(events)
+        if isinstance(event, yaml.CollectionStartEvent):
+            depth += 1
+        elif isinstance(event, yaml.CollectionEndEvent):
+            depth -= 1
+
+def yamlScalar(event):
+    tag = event.tag
+    if tag == None or tag == "!":
+        tag = resolver.resolve(ScalarNode, event.value, event.implicit)
+    if tag == STR_TAG:
+        return event.value
+    construct = constructor.yaml_constructors.get(tag)
+    # e.g. merge keys or tags unknown to the safe loader
+    if construct == None:
+        raise SelectionError("Unsupported tag "+str(tag))
+    return construct(constructor, ScalarNode(tag, event.value, style=event.style))
@@ -1,62 +1,190 @@
 #!/usr/bin/python3
 # small server to serve heat2dot conversion and output as svg
 
-import subprocess
-import time
 import os
+import time
+import argparse
 from flask import Flask
 from flask import request
+from flask import jsonify
 from flask import Markup
+import heat2dot
+import heat2dot_api
+import heat2dot_jobs
+import heat2dot_cache
+import heat2dot_render
+import heat2dot_metrics
+import heat2dot_positions
 app = Flask(__name__)
 
 PORT = 1111
+# largest accepted upload in async mode and largest decompressed template of the api
+MAX_UPLOAD = int(os.environ.get("HEAT2DOT_MAX_UPLOAD", 64*1024*1024))
+
+# render cache, the disk tier is enabled by setting HEAT2DOT_CACHE_DIR
+CACHE_BYTES = int(os.environ.get("HEAT2DOT_CACHE_BYTES", 64*1024*1024))
+CACHE_DIR = os.environ.get("HEAT2DOT_CACHE_DIR")
+renderCache = heat2dot_cache.RenderCache(maxBytes=CACHE_BYTES, directory=CACHE_DIR)
+
+# graphviz renders, by default one worker per core
+RENDER_WORKERS = int(os.environ.get("HEAT2DOT_RENDER_WORKERS", os.cpu_count() or 1))
+RENDER_QUEUE = int(os.environ.get("HEAT2DOT_RENDER_QUEUE", 4*RENDER_WORKERS))
+RENDER_TIMEOUT = float(os.environ.get("HEAT2DOT_RENDER_TIMEOUT", 60))
+RENDER_BACKEND = os.environ.get("HEAT2DOT_RENDER_BACKEND", "auto")
+renderScheduler = heat2dot_render.RenderScheduler(workers=RENDER_WORKERS, queueSize=RENDER_QUEUE, timeout=RENDER_TIMEOUT, backend=RENDER_BACKEND)
+
+# connected components of graphs with at least this many nodes are laid out in parallel
+PARALLEL_LAYOUT_NODES = int(os.environ.get("HEAT2DOT_PARALLEL_LAYOUT_NODES", 2000))
+CAN_PACK = heat2dot_render.canPack()
+
+# graphs with at least this many nodes are drawn by the built-in layout unless the form
+# asks for graphviz, 0 only uses it when graphviz is not installed
+BUILTIN_LAYOUT_NODES = int(os.environ.get("HEAT2DOT_BUILTIN_LAYOUT_NODES", heat2dot_render.BUILTIN_LAYOUT_NODES)) or None
+
+# node positions of the last layouts of up to this many stacks are kept, 0 disables,
+# stacks with at most HEAT2DOT_POSITION_MAX_NEW new nodes are drawn at those positions
+POSITION_LAYOUTS = int(os.environ.get("HEAT2DOT_POSITION_LAYOUTS", 64))
+POSITION_MAX_NEW = float(os.environ.get("HEAT2DOT_POSITION_MAX_NEW", heat2dot_positions.MAX_NEW_SHARE))
+positionCache = None
+if POSITION_LAYOUTS > 0 and renderScheduler.canDrawPositioned():
+    positionCache = heat2dot_positions.PositionCache(POSITION_LAYOUTS, POSITION_MAX_NEW)
+
+# stage timings of the served conversions, a cProfile profile of every
+# conversion is written to HEAT2DOT_PROFILE_DIR if set
+metrics = heat2dot_metrics.PipelineMetrics()
+PROFILE_DIR = os.environ.get("HEAT2DOT_PROFILE_DIR")
+
+# larger graphs are drawn with a coarser level of detail, 0 disables the budget
+NODE_BUDGET = int(os.environ.get("HEAT2DOT_NODE_BUDGET", 5000)) or None
+
+# problems listed per kind on error pages, further ones are only counted, 0 lists all
+DIAGNOSTIC_LIMIT = int(os.environ.get("HEAT2DOT_DIAGNOSTIC_LIMIT", 20)) or None
+
+# job queue and results shared by the replicas using the same HEAT2DOT_JOB_DB file,
+# each replica runs HEAT2DOT_JOB_WORKERS jobs at a time
+JOB_DB = os.environ.get("HEAT2DOT_JOB_DB")
+JOB_WORKERS = int(os.environ.get("HEAT2DOT_JOB_WORKERS", RENDER_WORKERS))
+JOB_TTL = float(os.environ.get("HEAT2DOT_JOB_TTL", heat2dot_jobs.TTL))
+JOB_LEASE = float(os.environ.get("HEAT2DOT_JOB_LEASE", heat2dot_jobs.LEASE))
+jobStore = None
+if JOB_DB != None:
+    jobStore = heat2dot_jobs.JobStore(JOB_DB, JOB_TTL, JOB_LEASE)
+# the workers are started with the server
+jobWorkers = None
+
+def optionQuery(options):
+    if options["query"] == None:
+        return None
+    return heat2dot.Query(*options["query"])
+
+# components of a converted graph to lay out in parallel, None for small graphs
+def layoutComponents(result):
+    if CAN_PACK and RENDER_WORKERS > 1 and heat2dot.detailNodeCount(result.graph, result.detail) >= PARALLEL_LAYOUT_NODES:
+        dots = heat2dot.componentDots(result.graph, result.detail)
+        # one component and the legend
+        if len(dots) > 2:
+            return dots
+    return None
+
+# render a converted graph, in parallel per connected component if it is large
+# with the position cache a stack drawn before keeps the positions of its nodes,
+# new layouts are drawn from the laid out dot text so their positions can be stored
+# stack is the name of the stack, see heat2dot_positions.stackId
+# the built-in layout is fast enough to draw every graph anew
+def renderGraph(result, engine=heat2dot_render.ENGINE_AUTO, outputFormat="svg", stack=None):
+    engine = heat2dot_render.chooseEngine(engine, heat2dot.detailNodeCount(result.graph, result.detail), BUILTIN_LAYOUT_NODES, outputFormat)
+    if engine == heat2dot_render.ENGINE_BUILTIN:
+        return renderScheduler.render(result.dot, outputFormat, engine=engine)
+    components = layoutComponents(result)
+    if positionCache == None:
+        if components != None:
+            return renderScheduler.renderComponents(components, outputFormat)
+        return renderScheduler.render(result.dot, outputFormat)
+
+    keys = heat2dot_positions.dotKeys(result.graph, result.detail)
+    layoutId = heat2dot_positions.stackId(keys, result.detail, stack)
+    layout = positionCache.lookup(layoutId)
+    if layout != None:
+        seeded = positionCache.seed(layoutId, layout, result.dot, keys)
+        if seeded != None:
+            return renderScheduler.render(seeded, outputFormat, positioned=True)
+    if components != None:
+        laidOut = renderScheduler.layoutComponents(components)
+    else:
+        laidOut = renderScheduler.render(result.dot, "dot")
+    positionCache.put(layoutId, heat2dot_positions.readLayout(laidOut, keys, result.detail))
+    return renderScheduler.render(laidOut, outputFormat, positioned=True)
+
+# convert and render a template
+# results are cached under the raw text and under the normalized template
+# parse failures and failed renders are not cached
+# options["format"] is what the entry holds besides the dot text, svg, png or
+# json for the graph as json (see heat2dot_api)
+def render(text, options):
+    textKey = heat2dot_cache.textKey(text, options)
+    entry = renderCache.get(textKey, countMiss=False)
+    if entry != None:
+        metrics.record(None, "text")
+        return entry
+
+    result = heat2dot.DotResult(options["diagnosticLimit"])
+    textobj = heat2dot.parseTemplate(text, result)
+    if textobj == None:
+        metrics.record(result.metrics(), "miss")
+        return {"success": False, "messages": result.messageText(), "dot": None, "svg": None}
+
+    key = heat2dot_cache.templateKey(textobj, options)
+    entry = renderCache.get(key)
+    if entry != None:
+        metrics.record(None, "template")
+    else:
+        result = heat2dot.convert(textobj, result=result, detail=options["detail"], nodeBudget=options["nodeBudget"], query=optionQuery(options))
+        entry = {"success": result.success, "messages": result.messageText(), "dot": result.dot, "svg": None}
+        layoutSeconds = None
+        if result.success and options["format"] == "json":
+            entry["json"] = heat2dot_api.graphJson(result)
+        elif result.success and options["format"] in heat2dot_api.RENDERED_FORMATS:
+            start = time.perf_counter()
+            heat2dot_api.setOutput(entry, options["format"], renderGraph(result, options["engine"], options["format"], options.get("stack")))
+            layoutSeconds = time.perf_counter()-start
+        metrics.record(result.metrics(), "miss", layoutSeconds)
+        renderCache.put(key, entry)
+    renderCache.alias(textKey, key)
+    return entry
 
 @app.route('/')
 def main():
-    return ("<html><head><title>heat2dot</title></head><body>"
-            "<form method=\"POST\" action=\"convert\">"
-            "Enter json or yaml text:<br/>"
-            "<textarea name=\"text\"></textarea><br/>"
-            "<input type=\"submit\"/>"
-            "</form>"
-            "</body></html>")
+    return "<html><head><title>heat2dot</title></head><body>"+heat2dot_api.FORM+"</body></html>"
 
 @app.route('/convert',methods=['POST'])
 def convert():
     if "text" not in request.form:
         return "<html><head><title>heat2dot</title></head><body>Text not found</body></html>",403
-    
-    infile = "/tmp/inheat2dot_"+str(time.time())
-    dotfile = "/tmp/inheat2dot_"+str(time.time())+".dot"
+    options = heat2dot_api.formOptions(request.form, NODE_BUDGET, DIAGNOSTIC_LIMIT)
+    if options == None:
+        return "<html><head><title>heat2dot</title></head><body>Invalid options</body></html>",403
 
-    with open(infile,"w") as intextfile:
-        intextfile.write(request.form["text"])
-    
     error_messages = None
     svg = None
 
     try:
-        h2d_out = subprocess.run(["cat "+infile+" | ./heat2dot.py > "+dotfile],shell=True,stderr=subprocess.PIPE)
-        error_messages = h2d_out.stderr.decode("UTF-8")
+        if PROFILE_DIR != None:
+            entry = heat2dot_metrics.profileCall(heat2dot_metrics.profilePath(PROFILE_DIR), render, request.form["text"], options)
+        else:
+            entry = render(request.form["text"], options)
+        error_messages = entry["messages"]
 
-        if h2d_out.returncode != 0:
-        
-            return Markup("<html><head><title>heat2dot</title></head><body>Failure<br/><pre>")+Markup.escape(h2d_out.stderr.decode("UTF-8"))+Markup("</pre></body></html>")
+        if not entry["success"]:
+            return Markup("<html><head><title>heat2dot</title></head><body>Failure<br/><pre>")+Markup.escape(error_messages)+Markup("</pre></body></html>")
         else:
-            dot_out = subprocess.run(["dot -Tsvg "+dotfile],shell=True,stdout=subprocess.PIPE)
-            svg = dot_out.stdout.decode("UTF-8")
+            svg = entry["svg"]
+    except heat2dot_render.RenderQueueFull:
+        return "<html><head><title>heat2dot</title></head><body>Server busy, try again later</body></html>",503
+    except heat2dot_render.RenderError as e:
+        return Markup("<html><head><title>heat2dot</title></head><body>Failure<br/><pre>")+Markup.escape(str(e))+Markup("</pre></body></html>")
     except Exception as e:
         print(e)
-    finally:
-        try:
-            os.remove(infile)
-        except:
-            pass
-        try:
-            os.remove(dotfile)
-        except:
-            pass
-    
+
     if error_messages != None and svg == None:
         return Markup("<html><head><title>heat2dot</title></head><body>Failure<br/><pre>")+Markup.escape(error_messages)+Markup("</pre></body></html>")
     elif svg != None:
@@ -73,6 +201,94 @@ def convert():
     else:
         return "<html><head><title>heat2dot</title></head><body>Something went horribly wrong.</body></html>"
 
-if __name__ == '__main__':
-    app.run(host="0.0.0.0",port=PORT)
+def apiResponse(response):
+    status, body, headers = response
+    return body, status, headers
+
+# options, output format and template of an api request, see heat2dot_api
+# raises ApiError for invalid requests
+def apiRequest():
+    options = heat2dot_api.formOptions(request.args, NODE_BUDGET, DIAGNOSTIC_LIMIT)
+    outputFormat = heat2dot_api.apiFormat(options, request.args)
+    if outputFormat == None:
+        raise heat2dot_api.ApiError(400, "Invalid options")
+    if request.content_length != None and request.content_length > MAX_UPLOAD:
+        raise heat2dot_api.ApiError(413, "Template larger than %d bytes" % MAX_UPLOAD)
+    return options, outputFormat, heat2dot_api.decodeBody(request.get_data(), request.headers.get("Content-Encoding"), MAX_UPLOAD)
+
+# the template is the request body, the options are query parameters, see heat2dot_api
+@app.route('/api/convert',methods=['POST'])
+def apiConvert():
+    try:
+        options, outputFormat, text = apiRequest()
+        if PROFILE_DIR != None:
+            entry = heat2dot_metrics.profileCall(heat2dot_metrics.profilePath(PROFILE_DIR), render, text, options)
+        else:
+            entry = render(text, options)
+    except heat2dot_api.ApiError as e:
+        return apiResponse(heat2dot_api.errorResponse(e.status, str(e)))
+    except heat2dot_render.RenderQueueFull:
+        return apiResponse(heat2dot_api.errorResponse(503, "Server busy, try again later"))
+    except heat2dot_render.RenderError as e:
+        return apiResponse(heat2dot_api.errorResponse(500, str(e)))
+    return apiResponse(heat2dot_api.entryResponse(entry, outputFormat, request.headers.get("Accept-Encoding")))
 
+# queue a render like /api/convert, identical jobs of all replicas are rendered once
+@app.route('/jobs',methods=['POST'])
+def submitJob():
+    if jobStore == None:
+        return apiResponse(heat2dot_api.errorResponse(404, "Jobs are not enabled, see HEAT2DOT_JOB_DB"))
+    try:
+        options, outputFormat, text = apiRequest()
+    except heat2dot_api.ApiError as e:
+        return apiResponse(heat2dot_api.errorResponse(e.status, str(e)))
+    jobId = heat2dot_jobs.jobId(text, options, outputFormat)
+    state, coalesced = jobStore.submit(jobId, text, options, outputFormat)
+    if jobWorkers != None:
+        jobWorkers.notify()
+    return apiResponse(heat2dot_jobs.submitResponse(jobId, state, coalesced))
+
+# the result of a finished job or its state, wait=SECONDS waits for it to finish
+@app.route('/jobs/<jobId>')
+def getJob(jobId):
+    if jobStore == None:
+        return apiResponse(heat2dot_api.errorResponse(404, "Jobs are not enabled, see HEAT2DOT_JOB_DB"))
+    try:
+        wait = float(request.args.get("wait", 0))
+    except ValueError:
+        return apiResponse(heat2dot_api.errorResponse(400, "Invalid wait"))
+    return apiResponse(heat2dot_jobs.jobResponse(jobStore.wait(jobId, wait), request.headers.get("Accept-Encoding")))
+
+@app.route('/cache')
+def cache():
+    return jsonify(renderCache.stats())
+
+@app.route('/render')
+def renderStats():
+    return jsonify(renderScheduler.stats())
+
+@app.route('/metrics')
+def metricsStats():
+    stats = metrics.stats()
+    stats["cacheStats"] = renderCache.stats()
+    stats["render"] = renderScheduler.stats()
+    if positionCache != None:
+        stats["positions"] = positionCache.stats()
+    if jobStore != None:
+        stats["jobs"] = jobStore.stats()
+    return jsonify(stats)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serves heat2dot conversion and output as svg")
+    parser.add_argument("--async", dest="asyncMode", action="store_true",
+                        help="asyncio server with streamed responses, requires aiohttp")
+    args = parser.parse_args()
+    if args.asyncMode or os.environ.get("HEAT2DOT_ASYNC") == "1":
+        import heat2dot_async
+        heat2dot_async.run("0.0.0.0", PORT, renderCache, RENDER_WORKERS, RENDER_QUEUE, RENDER_TIMEOUT, MAX_UPLOAD, NODE_BUDGET, PARALLEL_LAYOUT_NODES, PROFILE_DIR, DIAGNOSTIC_LIMIT,
+                           positionCache, BUILTIN_LAYOUT_NODES,
+                           jobStore, JOB_WORKERS)
+    else:
+        if jobStore != None:
+            jobWorkers = heat2dot_jobs.JobWorkers(jobStore, render, JOB_WORKERS)
+        app.run(host="0.0.0.0",port=PORT)
@@ -0,0 +1,54 @@
+# Request bodies of the raw body api
+
+import os
+import sys
+import gzip
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import heat2dot_api
+from heat2dot_api import ApiError, decodeBody
+
+TEMPLATE = b'{"resources": {"net": {"type": "OS::Neutron::Net"}}}'
+
+class DecodeBodyTest(unittest.TestCase):
+    def assertStatus(self, status, data, contentEncoding, limit=1024):
+        with self.assertRaises(ApiError) as context:
+            decodeBody(data, contentEncoding, limit)
+        self.assertEqual(context.exception.status, status)
+
+    def testPlain(self):
+        self.assertEqual(decodeBody(TEMPLATE, None, 1024), TEMPLATE)
+        self.assertEqual(decodeBody(TEMPLATE, "identity", 1024), TEMPLATE)
+
+    def testGzip(self):
+        self.assertEqual(decodeBody(gzip.compress(TEMPLATE), "gzip", 1024), TEMPLATE)
+        # already decoded by the web framework
+        self.assertEqual(decodeBody(TEMPLATE, "gzip", 1024), TEMPLATE)
+
+    def testTooLarge(self):
+        self.assertStatus(413, TEMPLATE, None, 10)
+        self.assertStatus(413, gzip.compress(b" "*100000), "gzip", 1000)
+
+    def testInvalid(self):
+        compressed = gzip.compress(TEMPLATE)
+        self.assertStatus(400, compressed[:len(compressed)//2], "gzip")
+        self.assertStatus(400, heat2dot_api.GZIP_MAGIC+b"\x08\x00not deflate data", "gzip")
+
+    def testUnsupportedEncoding(self):
+        self.assertStatus(415, TEMPLATE, "br")
+
+    @unittest.skipIf(heat2dot_api.zstandard != None, "zstandard is installed")
+    def testZstdMissing(self):
+        self.assertStatus(415, heat2dot_api.ZSTD_MAGIC+b"\x00"*8, "zstd")
+
+    @unittest.skipIf(heat2dot_api.zstandard == None, "zstandard is not installed")
+    def testZstd(self):
+        compressed = heat2dot_api.zstandard.ZstdCompressor().compress(TEMPLATE)
+        self.assertEqual(decodeBody(compressed, "zstd", 1024), TEMPLATE)
+        self.assertStatus(400, compressed[:len(compressed)//2], "zstd")
+        self.assertStatus(413, heat2dot_api.zstandard.ZstdCompressor().compress(b" "*100000), "zstd", 1000)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+# Cache keys of parsed templates
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import heat2dot
+import heat2dot_cache
+
+MIXED_KEYS = """
+heat_template_version: 2015-04-30
+resources:
+  1:
+    type: OS::Neutron::Net
+    properties: {name: one}
+  b:
+    type: OS::Neutron::Net
+    properties: {name: b}
+"""
+
+def parse(text):
+    result = heat2dot.DotResult()
+    textobj = heat2dot.parseTemplate(text, result)
+    return textobj, result
+
+class TemplateKeyTest(unittest.TestCase):
+    def testMixedKeyTypes(self):
+        textobj, result = parse(MIXED_KEYS)
+        self.assertNotEqual(textobj, None, result.messageText())
+        key = heat2dot_cache.templateKey(textobj, {"format": "svg"})
+        self.assertTrue(key.startswith("n"))
+        self.assertTrue(heat2dot.convert(textobj).success)
+
+    def testKeyTypesDiffer(self):
+        options = {"format": "svg"}
+        self.assertNotEqual(heat2dot_cache.templateKey({1: "x"}, options), heat2dot_cache.templateKey({"1": "x"}, options))
+        self.assertNotEqual(heat2dot_cache.templateKey({"a": [{1: "x"}]}, options), heat2dot_cache.templateKey({"a": [{"1": "x"}]}, options))
+
+    def testKeyOrderAndFormat(self):
+        options = {"format": "svg"}
+        first, result = parse('{"resources": {"a": {"type": "OS::Neutron::Net"}, "b": {"type": "OS::Neutron::Router"}}}')
+        second, result = parse("resources:\n  b: {type: OS::Neutron::Router}\n  a: {type: OS::Neutron::Net}\n")
+        self.assertEqual(heat2dot_cache.templateKey(first, options), heat2dot_cache.templateKey(second, options))
+        self.assertNotEqual(heat2dot_cache.templateKey(first, options), heat2dot_cache.templateKey(first, {"format": "png"}))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+# Graphs laid out per connected component draw the same nodes as the whole graph
+
+import os
+import re
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import heat2dot
+
+NODE_LINE = re.compile(r"^\w+ \[.*\];$", re.M)
+
+# two nets with three servers each, servers without ports and servers whose port
+# refers to a missing net, the last two kinds are grouped across components
+def template():
+    resources = {}
+    for netIdx in range(2):
+        net = "net"+str(netIdx)
+        resources[net] = {"type": "OS::Neutron::Net", "properties": {"name": net}}
+        for serverIdx in range(3):
+            port = "port"+str(netIdx)+"_"+str(serverIdx)
+            resources[port] = {"type": "OS::Neutron::Port", "properties": {"name": port, "network": {"get_resource": net}}}
+            resources["server"+str(netIdx)+"_"+str(serverIdx)] = {"type": "OS::Nova::Server", "properties": {
+                "name": "server"+str(netIdx)+"_"+str(serverIdx), "networks": [{"port": {"get_resource": port}}]}}
+    for serverIdx in range(3):
+        resources["lonely"+str(serverIdx)] = {"type": "OS::Nova::Server", "properties": {"name": "lonely"+str(serverIdx)}}
+    for serverIdx in range(2):
+        port = "brokenport"+str(serverIdx)
+        resources[port] = {"type": "OS::Neutron::Port", "properties": {"name": port, "network": {"get_resource": "missing"}}}
+        resources["broken"+str(serverIdx)] = {"type": "OS::Nova::Server", "properties": {
+            "name": "broken"+str(serverIdx), "networks": [{"port": {"get_resource": port}}]}}
+    return {"heat_template_version": "2015-04-30", "resources": resources}
+
+def nodeLines(dot):
+    return sorted(NODE_LINE.findall(dot))
+
+class ComponentDotsTest(unittest.TestCase):
+    def testSameNodes(self):
+        result = heat2dot.convert(template())
+        self.assertTrue(result.success, result.messageText())
+        for detail in heat2dot.DETAIL_LEVELS:
+            dot = "".join(heat2dot.iterDot(result.graph, detail=detail, legend=False))
+            components = heat2dot.componentDots(result.graph, detail)[:-1]
+            self.assertGreater(len(components), 1)
+            self.assertEqual(nodeLines("".join(components)), nodeLines(dot), detail)
+
+    def testGroupsAcrossComponents(self):
+        result = heat2dot.convert(template())
+        dot = "".join(heat2dot.componentDots(result.graph, heat2dot.DETAIL_GROUPED))
+        self.assertIn("lonely0 x3", dot)
+        self.assertIn("broken0 x2", dot)
+
+if __name__ == "__main__":
+    unittest.main()
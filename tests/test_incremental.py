@@ -0,0 +1,57 @@
+# Incremental re-conversion gives the same result as a full conversion
+
+import os
+import sys
+import copy
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import heat2dot
+import heat2dot_bench
+import heat2dot_incremental
+
+class IncrementalTest(unittest.TestCase):
+    def setUp(self):
+        self.template = heat2dot_bench.generateTemplate(200, brokenShare=0.05)
+        self.resources = self.template["resources"]
+        self.converter = heat2dot_incremental.IncrementalConverter()
+        self.check()
+
+    def check(self):
+        full = heat2dot.convert(copy.deepcopy(self.template))
+        result = self.converter.update(copy.deepcopy(self.template))
+        self.assertEqual(result.success, full.success)
+        self.assertEqual(result.dot, full.dot)
+        self.assertEqual(result.messages, full.messages)
+
+    def testRename(self):
+        self.resources["server0_0"]["properties"]["name"] = "renamed:vm"
+        self.check()
+        self.assertFalse(self.converter.fullRebuild)
+
+    def testReference(self):
+        self.resources["port0_1_0"]["properties"]["network"] = {"get_resource": "net1"}
+        self.check()
+        self.resources["port0_1_0"]["properties"]["network"] = {"get_resource": "missing"}
+        self.check()
+
+    def testNameCollision(self):
+        self.resources["net1"]["properties"]["name"] = "net0:n"
+        self.check()
+
+    def testAddAndDelete(self):
+        self.resources["newport"] = {"type": "OS::Neutron::Port", "properties": {"name": "newport", "network": {"get_resource": "net0"}}}
+        self.resources["server0_2"]["properties"]["networks"].append({"port": {"get_resource": "newport"}})
+        self.check()
+        del self.resources["server0_3"]
+        self.check()
+
+    def testSeveralEdits(self):
+        for idx in range(5):
+            self.resources["port0_%d_1" % idx]["properties"]["name"] = "edited%d" % idx
+            self.resources.pop("fip%d_0" % idx, None)
+            self.check()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+# Shared job queue of the server replicas
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import heat2dot_jobs
+from heat2dot_jobs import JobStore, jobId
+
+OPTIONS = {"format": "svg", "detail": "full"}
+ENTRY = {"success": True, "messages": None, "dot": "graph heat {\n}\n", "svg": "<svg/>"}
+
+class JobStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "jobs.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def submit(self, store, text=b"template"):
+        job = jobId(text, OPTIONS, "svg")
+        return job, store.submit(job, text, OPTIONS, "svg")
+
+    def testClaimAndFinish(self):
+        store = JobStore(self.path)
+        job, submitted = self.submit(store)
+        self.assertEqual(submitted, (heat2dot_jobs.QUEUED, False))
+        # the same template and options join the queued job
+        self.assertEqual(self.submit(store)[1], (heat2dot_jobs.QUEUED, True))
+        self.assertEqual(store.claim(), (job, b"template", OPTIONS))
+        self.assertEqual(store.claim(), None)
+        self.assertEqual(store.get(job)["state"], heat2dot_jobs.RUNNING)
+        store.finish(job, ENTRY)
+        finished = store.get(job)
+        self.assertEqual(finished["state"], heat2dot_jobs.DONE)
+        self.assertEqual(finished["entry"], ENTRY)
+        status, body, headers = heat2dot_jobs.jobResponse(finished)
+        self.assertEqual((status, body), (200, b"<svg/>"))
+        self.assertEqual(self.submit(store)[1], (heat2dot_jobs.DONE, True))
+
+    def testFail(self):
+        store = JobStore(self.path)
+        job = self.submit(store)[0]
+        store.claim()
+        store.fail(job, "broken")
+        self.assertEqual(heat2dot_jobs.jobResponse(store.get(job))[0], 500)
+        # failed jobs are queued again
+        self.assertEqual(self.submit(store)[1], (heat2dot_jobs.QUEUED, False))
+
+    def testExpiredLease(self):
+        first = JobStore(self.path, lease=0.05)
+        second = JobStore(self.path, lease=0.05)
+        job = self.submit(first)[0]
+        self.assertEqual(first.claim()[0], job)
+        self.assertEqual(second.claim(), None)
+        # the first replica stopped sending heartbeats
+        time.sleep(0.1)
+        self.assertEqual(second.claim()[0], job)
+        self.assertEqual(second.stats()["reclaimed"], 1)
+        # the result of the replica that lost the job is dropped
+        first.finish(job, dict(ENTRY, svg="<svg>first</svg>"))
+        self.assertEqual(first.get(job)["state"], heat2dot_jobs.RUNNING)
+        second.finish(job, ENTRY)
+        self.assertEqual(first.get(job)["entry"], ENTRY)
+
+    def testGiveUp(self):
+        store = JobStore(self.path, lease=0)
+        job = self.submit(store)[0]
+        for attempt in range(heat2dot_jobs.MAX_ATTEMPTS):
+            self.assertEqual(store.claim()[0], job)
+            time.sleep(0.01)
+        self.assertEqual(store.claim(), None)
+        self.assertEqual(store.get(job)["state"], heat2dot_jobs.FAILED)
+
+    def testPurge(self):
+        store = JobStore(self.path, ttl=0.05)
+        finished = self.submit(store, b"finished")[0]
+        store.claim()
+        store.finish(finished, ENTRY)
+        queued = self.submit(store, b"queued")[0]
+        time.sleep(0.1)
+        store.purge()
+        self.assertEqual(store.get(finished), None)
+        self.assertEqual(heat2dot_jobs.jobResponse(None)[0], 404)
+        self.assertEqual(store.get(queued)["state"], heat2dot_jobs.QUEUED)
+
+if __name__ == "__main__":
+    unittest.main()
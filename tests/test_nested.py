@@ -0,0 +1,39 @@
+# Expansion of resource groups
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import heat2dot
+
+GROUP = """
+heat_template_version: 2015-04-30
+parameters:
+  n:
+    type: number
+    default: 3
+resources:
+  net:
+    type: OS::Neutron::Net
+  group:
+    type: OS::Heat::ResourceGroup
+    properties:
+      count: {get_param: n}
+      resource_def:
+        type: OS::Nova::Server
+        properties:
+          name: vm%index%
+"""
+
+class GroupTest(unittest.TestCase):
+    def testParameterDefault(self):
+        for selective in (True, False):
+            result = heat2dot.convert(GROUP, selective=selective)
+            self.assertTrue(result.success, result.messageText())
+            self.assertEqual(sorted(server.shortName for server in result.graph.servers), ["vm0", "vm1", "vm2"])
+            self.assertNotIn("not known", result.messageText() or "")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+# Subgraph queries draw every node their edges refer to
+
+import os
+import re
+import sys
+import json
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import heat2dot
+
+NODE_LINE = re.compile(r"^(\w+) \[", re.M)
+EDGE_LINE = re.compile(r"^(\w+) -- (\w+)", re.M)
+
+# two nets with two servers of two ports each, a floating ip and a router between them
+def template():
+    resources = {"router0": {"type": "OS::Neutron::Router", "properties": {"name": "router0"}}}
+    for netIdx in range(2):
+        net = "net"+str(netIdx)
+        subnet = "subnet"+str(netIdx)
+        resources[net] = {"type": "OS::Neutron::Net", "properties": {"name": net}}
+        resources[subnet] = {"type": "OS::Neutron::Subnet", "properties": {
+            "name": subnet, "cidr": "10.0."+str(netIdx)+".0/24", "network": {"get_resource": net}}}
+        resources["ri"+str(netIdx)] = {"type": "OS::Neutron::RouterInterface", "properties": {
+            "router": {"get_resource": "router0"}, "subnet": {"get_resource": subnet}}}
+        for serverIdx in range(2):
+            server = "server"+str(netIdx)+"_"+str(serverIdx)
+            networks = []
+            for portIdx in range(2):
+                port = "port"+str(netIdx)+"_"+str(serverIdx)+"_"+str(portIdx)
+                resources[port] = {"type": "OS::Neutron::Port", "properties": {
+                    "name": port, "network": {"get_resource": net}}}
+                networks.append({"port": {"get_resource": port}})
+            resources[server] = {"type": "OS::Nova::Server", "properties": {"name": server, "networks": networks}}
+        resources["fip"+str(netIdx)] = {"type": "OS::Neutron::FloatingIP", "properties": {
+            "port_id": {"get_resource": "port"+str(netIdx)+"_0_0"}}}
+    return json.dumps({"heat_template_version": "2015-04-30", "resources": resources})
+
+def dotNodes(dot):
+    return set(NODE_LINE.findall(dot))-{"graph", "node", "edge"}
+
+def dotEdges(dot):
+    return EDGE_LINE.findall(dot)
+
+class QueryTest(unittest.TestCase):
+    def convert(self, kind, name, hops=1, detail=heat2dot.DETAIL_FULL):
+        result = heat2dot.convert(template(), detail=detail, query=heat2dot.Query(kind, name, hops))
+        self.assertTrue(result.success, result.messageText())
+        return result
+
+    def assertEdgesDeclared(self, dot):
+        nodes = dotNodes(dot)
+        edges = dotEdges(dot)
+        self.assertTrue(edges)
+        for fromId,toId in edges:
+            self.assertIn(fromId, nodes)
+            self.assertIn(toId, nodes)
+
+    def testAroundNetwork(self):
+        result = self.convert(heat2dot.QUERY_AROUND, "net0")
+        self.assertEdgesDeclared(result.dot)
+        # the ports of net0 are drawn in the clusters of their servers
+        self.assertEqual(len(result.graph.ports), 4)
+        self.assertEqual(len(result.graph.servers), 2)
+        self.assertEqual(result.dot.count("subgraph cluster_server"), 2)
+
+    def testAroundNetworkHops(self):
+        for hops in range(4):
+            self.assertEdgesDeclared(self.convert(heat2dot.QUERY_AROUND, "net0", hops+1).dot)
+
+    def testAroundPort(self):
+        result = self.convert(heat2dot.QUERY_AROUND, "port1_1_0")
+        self.assertEdgesDeclared(result.dot)
+        self.assertEqual([server.key for server in result.graph.servers], ["server1_1"])
+
+    def testReachable(self):
+        self.assertEdgesDeclared(self.convert(heat2dot.QUERY_REACHABLE, "net1").dot)
+
+    def testDetailLevels(self):
+        for detail in heat2dot.DETAIL_LEVELS:
+            if detail != heat2dot.DETAIL_BACKBONE:
+                self.assertEdgesDeclared(self.convert(heat2dot.QUERY_AROUND, "net0", detail=detail).dot)
+
+if __name__ == "__main__":
+    unittest.main()
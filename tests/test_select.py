@@ -0,0 +1,65 @@
+# Selective parsing builds the same template parts as a full parse
+
+import os
+import sys
+import json
+import unittest
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import heat2dot
+import heat2dot_bench
+import heat2dot_select
+
+ANCHORS = """
+heat_template_version: 2015-04-30
+resources:
+  net0:
+    type: OS::Neutron::Net
+    properties: &netprops
+      name: net0
+  net1:
+    type: OS::Neutron::Net
+    properties: *netprops
+  port:
+    type: OS::Neutron::Port
+    properties:
+      name: port
+      network: {get_resource: net1}
+"""
+
+def template():
+    template = heat2dot_bench.generateTemplate(100)
+    # parts the converter does not read
+    template["parameters"] = {"flavor": {"type": "string", "default": "m1.small", "description": "skipped"}}
+    template["outputs"] = {"ip": {"value": {"get_attr": ["server0_0", "first_address"]}}}
+    template["resources"]["server0_0"]["properties"]["user_data"] = "#!/bin/sh\necho \"{[ not parsed ]}\"\n"*20
+    template["resources"]["server0_0"]["metadata"] = {"nested": [1, 2, {"a": None}]}
+    return template
+
+class SelectTest(unittest.TestCase):
+    def testJson(self):
+        text = json.dumps(template())
+        expected = heat2dot_select.prune(json.loads(text), heat2dot.TEMPLATE_SELECTION)
+        self.assertEqual(heat2dot_select.loadJson(text, heat2dot.TEMPLATE_SELECTION), expected)
+
+    def testYaml(self):
+        text = yaml.safe_dump(template())
+        expected = heat2dot_select.prune(yaml.safe_load(text), heat2dot.TEMPLATE_SELECTION)
+        self.assertEqual(heat2dot_select.loadYaml(text, heat2dot.TEMPLATE_SELECTION), expected)
+
+    def testConvert(self):
+        for text in (json.dumps(template()), yaml.safe_dump(template())):
+            self.assertEqual(heat2dot.convert(text, selective=True).dot, heat2dot.convert(text, selective=False).dot)
+
+    def testAnchorFallback(self):
+        with self.assertRaises(heat2dot_select.SelectionError):
+            heat2dot_select.loadYaml(ANCHORS, heat2dot.TEMPLATE_SELECTION)
+        result = heat2dot.convert(ANCHORS, selective=True)
+        self.assertTrue(result.success, result.messageText())
+        self.assertEqual(result.dot, heat2dot.convert(ANCHORS, selective=False).dot)
+        self.assertEqual(len(result.graph.nets), 2)
+
+if __name__ == "__main__":
+    unittest.main()